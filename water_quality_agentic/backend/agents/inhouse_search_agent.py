@@ -1,107 +1,240 @@
 # backend/agents/inhouse_search_agent.py
-# InHouseSearch Agent：本地水质语料检索（升级版）
-# InHouseSearch Agent: smarter keyword-based routing over local water-quality corpus
+# InHouseSearch Agent：本地水质语料检索（持久化 BM25 段落索引 + 关键词路由回退）
+# InHouseSearch Agent: persistent BM25 passage index with keyword-routing fallback
 
-from pathlib import Path
+import os
+import threading
+
+from backend.retrieval.corpus_index import CorpusIndex
+from backend.retrieval.measurements import YEAR_RE, find_parameters, limit_status
+from backend.retrieval.passages import LANGUAGES, format_passage, query_language, select_language
+from backend.retrieval.topic_router import get_router
+
+# 文档 key -> 展示用标题 / document key -> display label
+DOC_LABELS = {
+    "who": "WHO Drinking Water Guidelines",
+    "ontario": "Ontario Lake 2025 Report",
+    "heavy": "WHO Heavy Metal Guidelines",
+    "phosphorus": "Phosphorus & Nutrient Notes",
+    "groundwater": "Rural Groundwater Notes",
+    "microbial": "Microbial & E. coli Notes",
+    "ecosystem": "Ecosystem Health Notes",
+    "background": "General Background",
+}
+
+# 已知文件 -> 文档 key；其它文件按文件名自动生成 key 和标题
+# Known files -> document key; any other file gets a key/label from its name
+DOC_FILES = {
+    "who_water_guidelines.txt": "who",
+    "ontario_lake_report_2025.txt": "ontario",
+    "heavy_metal_guidelines.txt": "heavy",
+    "phosphorus_nutrients_notes.txt": "phosphorus",
+    "groundwater_quality_notes.txt": "groundwater",
+    "microbial_ecoli_notes.txt": "microbial",
+    "ecosystem_health_notes.txt": "ecosystem",
+    "general_background.txt": "background",
+}
+
+# 后台检查语料目录的间隔（秒），见 CorpusWatcher / how often CorpusWatcher re-checks the corpus
+REINDEX_INTERVAL_S = float(os.getenv("CORPUS_REINDEX_INTERVAL_S", "60"))
+
+# 证据语言："auto"（跟随查询语言）/ "en" / "zh" / "both"（中英都发，旧行为）
+# Evidence language: "auto" follows the query, "en" / "zh" force one, "both" sends every line
+CORPUS_LANGUAGE = os.getenv("CORPUS_LANGUAGE", "auto")
 
 
 class InHouseSearchAgent:
-    def __init__(self):
+    def __init__(self, mode: str = "bm25", top_k: int = 6, index: CorpusIndex = None,
+                 language: str = CORPUS_LANGUAGE):
+        """
+        初始化本地语料索引。
+        data/inhouse_corpus/ 下的所有 .txt / .md 文件（含子目录）都会被索引；
+        索引保存在 data/corpus_index.db，启动时只重新处理新增或修改过的文件。
+        DOC_FILES 中的文件使用固定的 key（who / ontario / ...），供关键词路由使用。
+
+        mode: "bm25"（段落级检索，默认）或 "keyword"（旧的整篇文档路由）
+        mode: "bm25" (passage retrieval, default) or "keyword" (legacy whole-file routing)
+        language: 段落只输出一种语言（见 CORPUS_LANGUAGE），另一种保留在 text_en / text_zh
+        language: emit passages in one language; the other stays in text_en / text_zh
+        Every file under data/inhouse_corpus/ is indexed into the shared on-disk
+        index; construction only re-processes new or changed files. Later
+        changes are picked up by CorpusWatcher, never on the query path.
+        """
+        self.mode = mode
+        self.top_k = top_k
+        self.language = language
+        self.index = index or CorpusIndex(
+            doc_keys={name: (key, DOC_LABELS[key]) for name, key in DOC_FILES.items()}
+        )
+        self.last_sync = self.index.sync()
+        self._docs = None
+
+    @property
+    def docs(self) -> dict:
+        """
+        doc_key -> 全文，只在关键词路由时按需读取。
+        Full document texts, read lazily for keyword routing only.
+        """
+        if self._docs is None:
+            self._docs = {
+                key: path.read_text(encoding="utf-8")
+                for key, path in self.index.documents().items()
+                if path.exists()
+            }
+        return self._docs
+
+    def check_corpus(self, sync: bool = True) -> bool:
         """
-        初始化本地语料库。
-        必选文件：
-          - who_water_guidelines.txt
-          - ontario_lake_report_2025.txt
-
-        可选文件（建议你后面逐步补充）：
-          - heavy_metal_guidelines.txt
-          - phosphorus_nutrients_notes.txt
-          - groundwater_quality_notes.txt
-          - microbial_ecoli_notes.txt
-          - ecosystem_health_notes.txt
-          - general_background.txt
-        如果某个文件不存在，不会报错，只是对应的内容不会被加载。
+        由 CorpusWatcher 在后台调用：sync=True 扫描语料目录并增量重建索引；
+        sync=False 只读，重新读取其它进程 sync 之后的统计。返回语料是否有变化。
+        Called off the query path by CorpusWatcher. sync=True rescans the
+        corpus directory; sync=False only re-reads what another process synced.
         """
-        base = Path(__file__).resolve().parents[2] / "data" / "inhouse_corpus"
+        if sync:
+            self.last_sync = self.index.sync()
+            changed = any(self.last_sync[k] for k in ("added", "updated", "removed"))
+        else:
+            changed = self.index.refresh()
+        if changed:
+            self._docs = None
+        return changed
 
-        self.docs = {}
+    def search_passages(self, query: str, top_k: int = None, language: str = None) -> list:
+        """
+        BM25 检索，返回按得分排序的段落（附带 score 字段）。
+        选定单一语言时，另一种语言的纯文本段落换成它的配对译文，
+        中英混排段落只保留该语言的行。
+        Rank passages with BM25; returns passage dicts with a "score" field.
+        In single-language mode, other-language passages are swapped for their
+        paired translation and mixed passages keep only that language's lines.
+        """
+        top_k = top_k or self.top_k
+        language = language or self.language
+        if language == "auto":
+            language = query_language(query)
+        if language not in LANGUAGES:
+            hits = self.index.search(query, top_k)
+            passages = self.index.get_passages([doc_id for doc_id, _ in hits])
+            return [dict(p, score=score) for p, (_, score) in zip(passages, hits)]
 
-        def safe_load(key: str, filename: str):
-            path = base / filename
-            if path.exists():
-                self.docs[key] = path.read_text(encoding="utf-8")
+        # 中英两份往往同时命中，多取一倍候选，换成译文去重后再截断
+        # Both translations often hit, so over-fetch, swap and dedupe, then trim
+        hits = self.index.search(query, top_k * 2)
+        passages = self.index.get_passages([doc_id for doc_id, _ in hits])
+        swap_ids = [p["pair_id"] for p in passages
+                    if p["lang"] not in (language, "mixed") and p["pair_id"]]
+        translations = {p["id"]: p for p in self.index.get_passages(swap_ids)}
+        results, seen = [], set()
+        for p, (_, score) in zip(passages, hits):
+            if p["lang"] not in (language, "mixed"):
+                p = translations.get(p["pair_id"], p)
+            if p["id"] in seen:
+                continue
+            seen.add(p["id"])
+            results.append(dict(select_language(p, language), score=score))
+            if len(results) == top_k:
+                break
+        return results
 
-        # --- 必备基础文档 ---
-        safe_load("who", "who_water_guidelines.txt")
-        safe_load("ontario", "ontario_lake_report_2025.txt")
+    def check_limits(self, query: str) -> list:
+        """
+        确定性的“是否超标”判断：查询中每个参数的监测值与指南限值比较。
+        地点 / 年份按查询过滤，没有数据时逐级放宽；没有监测值时只返回限值本身。
+        每行是测量值 dict 加 "status"（within / exceeds ...）。
+        Deterministic "within limits?" check for every parameter named in the
+        query. Location and year filters are relaxed when they match nothing;
+        with no observations the guideline itself is returned.
+        """
+        q = query.lower()
+        location = next((loc for loc in self.index.locations() if loc.lower() in q), None)
+        year = (YEAR_RE.findall(query) or [None])[0]
+        rows = []
+        for parameter in find_parameters(query):
+            found = []
+            for loc, yr in ((location, year), (location, None), (None, None)):
+                found = self.index.lookup_measurements(parameter, location=loc, year=yr)
+                if found:
+                    break
+            for row in found:
+                if row["guideline_value"] is None:
+                    guideline = self.index.guideline_for(parameter, row["unit"])
+                    if guideline is not None:
+                        row["guideline_value"] = guideline["guideline_value"]
+                        row["guideline_source"] = guideline["guideline_source"]
+                row["status"] = limit_status(row["value"], row["guideline_value"])
+                rows.append(row)
+            if not found:
+                guideline = self.index.guideline_for(parameter, "mg/L") or next(
+                    iter(self.index.lookup_measurements(parameter, kind="guideline")), None
+                )
+                if guideline is not None:
+                    rows.append(dict(guideline, status="guideline only"))
+        return rows
 
-        # --- 建议增加的扩展语料 ---
-        safe_load("heavy", "heavy_metal_guidelines.txt")
-        safe_load("phosphorus", "phosphorus_nutrients_notes.txt")
-        safe_load("groundwater", "groundwater_quality_notes.txt")
-        safe_load("microbial", "microbial_ecoli_notes.txt")
-        safe_load("ecosystem", "ecosystem_health_notes.txt")
-        safe_load("background", "general_background.txt")
+    def search(self, query: str, top_k: int = None) -> str:
+        """
+        默认使用 BM25 返回 top-k 段落；mode="keyword" 或无命中时回退到旧的关键词路由。
+        BM25 top-k passages by default; falls back to keyword routing when
+        mode="keyword" or when no passage matches the query.
+        """
+        if self.mode == "bm25":
+            hits = self.search_passages(query, top_k)
+            if hits:
+                return "\n\n".join(format_passage(p) for p in hits)
+        return self._keyword_search(query)
 
-    def search(self, query: str) -> str:
+    def _keyword_search(self, query: str) -> str:
         """
         非向量检索的简化版：根据关键词和主题，拼接合适的文档内容。
         Simple keyword-based routing: choose relevant internal docs based on query text.
         """
-        q = query.lower()
+        router = get_router()
+        topics = set(router.names(query, "topic"))
+        signals = set(router.names(query, "signal"))
         chunks = []
+        added = set()
+
+        def add(doc: str) -> bool:
+            """加入一篇文档（不存在或已加入时返回 False）/ Add a doc once; False if absent."""
+            if doc not in self.docs:
+                return False
+            if doc not in added:
+                added.add(doc)
+                chunks.append(f"【{DOC_LABELS[doc]}】\n{self.docs[doc]}")
+            return True
 
         # --- 1) Nitrate / nutrients 相关 ---
-        if any(k in q for k in ["nitrate", "no3", "nitrogen", "nutrient", "fertilizer", "肥料", "营养盐"]):
-            if "who" in self.docs:
-                chunks.append("【WHO Drinking Water Guidelines】\n" + self.docs["who"])
-            if "ontario" in self.docs:
-                chunks.append("【Ontario Lake 2025 Report】\n" + self.docs["ontario"])
-
-        # --- 2) 磷 / Phosphorus 相关 ---
-        if any(k in q for k in ["phosphorus", "phosphate", "磷"]):
-            if "phosphorus" in self.docs:
-                chunks.append("【Phosphorus & Nutrient Notes】\n" + self.docs["phosphorus"])
-            # 没有专门的磷文件时，可以至少给安大略报告
-            elif "ontario" in self.docs and "【Ontario Lake 2025 Report】" not in "".join(chunks):
-                chunks.append("【Ontario Lake 2025 Report】\n" + self.docs["ontario"])
-
-        # --- 3) 重金属 / Heavy metals 相关（cadmium, arsenic, lead, mercury）---
-        if any(k in q for k in ["cadmium", "arsenic", "lead", "mercury", "heavy metal", "重金属", "镉", "砷", "铅"]):
-            if "heavy" in self.docs:
-                chunks.append("【WHO Heavy Metal Guidelines】\n" + self.docs["heavy"])
-            # 如果没有单独 heavy 文件，至少给 WHO 总指南
-            elif "who" in self.docs and "【WHO Drinking Water Guidelines】" not in "".join(chunks):
-                chunks.append("【WHO Drinking Water Guidelines】\n" + self.docs["who"])
+        if topics & {"nitrate", "nutrients"}:
+            add("who")
+            add("ontario")
+
+        # --- 2) 磷 / Phosphorus 相关；没有专门的磷文件时，至少给安大略报告 ---
+        if "phosphorus" in topics:
+            add("phosphorus") or add("ontario")
+
+        # --- 3) 重金属 / Heavy metals；没有单独 heavy 文件时，至少给 WHO 总指南 ---
+        if "heavy_metals" in topics:
+            add("heavy") or add("who")
 
         # --- 4) 地下水 / 农村水井 Groundwater / wells ---
-        if any(k in q for k in ["groundwater", "well", "rural well", "地下水", "水井", "农村"]):
-            if "groundwater" in self.docs:
-                chunks.append("【Rural Groundwater Notes】\n" + self.docs["groundwater"])
-
-        # --- 5) 微生物 / E.coli 等 ---
-        if any(k in q for k in ["e. coli", "ecoli", "bacteria", "microbial", "大肠杆菌", "细菌"]):
-            if "microbial" in self.docs:
-                chunks.append("【Microbial & E. coli Notes】\n" + self.docs["microbial"])
-            # 安大略报告里通常也包含微生物监测
-            elif "ontario" in self.docs and "【Ontario Lake 2025 Report】" not in "".join(chunks):
-                chunks.append("【Ontario Lake 2025 Report】\n" + self.docs["ontario"])
+        if "groundwater" in topics:
+            add("groundwater")
+
+        # --- 5) 微生物 / E.coli 等；安大略报告里通常也包含微生物监测 ---
+        if "microbial" in topics:
+            add("microbial") or add("ontario")
 
         # --- 6) 生态健康 / ecosystem health ---
-        if any(k in q for k in ["ecosystem health", "生态健康", "fish", "algae", "eutrophication", "富营养化"]):
-            if "ecosystem" in self.docs:
-                chunks.append("【Ecosystem Health Notes】\n" + self.docs["ecosystem"])
+        if "ecosystem_health" in topics:
+            add("ecosystem")
 
-        # --- 7) 如果出现 “Lake Ontario” 或 “Ontario” 但上面没触发 ---
-        if ("lake ontario" in q or "ontario" in q) and "ontario" in self.docs:
-            # 避免重复添加
-            if "【Ontario Lake 2025 Report】" not in "".join(chunks):
-                chunks.append("【Ontario Lake 2025 Report】\n" + self.docs["ontario"])
+        # --- 7) 如果出现 “Lake Ontario” 或 “Ontario” ---
+        if "ontario" in signals:
+            add("ontario")
 
         # --- 8) 如果出现 WHO / safe limit 等 ---
-        if any(k in q for k in ["who", "safe limit", "guideline", "标准", "指南"]):
-            if "who" in self.docs and "【WHO Drinking Water Guidelines】" not in "".join(chunks):
-                chunks.append("【WHO Drinking Water Guidelines】\n" + self.docs["who"])
+        if "guideline" in signals:
+            add("who")
 
         # --- 9) 如果上面都没命中，给一个通用背景 ---
         if not chunks:
@@ -113,4 +246,49 @@ class InHouseSearchAgent:
                     "and optional notes on heavy metals, groundwater, nutrients, and ecosystem health."
                 )
 
-        return "\n\n".join(chunks)
\ No newline at end of file
+        return "\n\n".join(chunks)
+
+class CorpusWatcher:
+    """
+    后台定期检查语料目录，用法与 WebPrefetcher 相同（start / stop / stats），
+    查询路径因此只读索引。多 worker 时只有一个进程 sync=True（扫描目录、写索引），
+    其它进程只重新读取共享索引的统计。
+    Re-checks the corpus every interval_s on a daemon thread so the query path
+    only reads the index. With several workers one process syncs (directory
+    scan plus write transaction); the others only refresh from the shared index.
+    """
+
+    def __init__(self, agent: InHouseSearchAgent, interval_s: float = REINDEX_INTERVAL_S,
+                 sync: bool = True):
+        self.agent = agent
+        self.interval_s = interval_s
+        self.sync = sync
+        self.counters = {"runs": 0, "changed": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> bool:
+        changed = self.agent.check_corpus(self.sync)
+        self.counters["runs"] += 1
+        self.counters["changed"] += int(changed)
+        return changed
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="corpus-watch", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                self.counters["errors"] += 1
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return dict(self.counters, running=self._thread is not None, sync=self.sync,
+                    last_sync=self.agent.last_sync)
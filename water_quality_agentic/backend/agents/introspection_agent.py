@@ -1,33 +1,296 @@
 # backend/agents/introspection_agent.py
-# Introspection Agent：简单质量评估 + 反思
-# Introspection Agent: simple quality scoring + reflection notes
+# Introspection Agent：质量评估 + 反思。反馈先入队（pending），后台 worker 批量调用 LLM 打分；
+# 也可以批量重评分历史 query_log（带进度，可断点续跑）。
+# Introspection Agent: quality scoring + reflection notes. Feedback is queued
+# as pending and scored in batches by a background worker (several answers
+# per LLM call); historical query_log rows can be re-scored in bulk with
+# progress reporting and resumable checkpoints.
+#
+# 用法 / usage (在 water_quality_agentic/ 目录下):
+#   python -m backend.agents.introspection_agent --pending
+#   python -m backend.agents.introspection_agent --rescore --run nightly
 
-from backend.db.local_db import log_reflection
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.db.local_db import (
+    claim_reflections, count_query_log, enqueue_reflection, get_evaluation_run, init_db,
+    query_log_page, reflection_status_counts, save_reflection_scores, save_rescore_page,
+)
+from backend.llm.client import MISTRAL_MODEL_NAME, get_llm_client
+
+# EVALUATOR=rule 时只用规则打分（不调用 LLM）/ EVALUATOR=rule skips the LLM judge
+EVALUATOR = os.getenv("EVALUATOR", "llm")
+# 每次 LLM 调用评估的答案数，以及同时在途的 LLM 调用数
+# Answers judged per LLM call, and LLM calls in flight at once
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "4"))
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "2"))
+# 判分时答案最多保留的字符数 / answers are truncated to this many characters for the judge
+MAX_ANSWER_CHARS = 1500
+
+
+def rule_score(query: str, answer: str, feedback: str) -> dict:
+    """
+    规则打分（原来的实现），LLM 不可用或没返回某条结果时兜底。
+    The original rule-based score; fallback when the LLM judge is unavailable.
+    """
+    score = 3  # 1-5 简单打分 / simple 1-5 score
+
+    notes = []
+    if "nitrate" in answer.lower():
+        notes.append("Covered nitrate levels.")
+    else:
+        notes.append("Did not explicitly mention nitrate.")
+
+    if "WHO" in answer:
+        notes.append("Included WHO guidelines.")
+    else:
+        notes.append("Should mention WHO safe limits next time.")
+
+    if feedback:
+        notes.append(f"User feedback: {feedback}")
+
+    return {"score": score, "notes": "; ".join(notes), "evaluator": "rule"}
 
 
 class IntrospectionAgent:
-    def __init__(self):
-        pass
+    def __init__(self, llm=None, evaluator: str = EVALUATOR, batch_size: int = EVAL_BATCH_SIZE,
+                 max_concurrency: int = EVAL_CONCURRENCY, poll_interval_s: float = 5.0):
+        """
+        llm: 共享的 LLMClient（延迟创建）/ shared LLMClient, created lazily
+        evaluator: "llm" 或 "rule"
+        """
+        self._llm = llm
+        self.evaluator = evaluator
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.poll_interval_s = poll_interval_s
+        self.counters = {"enqueued": 0, "scored": 0, "fallbacks": 0, "llm_batches": 0,
+                         "errors": 0}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="evaluator")
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_llm_client()
+        return self._llm
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+    # ---------- 入口：反馈入队 / entry point: enqueue feedback ----------
 
     def evaluate_and_log(self, query: str, answer: str, feedback: str):
         """
-        非真实 LLM，只做一个规则打分。
-        In real system, call a small LLM (e.g., Phi-mini) to evaluate.
+        只把反馈记为 pending 并唤醒后台 worker，不在请求线程里打分。
+        Enqueue the feedback as pending and wake the background worker;
+        scoring never runs on the caller's thread.
+        """
+        enqueue_reflection(query, answer, feedback)
+        self._count("enqueued")
+        self.start()
+        self._wake.set()
+
+    # ---------- 打分 / scoring ----------
+
+    @staticmethod
+    def _judge_messages(items: list) -> list:
+        system_prompt = """
+        You are a strict evaluator of answers from a water-quality research assistant.
+        For every item, score the answer from 1 (poor) to 5 (excellent) on factual grounding,
+        correct use of guideline limits (e.g. WHO), coverage of the question and clarity,
+        taking the user feedback into account when present.
+        Return ONLY a JSON array: [{"id": <item id>, "score": <1-5>, "notes": "<one sentence>"}].
+        """
+        payload = [
+            {"id": item["id"], "query": item["query"],
+             "answer": (item["answer"] or "")[:MAX_ANSWER_CHARS],
+             "feedback": item.get("feedback") or ""}
+            for item in items
+        ]
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+        ]
+
+    @staticmethod
+    def _parse_scores(raw: str) -> dict:
+        """解析 LLM 返回的 JSON 数组 -> {id: (score, notes)}，格式不对的条目丢弃。"""
+        text = raw.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("["):]
+        scores = {}
+        for entry in json.loads(text):
+            try:
+                score = min(5, max(1, int(entry["score"])))
+            except (KeyError, TypeError, ValueError):
+                continue
+            scores[str(entry.get("id"))] = (score, str(entry.get("notes", "")))
+        return scores
+
+    def score_batch(self, items: list) -> list:
+        """
+        一次 LLM 调用给多条答案打分；解析失败或缺失的条目用规则兜底。
+        items: [{"id", "query", "answer", "feedback"}, ...]
+        Score several answers in one LLM call, falling back to rule_score for
+        anything the judge did not return.
+        """
+        scores = {}
+        if self.evaluator == "llm":
+            try:
+                raw = self.llm.complete("evaluator", self._judge_messages(items),
+                                        model=MISTRAL_MODEL_NAME)
+                scores = self._parse_scores(raw)
+                self._count("llm_batches")
+            except Exception:
+                self._count("errors")
+
+        results = []
+        for item in items:
+            judged = scores.get(str(item["id"]))
+            if judged is not None:
+                result = {"score": judged[0], "notes": judged[1],
+                          "evaluator": f"llm:{MISTRAL_MODEL_NAME}"}
+            else:
+                result = rule_score(item["query"], item["answer"] or "", item.get("feedback"))
+                if self.evaluator == "llm":
+                    self._count("fallbacks")
+            results.append(dict(item, status="scored", **result))
+        self._count("scored", len(results))
+        return results
+
+    def _score_all(self, items: list) -> list:
+        """按 batch_size 分组，最多 max_concurrency 个 LLM 调用并行 / Batches, in parallel."""
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        results = []
+        for batch_results in self._executor.map(self.score_batch, batches):
+            results.extend(batch_results)
+        return results
+
+    # ---------- pending 反馈 / pending feedback ----------
+
+    def process_pending(self, limit: int = None) -> int:
+        """
+        认领并给 pending 的 reflection_log 行打分直到队列为空（或达到 limit），返回处理条数。
+        Claim and score pending reflection rows until none are left (or
+        `limit` is reached); other processes' workers never get the same rows.
+        """
+        processed = 0
+        page_size = self.batch_size * self.max_concurrency
+        while limit is None or processed < limit:
+            size = page_size if limit is None else min(page_size, limit - processed)
+            rows = claim_reflections(size)
+            if not rows:
+                break
+            items = [{"id": r[0], "query": r[1], "answer": r[2], "feedback": r[3]} for r in rows]
+            save_reflection_scores(self._score_all(items))
+            processed += len(items)
+        return processed
+
+    def start(self):
+        """启动后台 worker（只启动一次）/ Start the background worker once."""
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._run, name="evaluation-worker",
+                                            daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        # 启动时也处理上次进程留下的 pending 行 / also drains rows left by a previous process
+        while True:
+            try:
+                self.process_pending()
+            except Exception:
+                self._count("errors")
+            self._wake.wait(timeout=self.poll_interval_s)
+            self._wake.clear()
+
+    # ---------- 历史重评分 / bulk re-scoring ----------
+
+    def rescore_history(self, run_name: str = "default", limit: int = None,
+                        restart: bool = False, progress=None) -> dict:
+        """
+        按 id 顺序重评分 query_log 中的历史答案，结果写入 reflection_log（带 query_log_id）。
+        每页结果和断点一起提交；同名 run 再次运行时从断点继续（已完成的 run 只处理新行），
+        restart=True 从头开始。progress(done, total) 在每页之后回调。
+        Re-score historical query_log answers in id order. Each page is
+        committed together with the run checkpoint, so re-running the same
+        run resumes where it stopped (a finished run only picks up newer
+        rows); restart=True starts over.
         """
-        score = 3  # 1-5 简单打分 / simple 1-5 score
+        run = get_evaluation_run(run_name)
+        if restart:
+            run.update(last_query_log_id=0, done=0)
+        run["total"] = run["done"] + count_query_log(run["last_query_log_id"])
+        if limit is not None:
+            run["total"] = min(run["total"], run["done"] + limit)
+        run["status"] = "running"
+
+        start = time.perf_counter()
+        scored = 0
+        page_size = self.batch_size * self.max_concurrency
+        while run["done"] < run["total"]:
+            rows = query_log_page(run["last_query_log_id"],
+                                  min(page_size, run["total"] - run["done"]))
+            if not rows:
+                break
+            items = [{"id": r[0], "query": r[1], "answer": r[2], "feedback": ""} for r in rows]
+            results = self._score_all(items)
+            run["last_query_log_id"] = rows[-1][0]
+            run["done"] += len(rows)
+            scored += len(rows)
+            save_rescore_page(run, results)
+            if progress is not None:
+                progress(run["done"], run["total"])
+        # limit 用完但还有剩余行时标记为 paused / "paused" when --limit stopped the run early
+        run["status"] = "done" if count_query_log(run["last_query_log_id"]) == 0 else "paused"
+        save_rescore_page(run, [])
+
+        return dict(run, scored_this_run=scored, wall_s=round(time.perf_counter() - start, 3))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, evaluator=self.evaluator,
+                        worker_running=self._worker is not None)
+
 
-        notes = []
-        if "nitrate" in answer.lower():
-            notes.append("Covered nitrate levels.")
-        else:
-            notes.append("Did not explicitly mention nitrate.")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score pending feedback or re-score history.")
+    parser.add_argument("--pending", action="store_true", help="score pending feedback rows")
+    parser.add_argument("--rescore", action="store_true", help="re-score query_log answers")
+    parser.add_argument("--run", default="default", help="re-scoring run name (checkpoint key)")
+    parser.add_argument("--limit", type=int, help="maximum rows to score in this invocation")
+    parser.add_argument("--restart", action="store_true", help="ignore the run checkpoint")
+    args = parser.parse_args(argv)
+    if not (args.pending or args.rescore):
+        parser.error("choose --pending and/or --rescore")
 
-        if "WHO" in answer:
-            notes.append("Included WHO guidelines.")
-        else:
-            notes.append("Should mention WHO safe limits next time.")
+    init_db()
+    agent = IntrospectionAgent()
+    if args.pending:
+        print(f"pending scored: {agent.process_pending(args.limit)}")
+    if args.rescore:
+        report = agent.rescore_history(
+            args.run, limit=args.limit, restart=args.restart,
+            progress=lambda done, total: print(f"  {done}/{total}", file=sys.stderr),
+        )
+        print(json.dumps(report, indent=2))
+    print(json.dumps({"reflections": reflection_status_counts(), "agent": agent.stats()},
+                     indent=2))
+    return 0
 
-        if feedback:
-            notes.append(f"User feedback: {feedback}")
 
-        log_reflection(query, answer, feedback, score, "; ".join(notes))
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# backend/agents/plan_batcher.py
+# 规划微批处理：短时间窗口内到达的 LLM 规划请求合并成一次 LLM 调用
+# Planner micro-batching: LLM planning requests that arrive within a short
+# window are sent as one LLM call returning a JSON array of plans keyed by id
+
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# PLAN_BATCH=0 时每个请求单独调用 LLM 规划 / PLAN_BATCH=0 plans every request on its own
+PLAN_BATCH = os.getenv("PLAN_BATCH", "1") == "1"
+# 第一个请求到达后最多等待多久（毫秒）收集同批请求，以及每批最多几个请求
+# How long (ms) to collect after the first request arrives, and the batch size cap
+PLAN_BATCH_WINDOW_MS = float(os.getenv("PLAN_BATCH_WINDOW_MS", "10"))
+PLAN_BATCH_MAX = int(os.getenv("PLAN_BATCH_MAX", "8"))
+
+
+class PlanBatcher:
+    """
+    - plan(query, timeout)：阻塞直到拿到该查询的规划，超过 timeout 秒抛 TimeoutError
+    - plan_batch([(request_id, query), ...]) -> {request_id: plan}：一次 LLM 调用规划一批，
+      返回不是合法 JSON 数组时抛异常
+    - plan_one(query) -> plan：单独规划（只有一个请求，或批量结果解析失败 / 缺少某个 id 时）
+    A daemon thread takes the first waiting request, collects more for up to
+    window_s (or until max_batch), and hands the batch to a small pool so the
+    next window opens while the LLM call is in flight. Requests the batch
+    reply does not cover fall back to individual plan_one calls. A request
+    whose caller timed out before its batch was dispatched is dropped.
+    """
+
+    def __init__(self, plan_batch, plan_one, window_s: float = PLAN_BATCH_WINDOW_MS / 1000,
+                 max_batch: int = PLAN_BATCH_MAX, max_in_flight: int = 4):
+        self._plan_batch = plan_batch
+        self._plan_one = plan_one
+        self.window_s = window_s
+        self.max_batch = max(1, max_batch)
+        self.counters = {"requests": 0, "llm_calls": 0, "batches": 0, "batched_requests": 0,
+                         "fallbacks": 0, "batch_errors": 0, "timeouts": 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                            thread_name_prefix="plan-batch")
+        self._thread = threading.Thread(target=self._run, name="plan-batcher", daemon=True)
+        self._thread.start()
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+    def plan(self, query: str, timeout: float = None) -> dict:
+        """
+        提交一个规划请求并等待结果；timeout 秒内没有结果时抛 TimeoutError
+        （调用方改用规则规划），还没发出的请求随之取消。
+        Enqueue one planning request and wait for it, at most `timeout`
+        seconds (None waits forever). On timeout the request is cancelled if
+        its batch has not been dispatched yet and TimeoutError is raised so
+        the caller can fall back to the rule plan.
+        """
+        future = Future()
+        self._queue.put((f"q{next(self._ids)}", query, future))
+        self._count("requests")
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            self._count("timeouts")
+            future.cancel()
+            raise
+
+    # ---------- 后台收集 / background collection ----------
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: list):
+        # 等待方已超时放弃的请求不再规划 / skip requests whose caller already gave up
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        if len(batch) == 1:
+            self._single(*batch[0])
+            return
+        plans = {}
+        try:
+            self._count("llm_calls")
+            plans = self._plan_batch([(request_id, query) for request_id, query, _ in batch])
+            self._count("batches")
+        except Exception:
+            self._count("batch_errors")
+        for request_id, query, future in batch:
+            plan = plans.get(request_id)
+            if plan is None:
+                # 批量结果里没有这个请求：单独规划，不阻塞其它请求
+                # not covered by the batch reply: plan it on its own without holding up the rest
+                self._count("fallbacks")
+                self._executor.submit(self._single, request_id, query, future)
+            else:
+                self._count("batched_requests")
+                future.set_result(dict(plan, batch_size=len(batch)))
+
+    def _single(self, request_id: str, query: str, future: Future):
+        self._count("llm_calls")
+        try:
+            future.set_result(self._plan_one(query))
+        except Exception as exc:
+            future.set_exception(exc)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["waiting"] = self._queue.qsize()
+        stats["requests_per_llm_call"] = (
+            round(stats["requests"] / stats["llm_calls"], 2) if stats["llm_calls"] else None
+        )
+        return stats
@@ -2,50 +2,36 @@
 # Planner Agent：使用 Mistral LLM 做任务规划，并协调其它 Agent
 # Planner Agent: uses Mistral LLM to plan tasks and orchestrate agents
 
-import os
 import json
-from mistralai import Mistral
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 
 from backend.agents.inhouse_search_agent import InHouseSearchAgent
+from backend.agents.plan_batcher import PLAN_BATCH, PlanBatcher
 from backend.agents.webscraper_agent import WebScraperAgent
-from backend.agents.summarizer_agent import SummarizerAgent
+from backend.agents.summarizer_agent import SummarizerAgent, stream_merge_sections
+from backend.agents.rule_planner import (
+    CONFIDENCE_THRESHOLD, classify, decompose, rule_need_web,
+)
+from backend.budget import SHRUNK_CONTEXT_RATIO, LatencyBudget
+from backend.db.web_cache import web_key
+from backend.llm.client import DeadlineExceeded, call_deadline, deadline_left, get_llm_client
+from backend.retrieval.context_packer import ContextPacker, DEFAULT_BUDGET_TOKENS
+from backend.retrieval.measurements import format_measurement_table
+from backend.tracing import Trace
 
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "your key")
 MISTRAL_MODEL_NAME = "mistral-small-latest"
 
+# 涉及多个污染物的查询拆成单污染物子计划并行执行（DECOMPOSE_MIXED=0 关闭）
+# Split multi-pollutant queries into per-pollutant sub-plans (DECOMPOSE_MIXED=0 disables)
+DECOMPOSE_MIXED = os.getenv("DECOMPOSE_MIXED", "1") == "1"
 
-class PlannerAgent:
-    """
-    新版 Planner：
-    - 使用 Mistral LLM 对 query 做 task planning（主题/关注点/是否需要 web）
-    - 再调用 InHouseSearch + WebScraper + Summarizer
-    - 返回 answer 和 debug 信息（供前端展示）
-    """
-
-    def __init__(self):
-        if not MISTRAL_API_KEY or MISTRAL_API_KEY == "YOUR_MISTRAL_KEY_HERE":
-            raise ValueError(
-                "MISTRAL_API_KEY is not set. Please export it in your environment."
-            )
-        self.llm = Mistral(api_key=MISTRAL_API_KEY)
-        self.inhouse_agent = InHouseSearchAgent()
-        self.web_agent = WebScraperAgent()
-        self.summarizer = SummarizerAgent()
-
-    # ---------- LLM 规划函数 ----------
-
-    def _llm_plan(self, query: str) -> dict:
-        """
-        使用 LLM 分析用户问题，输出 JSON 格式的规划:
-        {
-          "topic": "nitrate" | "heavy_metal" | "microbial" | "general",
-          "focus": "causes" | "mitigation" | "assessment",
-          "need_web": true/false
-        }
-        """
-
-        
-        plan_prompt = f"""
+# LLM 规划 prompt 的分类规则（单个查询和批量共用）
+# Classification rules of the LLM planning prompt, shared by single and batched calls
+PLANNER_RULES = """
         You are an Agentic AI Planner for a Water Pollution & Water Quality Intelligence System.
 
         Your task is to analyze the user query and produce a structured JSON plan with:
@@ -112,89 +98,672 @@ class PlannerAgent:
         - Return JSON only. Absolutely no explanation.
 
         ========================================
-        User query:
+"""
+
+# 批量规划：同样的规则，一次返回多个查询的规划
+# Batched planning: the same rules, one plan per request in a JSON array
+PLANNER_BATCH_SUFFIX = """        ### BATCH MODE
+        You will receive several user queries as a JSON array of {"id", "query"} objects.
+        Plan each query independently and return ONLY a JSON array with one object per query:
+        [{"id": "<request id>", "topic": "...", "focus": "...", "need_web": true/false}]
+
+        ========================================
+        Requests (JSON):
+"""
+
+
+class PlannerAgent:
+    """
+    新版 Planner：
+    - 先用规则分类器规划；置信度不足（多主题 / 无关键词）时才调用 Mistral LLM
+    - 再调用 InHouseSearch + WebScraper + Summarizer
+    - 在 Summarizer 之前用 ContextPacker 把证据压缩到 token 预算以内
+    - 返回 answer 和 debug 信息（供前端展示）
+    """
+
+    # 候选段落数：多取一些，再交给 ContextPacker 按预算筛选
+    # Candidate passages fetched before packing into the token budget
+    RETRIEVAL_CANDIDATES = 12
+    # 单语言段落只有一半的行，同样的证据只需一半候选
+    # Single-language passages carry half the lines, so half as many cover the same evidence
+    SINGLE_LANGUAGE_CANDIDATES = 6
+    # assessment 问题有测量表时，只附带这么多条原文段落作为背景
+    # Raw passages kept next to the measurement table for assessment questions
+    ASSESSMENT_CONTEXT_PASSAGES = 2
+    # 最多拆成几个子计划 / at most this many sub-plans per query
+    MAX_SUB_PLANS = 4
+
+    def __init__(
+        self,
+        context_budget_tokens: int = DEFAULT_BUDGET_TOKENS,
+        concurrent: bool = False,
+        rule_fast_path: bool = True,
+        llm=None,
+        decompose: bool = DECOMPOSE_MIXED,
+        plan_batch: bool = PLAN_BATCH,
+    ):
+        """
+        context_budget_tokens: Summarizer 上下文的 token 预算
+        concurrent: True 时规划、内部检索、web 获取并行执行
+        concurrent: overlap planning, in-house search and web fetch in a thread pool
+        rule_fast_path: 规则分类器足够自信时跳过 LLM 规划
+        rule_fast_path: skip the LLM planning call when the rule classifier is confident
+        llm: 所有 Agent 共用的 LLMClient / LLMClient shared by every agent
+        decompose: 多污染物查询拆成子计划，每个子计划有自己的小上下文，最后合并
+        decompose: run multi-pollutant queries as per-pollutant sub-plans, each
+                   with its own small context, and merge their findings
+        plan_batch: 并发请求的 LLM 规划合并成批量调用（PlanBatcher）
+        plan_batch: coalesce concurrent LLM planning calls into batched calls
+        """
+        # LLM 客户端和各子 Agent 在第一次使用时才创建（读语料 / 建连接都比较慢）
+        # The LLM client and sub-agents are built on first use (corpus load, HTTP setup)
+        self._init_lock = threading.RLock()
+        self._llm = llm
+        self._inhouse_agent = None
+        self._web_agent = None
+        self._summarizer = None
+        self._plan_batcher = None
+        self.packer = ContextPacker(budget_tokens=context_budget_tokens)
+        self.concurrent = concurrent
+        self.rule_fast_path = rule_fast_path
+        self.decompose = decompose
+        self.plan_batch = plan_batch
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="planner-stage")
+        # 子计划单独一个线程池：子计划内部还会向 _executor 提交 web 获取，避免互相占满
+        # Sub-plans get their own pool: they submit web fetches to _executor and
+        # must not starve it
+        self._sub_executor = ThreadPoolExecutor(max_workers=self.MAX_SUB_PLANS,
+                                                thread_name_prefix="planner-sub-plan")
+
+    # ---------- 延迟初始化 ----------
+
+    def _lazy(self, attr: str, factory):
+        """线程安全的延迟创建（双重检查）/ Thread-safe lazy construction (double-checked)."""
+        value = getattr(self, attr)
+        if value is None:
+            with self._init_lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = factory()
+                    setattr(self, attr, value)
+        return value
+
+    @property
+    def llm(self):
+        return self._lazy("_llm", get_llm_client)
+
+    @property
+    def inhouse_agent(self) -> InHouseSearchAgent:
+        return self._lazy("_inhouse_agent", InHouseSearchAgent)
+
+    @property
+    def web_agent(self) -> WebScraperAgent:
+        return self._lazy("_web_agent", lambda: WebScraperAgent(llm=self.llm))
+
+    @property
+    def summarizer(self) -> SummarizerAgent:
+        return self._lazy("_summarizer", lambda: SummarizerAgent(llm=self.llm))
+
+    @property
+    def plan_batcher(self) -> PlanBatcher:
+        return self._lazy("_plan_batcher", lambda: PlanBatcher(self._llm_plan_batch, self._llm_plan))
+
+    def warm_up(self):
+        """
+        立即创建所有延迟对象（读语料、建索引、创建 LLM 客户端）。
+        Build every lazy component now instead of on the first query.
+        """
+        for attr in ("llm", "inhouse_agent", "web_agent", "summarizer"):
+            getattr(self, attr)
+
+    # ---------- 规划函数 ----------
+
+    def _plan(self, query: str) -> dict:
+        """
+        两级规划：
+        1) 规则分类器，置信度 >= CONFIDENCE_THRESHOLD 时直接采用（planner_path="rules"）
+        2) 否则调用 LLM 规划（planner_path="llm"，JSON 解析失败时为 "llm_fallback_rules"）；
+           plan_batch 开启时经 PlanBatcher 与其它并发请求合批（planner_path="llm_batch"）
+        Rule classifier first; escalate to the LLM only for ambiguous queries,
+        batched with concurrent requests when plan_batch is on. The wait for
+        a batched plan is bounded by the plan stage's call_deadline(); missing
+        it raises DeadlineExceeded, which the caller turns into the rule plan.
+        plan["planner_path"] records which path produced the plan.
+        """
+        rule_plan = classify(query)
+        if self.rule_fast_path and rule_plan["confidence"] >= CONFIDENCE_THRESHOLD:
+            return self._rule_plan(rule_plan, "rules")
+        if self.plan_batch:
+            try:
+                plan = self.plan_batcher.plan(query, timeout=deadline_left())
+            except FutureTimeout as exc:
+                raise DeadlineExceeded("batched planner missed the plan deadline") from exc
+        else:
+            plan = self._llm_plan(query)
+        plan["rule_confidence"] = rule_plan["confidence"]
+        return plan
+
+    @staticmethod
+    def _rule_plan(rule_plan: dict, planner_path: str) -> dict:
+        return {
+            "topic": rule_plan["topic"],
+            "focus": rule_plan["focus"],
+            "need_web": rule_plan["need_web"],
+            "planner_path": planner_path,
+            "confidence": rule_plan["confidence"],
+        }
+
+    def _llm_plan(self, query: str) -> dict:
+        """
+        使用 LLM 分析用户问题，输出 JSON 格式的规划:
+        {
+          "topic": "nitrate" | "heavy_metals" | "microbial" | ... | "mixed" | "general",
+          "focus": "assessment" | "trend_analysis" | "comparison" | ... | "prediction",
+          "need_web": true/false
+        }
+        分类体系与 rule_planner 保持一致 / same taxonomy as rule_planner.
+        """
+        plan_prompt = PLANNER_RULES + f"""        User query:
         {query}
         """
 
-        resp = self.llm.chat.complete(
-            model=MISTRAL_MODEL_NAME,
-            messages=[{"role": "user", "content": plan_prompt}],
+        raw = self.llm.complete(
+            "planner", [{"role": "user", "content": plan_prompt}], model=MISTRAL_MODEL_NAME
         )
 
-        # raw = resp.choices[0].message["content"]
-        raw = resp.choices[0].message.content
-
         # 尝试解析 JSON，失败则回退为简单规则
         try:
-            plan = json.loads(raw)
-            # 保底：字段缺失时设置默认值
-            plan.setdefault("topic", "general")
-            plan.setdefault("focus", "assessment")
-            plan.setdefault("need_web", True)
-            return plan
+            return self._complete_plan(json.loads(raw), "llm")
         except Exception:
-            # fallback：简单 keyword 规则，避免 demo 挂掉
-            q = query.lower()
-            if "nitrate" in q or "nutrient" in q:
-                topic = "nitrate"
-            elif any(k in q for k in ["heavy metal", "lead", "cadmium", "mercury", "arsenic"]):
-                topic = "heavy_metal"
-            elif any(k in q for k in ["bacteria", "e. coli", "microbial", "pathogen"]):
-                topic = "microbial"
-            else:
-                topic = "general"
-
-            if any(k in q for k in ["risk factor", "cause", "source"]):
-                focus = "causes"
-            elif any(k in q for k in ["solution", "mitigation", "reduce", "control"]):
-                focus = "mitigation"
-            else:
-                focus = "assessment"
+            # fallback：规则分类器，避免 demo 挂掉
+            rule_plan = classify(query)
+            return {
+                "topic": rule_plan["topic"],
+                "focus": rule_plan["focus"],
+                "need_web": rule_plan["need_web"],
+                "planner_path": "llm_fallback_rules",
+            }
+
+    @staticmethod
+    def _complete_plan(plan: dict, planner_path: str) -> dict:
+        """保底：字段缺失时设置默认值 / Fill in defaults for missing fields."""
+        plan.setdefault("topic", "general")
+        plan.setdefault("focus", "assessment")
+        plan.setdefault("need_web", True)
+        plan["planner_path"] = planner_path
+        return plan
+
+    def _llm_plan_batch(self, requests: list) -> dict:
+        """
+        一次 LLM 调用规划多个查询：requests = [(request_id, query), ...]，
+        返回 {request_id: plan}。不是 JSON 数组时抛异常，由 PlanBatcher 逐个重试；
+        数组里缺失或格式不对的条目直接省略。
+        Plan several queries in one LLM call. Raises when the reply is not a
+        JSON array (PlanBatcher then plans each request on its own); malformed
+        or unknown entries are left out.
+        """
+        payload = [{"id": request_id, "query": query} for request_id, query in requests]
+        plan_prompt = PLANNER_RULES + PLANNER_BATCH_SUFFIX + json.dumps(payload, ensure_ascii=False)
+        raw = self.llm.complete(
+            "planner", [{"role": "user", "content": plan_prompt}], model=MISTRAL_MODEL_NAME
+        ).strip()
+        if raw.startswith("```"):
+            raw = raw.strip("`")
+            raw = raw[raw.find("["):]
+        entries = json.loads(raw)
+        if not isinstance(entries, list):
+            raise ValueError("batched planner reply is not a JSON array")
+        wanted = {request_id for request_id, _ in requests}
+        plans = {}
+        for entry in entries:
+            if isinstance(entry, dict) and str(entry.get("id")) in wanted:
+                request_id = str(entry.pop("id"))
+                plans[request_id] = self._complete_plan(entry, "llm_batch")
+        return plans
+
+    # ---------- 检索 ----------
+
+    def _retrieve(self, query: str) -> list:
+        """
+        取排序后的候选段落；BM25 无命中时把关键词路由结果作为单条证据。
+        Ranked candidate passages; keyword routing output is used as a single
+        evidence item when BM25 finds nothing.
+        """
+        agent = self.inhouse_agent
+        top_k = (self.RETRIEVAL_CANDIDATES if agent.language == "both"
+                 else self.SINGLE_LANGUAGE_CANDIDATES)
+        passages = agent.search_passages(query, top_k=top_k)
+        if not passages:
+            passages = [{"text": self.inhouse_agent.search(query), "score": 0.0}]
+        return passages
 
-            need_web = any(
-                kw in q for kw in ["2020", "2021", "2022", "2023", "2024", "2025", "latest", "current"]
-            )
+    # ---------- 外部调用接口 ----------
 
-            return {"topic": topic, "focus": focus, "need_web": need_web}
+    @staticmethod
+    def _timed(trace: Trace, stage: str, fn, *args):
+        """在一个 tracing span 内执行 fn / Run fn inside a tracing span."""
+        with trace.span(stage):
+            return fn(*args)
 
-    # ---------- 外部调用接口 ----------
+    @staticmethod
+    def _timed_until(trace: Trace, budget: LatencyBudget, deadline: str, stage: str, fn, *args):
+        """
+        在 span 内执行 fn，其中的 LLM 调用最多持续到 deadline 阶段截止；
+        超时的阶段因此会自行结束，让出 _executor 的线程。
+        Run fn inside a span with its LLM calls bounded by the `deadline`
+        stage's remaining time, so a stage nobody waits for any more ends on
+        its own and frees its _executor thread.
+        """
+        with call_deadline(budget.time_left(deadline)):
+            with trace.span(stage):
+                return fn(*args)
 
-    def handle_query(self, query: str):
+    def _await(self, future, budget: LatencyBudget, stage: str):
+        """
+        等待阶段结果，最多到该阶段的截止时间；超时返回 None（结果被丢弃）。
+        Wait for a stage until its deadline; None (result discarded) on timeout.
+        """
+        try:
+            return future.result(timeout=budget.time_left(stage))
+        except (FutureTimeout, DeadlineExceeded):
+            future.cancel()
+            return None
+
+    def _deadline_call(self, trace: Trace, budget: LatencyBudget, stage: str, fn, *args):
+        """顺序模式下带截止时间地执行一个阶段 / Run one stage with its deadline (sequential mode)."""
+        if not budget.enabled:
+            return self._timed(trace, stage, fn, *args)
+        return self._await(self._executor.submit(self._timed_until, trace, budget, stage, stage,
+                                                 fn, *args), budget, stage)
+
+    def handle_query(self, query: str, concurrent: bool = None, budget: LatencyBudget = None):
         """
         对前端暴露的主函数：
         - 调用 LLM 规划
         - 调用 InHouse / Web / Summarizer
         - 返回 (answer, debug_info)
+        concurrent 为 None 时使用构造函数里的设置。
+        budget：本次请求的延迟预算，默认 LATENCY_BUDGET_S；超过阶段截止时间时降级，
+        记录在 debug_info["degradations"]。
+        debug_info["timings"] 记录每个阶段的耗时（秒），
+        debug_info["spans"] 另含每个阶段的 LLM token 用量。
         """
-        plan = self._llm_plan(query)
+        debug_info, inhouse, web, trace = self._prepare(query, concurrent, budget)
 
+        # 4) Summarizer 生成最终答案（真实 LLM）；拆分查询时合并各子计划的结论
+        if "decomposition" in debug_info:
+            answer = self._timed(trace, "summarize", self.summarizer.merge,
+                                 query, inhouse, debug_info["plan"])
+        else:
+            answer = self._timed(
+                trace, "summarize", self.summarizer.summarize,
+                query, inhouse, web, debug_info["plan"],
+            )
+        self._finish(debug_info, answer, trace)
+        return answer, debug_info
+
+    def handle_query_stream(self, query: str, concurrent: bool = None,
+                            budget: LatencyBudget = None):
+        """
+        handle_query 的流式版本，生成器，依次产出事件：
+          {"event": "stage", "debug": debug_info}   规划 / 检索 / web / 打包完成
+          {"event": "token", "text": "..."}          Summarizer 的增量输出
+          {"event": "done", "answer": "...", "debug": debug_info}
+        debug_info["timings"]["first_token"] 记录首 token 延迟。
+        Streaming variant of handle_query(): yields a "stage" event once the
+        pre-summary stages finish, "token" events as the answer streams in,
+        and a final "done" event. Time-to-first-token is recorded in timings.
+        """
+        debug_info, inhouse, web, trace = self._prepare(query, concurrent, budget, stream=True)
+        yield {"event": "stage", "debug": debug_info}
+
+        if "decomposition" in debug_info and "text" not in inhouse[0]:
+            # 按小节合并：各污染物结论并行流式生成，小节写完即输出
+            # section merge: the per-pollutant findings stream concurrently, sections go out when final
+            chunks = self._stream_partials(query, inhouse, debug_info, trace)
+        elif "decomposition" in debug_info:
+            chunks = self.summarizer.merge_stream(query, inhouse, debug_info["plan"])
+        else:
+            chunks = self.summarizer.summarize_stream(query, inhouse, web, debug_info["plan"])
+        parts = []
+        with trace.span("summarize"):
+            for chunk in chunks:
+                if not parts:
+                    trace.timings["first_token"] = round(trace.elapsed(), 4)
+                parts.append(chunk)
+                yield {"event": "token", "text": chunk}
+
+        answer = "".join(parts)
+        self._finish(debug_info, answer, trace)
+        yield {"event": "done", "answer": answer, "debug": debug_info}
+
+    def _stream_partials(self, query: str, findings: list, debug_info: dict, trace: Trace):
+        """
+        并行流式生成各子计划的结论（findings 为已打包的上下文），经 stream_merge_sections
+        按小节合并输出。
+        Stream every sub-plan's finding concurrently from its packed context
+        and merge them section by section as they complete.
+        """
+        events = queue.Queue()
+        entries = {entry["label"]: entry for entry in debug_info["decomposition"]}
+        failures = []
+
+        def produce(index: int, finding: dict):
+            label, parts = finding["label"], []
+            try:
+                with trace.span(f"summarize:{label}"):
+                    for chunk in self.summarizer.summarize_partial_stream(
+                            query, label, finding["inhouse"], finding["web"], finding["plan"]):
+                        parts.append(chunk)
+                        events.put((index, chunk))
+            except Exception as exc:
+                entries[label]["error"] = f"{type(exc).__name__}: {exc}"
+                failures.append(label)
+            finally:
+                entries[label]["finding_preview"] = "".join(parts)[:200]
+                events.put((index, None))
+
+        for index, finding in enumerate(findings):
+            self._sub_executor.submit(produce, index, finding)
+
+        def drain():
+            remaining = len(findings)
+            while remaining:
+                index, chunk = events.get()
+                remaining -= chunk is None
+                yield index, chunk
+
+        yield from stream_merge_sections([f["label"] for f in findings], drain())
+        if len(failures) == len(findings):
+            raise RuntimeError("every sub-plan summary failed: " + entries[failures[0]]["error"])
+
+    def _prepare(self, query: str, concurrent: bool = None, budget: LatencyBudget = None,
+                 stream: bool = False):
+        """
+        Summarizer 之前的所有阶段：规划、内部检索、web、上下文打包。
+        降级顺序：规划超时 → 规则规划；web 超时 → 不用 web；剩余预算不足 → 缩小上下文。
+        多污染物查询（decompose）走 _run_decomposed，此时 inhouse 是各子计划的结论列表。
+        Everything before summarization; returns (debug_info, inhouse, web, trace).
+        Degradations: planner past its deadline -> rule plan; web fetch past
+        its deadline -> no web evidence; little budget left -> smaller context.
+        For decomposed queries inhouse is the list of sub-plan findings; with
+        stream=True and a section merge they are packed contexts instead, and
+        the findings are streamed by handle_query_stream().
+        """
+        if concurrent is None:
+            concurrent = self.concurrent
+        budget = budget if budget is not None else LatencyBudget()
+        trace = Trace()
         debug_info = {
-            "plan": plan,
+            "plan": {},
             "called_agents": [],
             "inhouse_preview": "",
             "web_preview": "",
+            "execution_mode": "concurrent" if concurrent else "sequential",
+            "timings": trace.timings,
+            "spans": trace.spans,
+            "latency_budget": budget.report(),
+            "degradations": budget.degradations,
         }
 
-        # 1) 内部检索
-        inhouse = self.inhouse_agent.search(query)
-        debug_info["called_agents"].append("InHouseSearchAgent")
-        debug_info["inhouse_preview"] = inhouse[:300]
-
-        # 2) 视情况决定是否查 Web
-        if plan.get("need_web", True):
-            web = self.web_agent.fetch(query)
-            debug_info["called_agents"].append("WebScraperAgent")
+        sub_plans = decompose(query, self.MAX_SUB_PLANS) if self.decompose else []
+        if sub_plans:
+            findings = self._run_decomposed(query, sub_plans, concurrent, debug_info, trace, budget,
+                                            defer_findings=stream)
+            if findings:
+                debug_info["inhouse_preview"] = "\n\n".join(
+                    f"[{f['label']}] {f.get('text', f.get('inhouse'))}" for f in findings)[:300]
+                return debug_info, findings, "", trace
+            # 所有子计划都失败：退回整体流水线 / every sub-plan failed: run the whole query
+            del debug_info["decomposition"]
+            budget.degrade("decompose", "whole_query", "every sub-plan failed")
+
+        if concurrent:
+            plan, passages, web = self._run_stages_concurrent(query, debug_info, trace, budget)
         else:
-            web = ""
+            plan, passages, web = self._run_stages_sequential(query, debug_info, trace, budget)
+        debug_info["plan"] = plan
+
+        # 2.5) assessment 问题：用确定性的限值比较表代替大段原文
+        if plan.get("focus") == "assessment":
+            passages = self._timed(
+                trace, "measurements", self._measurement_evidence, query, passages, debug_info
+            )
+
+        # 3) 按 token 预算打包上下文；剩余延迟预算不足时缩小上下文，让 Summarizer 更快
+        context_tokens = None
+        if budget.tight():
+            context_tokens = int(self.packer.budget_tokens * SHRUNK_CONTEXT_RATIO)
+            budget.degrade("pack", "shrink_context",
+                           f"{budget.remaining():.2f}s left; context capped at {context_tokens} tokens")
+        inhouse, web, debug_info["context_packing"] = self._timed(
+            trace, "pack", self.packer.pack, passages, web, context_tokens
+        )
+        debug_info["inhouse_preview"] = inhouse[:300]
         debug_info["web_preview"] = web[:300]
+        return debug_info, inhouse, web, trace
 
-        # 3) Summarizer 生成最终答案（真实 LLM）
-        answer = self.summarizer.summarize(
-            query=query,
-            inhouse_text=inhouse,
-            web_text=web,
-            plan=plan,
+    def _measurement_evidence(self, query: str, passages: list, debug_info: dict) -> list:
+        """
+        查结构化测量表；有结果时把表格作为最高分证据，只保留少量原文段落。
+        Put the limit-check table first and keep only a few raw passages.
+        """
+        rows = self.inhouse_agent.check_limits(query)
+        if not rows:
+            return passages
+        # 子计划并行调用时各自追加 / sub-plans append their own rows
+        debug_info.setdefault("measurements", []).extend(
+            {k: v for k, v in row.items() if k != "sentence"} for row in rows
         )
+        table = {
+            "label": "Measurement table (pre-computed guideline checks)",
+            "section": "",
+            "text": format_measurement_table(rows),
+            "score": float("inf"),
+        }
+        return [table] + passages[:self.ASSESSMENT_CONTEXT_PASSAGES]
+
+    # ---------- 多污染物查询拆分 / multi-pollutant decomposition ----------
+
+    def _run_decomposed(self, query: str, sub_plans: list, concurrent: bool, debug_info: dict,
+                        trace: Trace, budget: LatencyBudget, defer_findings: bool = False) -> list:
+        """
+        规划与各子计划同时开始；每个子计划：检索 → （assessment 时）测量表 →
+        web（按子计划的 topic 读缓存）→ 小上下文打包 → 单污染物结论。
+        并行模式下各子计划并行执行，顺序模式下依次执行。
+        返回成功的结论 [{"label", "text"}, ...]，每个子计划的细节写入
+        debug_info["decomposition"]。defer_findings 且按小节合并时不写结论，
+        返回打包好的上下文 [{"label", "inhouse", "web", "plan"}, ...]，由流式路径生成。
+        Planning starts alongside the sub-plans; each sub-plan retrieves with
+        its focused sub-query, waits for the plan, then fetches web evidence
+        for its own topic, packs a small context (the budget split between
+        sub-plans) and writes a short finding. Sub-plans run in parallel in
+        concurrent mode and one after another otherwise. With defer_findings
+        (streaming) and a section merge, the packed contexts are returned
+        instead of findings so the streaming path can generate them.
+        """
+        plan_future = self._executor.submit(self._timed_until, trace, budget, "plan", "plan",
+                                            self._plan, query)
+        plan_lock = threading.Lock()
+        resolved = {}
+
+        def get_plan() -> dict:
+            # 只等待 / 降级一次，所有子计划共用 / awaited (and degraded) once, shared
+            with plan_lock:
+                if "plan" not in resolved:
+                    plan = self._await(plan_future, budget, "plan")
+                    resolved["plan"] = plan or self._plan_past_deadline(query, budget)
+                return resolved["plan"]
+
+        context_tokens = self.packer.budget_tokens // len(sub_plans)
+        debug_info["decomposition"] = [
+            {"label": sub["label"], "topic": sub["topic"], "query": sub["query"],
+             "context_tokens": context_tokens}
+            for sub in sub_plans
+        ]
+        run = lambda entry: self._run_sub_plan(query, entry, get_plan, debug_info, trace, budget,
+                                               defer_findings)
+        if concurrent:
+            findings = list(self._sub_executor.map(run, debug_info["decomposition"]))
+        else:
+            findings = [run(entry) for entry in debug_info["decomposition"]]
+
+        debug_info["plan"] = get_plan()
+        debug_info["called_agents"] = ["InHouseSearchAgent"] + (
+            ["WebScraperAgent"] if any("web_cache" in e for e in debug_info["decomposition"])
+            else [])
+        return [f for f in findings if f is not None]
+
+    def _run_sub_plan(self, query: str, entry: dict, get_plan, debug_info: dict,
+                      trace: Trace, budget: LatencyBudget, defer_finding: bool = False):
+        """执行一个子计划，失败时记录错误并返回 None / One sub-plan; None (error recorded) on failure."""
+        label, sub_query = entry["label"], entry["query"]
+        try:
+            with trace.span(f"sub_plan:{label}"):
+                passages = self._retrieve(sub_query)
+                plan = dict(get_plan(), topic=entry["topic"])
+                if plan.get("focus") == "assessment":
+                    passages = self._measurement_evidence(sub_query, passages, debug_info)
+
+                web = ""
+                if plan.get("need_web", True) and self._web_allowed(budget):
+                    stage = f"web_fetch:{label}"
+                    fetch = self.web_agent.fetch_evidence
+                    key = web_key(sub_query, plan)
+                    if budget.enabled:
+                        evidence = self._await(self._executor.submit(
+                            self._timed_until, trace, budget, "web_fetch", stage, fetch, key),
+                            budget, "web_fetch")
+                    else:
+                        evidence = self._timed(trace, stage, fetch, key)
+                    if evidence is None:
+                        budget.degrade(stage, "skip_web", "web fetch missed its deadline")
+                    else:
+                        entry["web_cache"] = {"key": evidence["key"], "status": evidence["cache"]}
+                        web = evidence["text"]
+
+                context_tokens = entry["context_tokens"]
+                if budget.tight():
+                    context_tokens = int(context_tokens * SHRUNK_CONTEXT_RATIO)
+                    budget.degrade(f"pack:{label}", "shrink_context",
+                                   f"{budget.remaining():.2f}s left; context capped at "
+                                   f"{context_tokens} tokens")
+                inhouse, web, entry["context_packing"] = self.packer.pack(
+                    passages, web, context_tokens)
+                if defer_finding and not self.summarizer.llm_merge(plan):
+                    return {"label": label, "inhouse": inhouse, "web": web, "plan": plan}
+                text = self.summarizer.summarize_partial(query, label, inhouse, web, plan)
+        except Exception as exc:
+            entry["error"] = f"{type(exc).__name__}: {exc}"
+            return None
+        entry["finding_preview"] = text[:200]
+        return {"label": label, "text": text}
+
+    def _finish(self, debug_info: dict, answer: str, trace: Trace):
+        """补全 debug 信息和总耗时 / Fill in final debug fields and total time."""
         debug_info["final_answer_preview"] = answer[:300]
+        debug_info["summary_mode"] = self.summarizer.mode
+        debug_info["llm_cache"] = self.llm.cache.stats()
+        debug_info["llm_client"] = self.llm.stats()
+        debug_info["timings"]["total"] = round(trace.elapsed(), 4)
+
+    def _run_stages_sequential(self, query: str, debug_info: dict, trace: Trace,
+                               budget: LatencyBudget):
+        """规划 → 内部检索 → web，依次执行 / Plan, search and web fetch one after another."""
+        plan = self._deadline_call(trace, budget, "plan", self._plan, query)
+        if plan is None:
+            plan = self._plan_past_deadline(query, budget)
 
-        return answer, debug_info
+        # 1) 内部检索
+        passages = self._timed(trace, "inhouse_search", self._retrieve, query)
+        debug_info["called_agents"].append("InHouseSearchAgent")
+
+        # 2) 视情况决定是否查 Web（按 topic + focus + 年份读缓存）
+        web = ""
+        if plan.get("need_web", True) and self._web_allowed(budget):
+            evidence = self._deadline_call(trace, budget, "web_fetch",
+                                           self.web_agent.fetch_evidence, web_key(query, plan))
+            if evidence is None:
+                budget.degrade("web_fetch", "skip_web", "web fetch missed its deadline")
+            else:
+                web = self._web_result(evidence, debug_info)
+        return plan, passages, web
+
+    def _plan_past_deadline(self, query: str, budget: LatencyBudget) -> dict:
+        """规划超时：改用规则规划 / Planner missed its deadline: fall back to the rule plan."""
+        budget.degrade("plan", "rule_plan", "planner missed its deadline")
+        return self._rule_plan(classify(query), "rules_deadline")
+
+    @staticmethod
+    def _web_allowed(budget: LatencyBudget) -> bool:
+        """web 阶段截止时间已过时直接跳过 / Skip web when its deadline has already passed."""
+        if budget.time_left("web_fetch") == 0:
+            budget.degrade("web_fetch", "skip_web", "no time left before the web deadline")
+            return False
+        return True
+
+    @staticmethod
+    def _web_result(evidence: dict, debug_info: dict) -> str:
+        debug_info["web_cache"] = {"key": evidence["key"], "status": evidence["cache"]}
+        debug_info["called_agents"].append("WebScraperAgent")
+        return evidence["text"]
+
+    def _run_stages_concurrent(self, query: str, debug_info: dict, trace: Trace,
+                               budget: LatencyBudget):
+        """
+        并行执行：
+        - LLM 规划和内部检索同时开始（检索不依赖规划结果）
+        - 若规则判断需要 web，则投机地提前开始 web 获取；
+          规划结果不需要 web 时取消 / 丢弃该结果
+        - 投机请求用规则分类的 web key；LLM 规划得到不同的 key 时改用新 key
+        Planning and in-house search start together; the web fetch starts
+        speculatively when rule_need_web() says so (keyed by the rule
+        classification) and is cancelled (or its result discarded) if the
+        LLM plan disagrees or maps to a different cache key. Plan and web
+        results are only awaited until their stage deadlines.
+        """
+        submit = self._executor.submit
+        fetch = self.web_agent.fetch_evidence
+        fetch_web = lambda key: submit(self._timed_until, trace, budget, "web_fetch", "web_fetch",
+                                       fetch, key)
+        plan_future = submit(self._timed_until, trace, budget, "plan", "plan", self._plan, query)
+        search_future = submit(self._timed, trace, "inhouse_search", self._retrieve, query)
+        web_future, speculative_key = None, None
+        if rule_need_web(query):
+            speculative_key = web_key(query, classify(query))
+            web_future = fetch_web(speculative_key)
+
+        plan = self._await(plan_future, budget, "plan")
+        if plan is None:
+            plan = self._plan_past_deadline(query, budget)
+        web = ""
+        if plan.get("need_web", True) and not self._web_allowed(budget):
+            if web_future is not None:
+                web_future.cancel()
+            debug_info["speculative_web"] = "skipped"
+        elif plan.get("need_web", True):
+            key = web_key(query, plan)
+            if web_future is None:
+                debug_info["speculative_web"] = "late_start"
+                web_future = fetch_web(key)
+            elif key != speculative_key:
+                debug_info["speculative_web"] = "rekeyed"
+                web_future.cancel()
+                web_future = fetch_web(key)
+            else:
+                debug_info["speculative_web"] = "hit"
+            evidence = self._await(web_future, budget, "web_fetch")
+            if evidence is None:
+                budget.degrade("web_fetch", "skip_web", "web fetch missed its deadline")
+            else:
+                web = self._web_result(evidence, debug_info)
+        elif web_future is not None:
+            # 已经开始的请求无法中断，只能丢弃结果
+            cancelled = web_future.cancel()
+            debug_info["speculative_web"] = "cancelled" if cancelled else "discarded"
+        else:
+            debug_info["speculative_web"] = "not_needed"
+
+        passages = search_future.result()
+        debug_info["called_agents"].insert(0, "InHouseSearchAgent")
+        return plan, passages, web
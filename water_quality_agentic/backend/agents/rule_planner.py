@@ -0,0 +1,215 @@
+# backend/agents/rule_planner.py
+# 规则规划器：用关键词给出 topic / focus / need_web 以及置信度
+# Rule planner: keyword classifier for topic / focus / need_web with a confidence score
+
+import re
+
+from backend.retrieval.measurements import find_location
+from backend.retrieval.topic_router import get_router, term_pattern
+
+# 关键词登记表在 data/topic_keywords.json（与关键词检索、测量抽取共用）；
+# topic / focus 分类与 PlannerAgent 的 LLM prompt 相同
+# Keywords live in the shared registry (data/topic_keywords.json); the topic /
+# focus taxonomy matches the PlannerAgent LLM prompt
+_router = get_router()
+POLLUTANT_TOPICS = _router.terms("topic", kind="pollutant")
+CONTEXT_TOPICS = _router.terms("topic", kind="context")
+FOCUS_KEYWORDS = _router.terms("focus")
+RECENCY_KEYWORDS = _router.terms("signal")["recency"]
+
+# 多个 context topic 同时出现时的优先级；登记表里新增的 context topic 排在最后
+# Precedence among context topics; context topics added to the registry come last
+CONTEXT_PRIORITY = ["ecosystem_health", "groundwater", "nutrients", "lake"]
+CONTEXT_PRIORITY += [t for t in CONTEXT_TOPICS if t not in CONTEXT_PRIORITY]
+
+# 多个 focus 命中时按此顺序取第一个 / first match wins when several focus types hit
+FOCUS_PRIORITY = ["comparison", "trend_analysis", "prediction", "mitigation", "origin", "risk", "assessment"]
+
+# 具体参数所属的污染物 topic / pollutant topic of each concrete parameter
+PARAMETER_TOPICS = {name: entry["topic"] for name, entry in _router.registry["parameter"].items()}
+
+# 置信度达到该阈值时跳过 LLM 规划 / skip the LLM planner at or above this confidence
+CONFIDENCE_THRESHOLD = 0.7
+
+
+def _compile(keywords: list):
+    """一组词的正则（与路由器的单词边界规则相同）/ Regex for a term list, router boundary rules."""
+    return re.compile("|".join(term_pattern(kw) for kw in sorted(keywords, key=len, reverse=True)))
+
+
+_YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+
+
+def rule_need_web(query: str) -> bool:
+    return "recency" in _router.names(query, "signal")
+
+
+def key_terms(query: str) -> frozenset:
+    """
+    查询中的具体污染物词和年份，例如 {"nitrate", "2025"}；
+    两个查询只有 key_terms 相同时才可能是同一个问题。
+    Concrete pollutant terms and years mentioned in the query; two queries
+    can only be the same question when these match.
+    """
+    terms = set(_YEAR_RE.findall(query))
+    terms.update(hit["term"].rstrip("s") for hit in _router.route(query)
+                 if hit["group"] == "topic" and hit["name"] in POLLUTANT_TOPICS
+                 and not hit["nested"])
+    return frozenset(terms)
+
+
+def query_year(query: str):
+    """查询中最晚的年份，没有时返回 None / Latest year mentioned in the query, or None."""
+    years = _YEAR_RE.findall(query)
+    return max(years) if years else None
+
+
+def query_region(query: str):
+    """
+    查询中的水体 / 地区（如 "lake_erie"），先查登记表，再找 "Lake X" / "X River" 之类的名称；
+    没有时返回 None。
+    Water body or region named in the query as a slug ("lake_erie"): the
+    registry's region group first, then a "Lake X" / "X River" style name.
+    """
+    regions = _router.names(query, "region")
+    if regions:
+        return regions[0]
+    location = find_location(query)
+    return location.lower().replace(" ", "_") if location else None
+
+
+def region_label(region: str) -> str:
+    """地区 slug 的展示名 / Display name of a region slug."""
+    entry = _router.registry["region"].get(region)
+    return entry["label"] if entry else region.replace("_", " ").title()
+
+
+def classify(query: str) -> dict:
+    """
+    返回 {"topic", "focus", "need_web", "confidence", "topic_hits", "focus_hits"}。
+    - 恰好一个污染物 topic：高置信度
+    - 多个污染物（mixed）或完全没有命中：低置信度，应交给 LLM
+    Confidence is high for exactly one pollutant topic and low for mixed
+    or keyword-less queries, which should be escalated to the LLM planner.
+    """
+    topics = _router.names(query, "topic")
+    # 污染物按登记表顺序 / pollutants in registry order
+    pollutants = [t for t in POLLUTANT_TOPICS if t in topics]
+    contexts = [t for t in CONTEXT_PRIORITY if t in topics]
+    focus_hits = _router.names(query, "focus")
+    focuses = [f for f in FOCUS_PRIORITY if f in focus_hits]
+
+    # --- topic ---
+    if len(pollutants) > 1:
+        topic, topic_conf = "mixed", 0.5
+    elif pollutants and "ecosystem_health" in contexts:
+        # 规则：涉及湖泊生态影响 → ecosystem_health，但同时有污染物时存在歧义
+        topic, topic_conf = "ecosystem_health", 0.6
+    elif pollutants:
+        topic, topic_conf = pollutants[0], 0.9
+    elif contexts:
+        topic = contexts[0]
+        topic_conf = 0.8 if len(contexts) == 1 or topic != "lake" else 0.6
+    else:
+        topic, topic_conf = "general", 0.3
+
+    # --- focus ---
+    if len(focuses) == 1:
+        focus, focus_conf = focuses[0], 0.9
+    elif focuses:
+        focus = focuses[0]
+        # “是否安全”类问题常伴随 limit/level 等词，不算真正的歧义
+        focus_conf = 0.8 if focuses[1:] == ["assessment"] else 0.5
+    else:
+        focus, focus_conf = "assessment", 0.7
+
+    return {
+        "topic": topic,
+        "focus": focus,
+        "need_web": rule_need_web(query),
+        "confidence": round(min(topic_conf, focus_conf), 2),
+        "topic_hits": pollutants + contexts,
+        "focus_hits": focuses,
+        "topic_scores": _router.scores(query, "topic"),
+    }
+
+
+# 子查询里去掉的比较用词，以及一个污染物片段末尾的连接词（"nitrate and" -> "nitrate"）
+# Comparison wording dropped from sub-queries, and connectives trailing one
+# pollutant's segment ("nitrate and" -> "nitrate")
+_COMPARE_RE = re.compile(_compile(FOCUS_KEYWORDS["comparison"]).pattern, re.IGNORECASE)
+_CONNECTIVE_TAIL_RE = re.compile(
+    r"(?:[\s,，、;；/&+]|\band\b|\bor\b|\bvs\b\.?|\bversus\b|\bwith\b|以及|与|和|及|或|跟)*$",
+    re.IGNORECASE,
+)
+
+
+def _sub_queries(query: str, spans: list) -> list:
+    """
+    按各部分首次出现的位置改写子查询："<开头> <该污染物片段> <结尾>"。
+    开头是第一个污染物之前的措辞（去掉比较用词），片段从该污染物到下一个污染物；
+    片段只有污染物本身时（"nitrate and cadmium levels in ..."）补上最后一个污染物之后的结尾。
+    spans: 每部分首次出现的 (start, end)，按位置排序。
+    Rewrite one sub-query per part as "<lead-in> <pollutant segment> <rest>":
+    the lead-in is the wording before the first pollutant (minus comparison
+    words), the segment runs to the next pollutant, and a bare segment
+    ("nitrate and cadmium levels in ...") borrows the wording after the last
+    pollutant.
+    """
+    # 大小写转换改变长度时退回小写文本 / fall back to the lowered text if lower() changes length
+    text = query if len(query.lower()) == len(query) else query.lower()
+    head = _COMPARE_RE.sub(" ", text[:spans[0][0]])
+    tail = text[spans[-1][1]:]
+    rewritten = []
+    for i, (start, end) in enumerate(spans):
+        segment = text[start:spans[i + 1][0] if i + 1 < len(spans) else len(text)]
+        segment = _CONNECTIVE_TAIL_RE.sub("", segment)
+        if i + 1 < len(spans) and segment.strip() == text[start:end]:
+            segment += tail
+        lead_in = head.rstrip()
+        # 中文之间不加空格 / no space after a Chinese lead-in
+        glue = " " if lead_in and lead_in[-1].isascii() else ""
+        rewritten.append(" ".join((lead_in + glue + segment.lstrip()).split()))
+    return rewritten
+
+
+def _first_hits(query: str, group: str, names) -> list:
+    """
+    某分组中各名称首次命中的位置 [((start, end), name), ...]，按位置排序。
+    First hit of each name of a group as [((start, end), name), ...], in position order.
+    """
+    located = {}
+    for hit in _router.route(query):
+        if hit["group"] == group and hit["name"] in names and hit["name"] not in located:
+            located[hit["name"]] = (hit["start"], hit["end"])
+    return sorted((span, name) for name, span in located.items())
+
+
+def decompose(query: str, max_parts: int = 4) -> list:
+    """
+    把涉及多个污染物（规则规划的 topic 为 mixed）的查询拆成单污染物子查询：
+    优先按具体参数（硝酸盐 / 镉 ...），不足两个时按污染物 topic（微生物 / 重金属 ...）。
+    位置取自路由器的命中，因此 "lead to" 之类被忽略的短语不会算作污染物。
+    每个子查询改写成只问一个污染物（见 _sub_queries），返回 [{"label", "topic", "query"}, ...]；
+    不是 mixed 或不足两部分时返回 []。
+    Split a multi-pollutant query (rule-planner topic "mixed") into
+    single-pollutant sub-queries, by concrete parameter first and by
+    pollutant topic otherwise. Positions come from the router's hits, so
+    ignored phrases such as the verb "lead to" never count as a pollutant.
+    Each sub-query is rewritten around one pollutant ("nitrate levels in
+    Lake Ontario in 2025"); [] unless the query is mixed with two parts.
+    """
+    if classify(query)["topic"] != "mixed":
+        return []
+    located = [(span, name, PARAMETER_TOPICS[name])
+               for span, name in _first_hits(query, "parameter", PARAMETER_TOPICS)]
+    if len(located) < 2:
+        located = [(span, name, name)
+                   for span, name in _first_hits(query, "topic", POLLUTANT_TOPICS)]
+    if len(located) < 2:
+        return []
+    sub_queries = _sub_queries(query, [span for span, _, _ in located])
+    return [
+        {"label": label, "topic": topic, "query": sub_query}
+        for (_, label, topic), sub_query in zip(located[:max_parts], sub_queries)
+    ]
@@ -3,32 +3,149 @@
 # Summarizer Agent: uses Mistral LLM to generate real summaries
 
 import os
-from mistralai import Mistral
+import re
 
+from backend.llm.client import get_llm_client
 
-# 从环境变量读取 API Key，避免写死在代码里
-# Read API key from environment variable
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "your key")
 MISTRAL_MODEL_NAME = "mistral-small-latest"
 
+# "two_phase"：先只生成英文答案，中文翻译按需再生成（默认）
+# "bilingual"：一次生成英文 + 中文（旧行为）
+# "two_phase" returns an English answer and translates on demand (default);
+# "bilingual" produces English + Chinese in one completion (previous behaviour)
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "two_phase")
 
-class SummarizerAgent:
-    def __init__(self):
-        if not MISTRAL_API_KEY or MISTRAL_API_KEY == "YOUR_MISTRAL_KEY_HERE":
-            raise ValueError(
-                "MISTRAL_API_KEY is not set. Please export it in your environment."
-            )
-        self.client = Mistral(api_key=MISTRAL_API_KEY)
+LANGUAGE_RULES = {
+    "bilingual": (
+        "The answer MUST be bilingual: English first, then Chinese translation.",
+        "- Output English + Chinese (each bullet point can have EN + CN).",
+    ),
+    "two_phase": (
+        "Write the answer in English only; a Chinese translation is produced separately.",
+        "- Output English only.",
+    ),
+}
 
-    def summarize(self, query: str, inhouse_text: str, web_text: str, plan=None) -> str:
+# 拆分查询的合并方式："sections" 按小节确定性合并（默认，不多一次 LLM 调用）；"llm" 再调用一次 LLM。
+# 比较类问题（focus == "comparison"）总是用 LLM 合并，否则答案里没有真正的比较。
+# How decomposed findings are merged: "sections" interleaves them section by
+# section without another LLM call (default); "llm" asks the LLM to merge them.
+# Comparison questions always use the LLM merge, since interleaving alone compares nothing.
+DECOMPOSE_MERGE = os.getenv("DECOMPOSE_MERGE", "sections")
+
+SECTION_TITLES = ["Background", "Key water-quality data", "Risk analysis", "Recommendations"]
+# "1) Background: ..." / "2. ..." / "3）..." 形式的小节行 / numbered section lines
+SECTION_RE = re.compile(r"^\s*([1-4])\s*[).）]\s*(?:[^:：\n]{0,40}[:：])?\s*(.*)$")
+
+
+def split_sections(text: str) -> dict:
+    """
+    把结构化答案按 1) ~ 4) 小节切开，返回 {1: "...", 2: "..."}；找不到小节时返回 {}。
+    Split a structured answer into its numbered sections ({} when none are found).
+    """
+    sections, current = {}, None
+    for line in text.splitlines():
+        match = SECTION_RE.match(line)
+        if match:
+            current = int(match.group(1))
+            sections[current] = match.group(2).strip()
+        elif current is not None and line.strip():
+            sections[current] = (sections[current] + " " + line.strip()).strip()
+    return sections
+
+
+def _section_lines(parsed: list, number: int) -> list:
+    """某一小节的合并行：标题 + 每个污染物一条 / One merged section: title plus a bullet per finding."""
+    bullets = [f"   - {label}: {sections[number]}"
+               for label, sections in parsed if sections.get(number)]
+    return [f"{number}) {SECTION_TITLES[number - 1]}:"] + bullets if bullets else []
+
+
+def _unstructured_lines(parsed: list, findings: list) -> list:
+    """无法切分小节的结论，原样附在最后 / Findings without the structure, appended verbatim."""
+    return [f"[{label}]\n{finding['text'].strip()}"
+            for (label, sections), finding in zip(parsed, findings)
+            if not sections and finding["text"].strip()]
+
+
+def _parse(findings: list) -> list:
+    return [(f["label"].replace("_", " "), split_sections(f["text"])) for f in findings]
+
+
+def merge_sections(findings: list) -> str:
+    """
+    确定性合并：每个小节下按污染物列出各自的结论；无法切分的结论原样附在最后。
+    Deterministic merge: under each section, one bullet per sub-plan;
+    findings that do not follow the structure are appended verbatim.
+    """
+    parsed = _parse(findings)
+    lines = []
+    for number in range(1, len(SECTION_TITLES) + 1):
+        lines.extend(_section_lines(parsed, number))
+    lines.extend(_unstructured_lines(parsed, findings))
+    return "\n".join(lines)
+
+
+def stream_merge_sections(labels: list, events):
+    """
+    merge_sections 的流式版本：各子计划的结论同时流式生成，
+    events 依次给出 (序号, 文本片段)，某个结论结束时片段为 None。
+    某一小节在所有结论里都写完（出现下一小节或流结束）后立即输出该小节，
+    拼起来与 merge_sections(全部结论) 相同。
+    Streaming merge_sections(): the findings stream in concurrently as
+    (index, chunk) events, with chunk None when one finishes. Each section
+    is emitted as soon as every finding has moved past it, and the
+    concatenated output equals merge_sections() of the finished findings.
+    """
+    findings = [{"label": label, "text": ""} for label in labels]
+    finished = [False] * len(labels)
+    next_section, started = 1, False
+
+    def complete_through(i: int) -> int:
+        if finished[i]:
+            return len(SECTION_TITLES)
+        numbers = split_sections(findings[i]["text"])
+        return max(numbers) - 1 if numbers else 0
+
+    def emit(lines: list):
+        nonlocal started
+        if lines:
+            text = ("\n" if started else "") + "\n".join(lines)
+            started = True
+            yield text
+
+    for index, chunk in events:
+        if chunk is None:
+            finished[index] = True
+        else:
+            findings[index]["text"] += chunk
+        ready = min(complete_through(i) for i in range(len(labels)))
+        if ready >= next_section:
+            # 小节 next_section..ready 在所有结论里都已写完 / these sections are final everywhere
+            parsed = _parse(findings)
+            for number in range(next_section, ready + 1):
+                yield from emit(_section_lines(parsed, number))
+            next_section = ready + 1
+    parsed = _parse(findings)
+    for number in range(next_section, len(SECTION_TITLES) + 1):
+        yield from emit(_section_lines(parsed, number))
+    yield from emit(_unstructured_lines(parsed, findings))
+
+
+class SummarizerAgent:
+    def __init__(self, llm=None, mode: str = SUMMARY_MODE):
         """
-        使用真实 LLM 生成摘要：
-        - 输入：用户问题、内部文档内容、web 内容、Planner 计划
-        - 输出：中英文双语、结构化（水质背景 → 数据 → 风险 → 建议）
-        Uses real LLM to generate a bilingual structured summary.
+        llm: 共享的 LLMClient，默认使用进程内单例 / shared LLMClient (process singleton by default)
+        mode: "two_phase" 或 "bilingual"，见 SUMMARY_MODE
         """
+        self.llm = llm if llm is not None else get_llm_client()
+        self.mode = mode if mode in LANGUAGE_RULES else "bilingual"
 
-        system_prompt = """
+    def _build_messages(self, query: str, inhouse_text: str, web_text: str, plan=None) -> list:
+        """拼出 system + user prompt / Build the system + user chat messages."""
+        language_rule, language_task = LANGUAGE_RULES[self.mode]
+
+        system_prompt = f"""
         You are a Water Pollution & Quality Summarization Agent.
         Your job is to:
         - merge internal water-quality documents and web content,
@@ -38,7 +155,7 @@ class SummarizerAgent:
           2) Key water-quality data
           3) Risk analysis
           4) Recommendations
-        The answer MUST be bilingual: English first, then Chinese translation.
+        {language_rule}
         Be concise but informative, suitable for a research analyst.
         """
 
@@ -59,17 +176,182 @@ class SummarizerAgent:
         - Merge the above information.
         - Resolve or explain any conflicts between internal and web data.
         - Follow the required structure.
-        - Output English + Chinese (each bullet point can have EN + CN).
+        {language_task}
+        """
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def summarize(self, query: str, inhouse_text: str, web_text: str, plan=None) -> str:
+        """
+        使用真实 LLM 生成摘要：
+        - 输入：用户问题、内部文档内容、web 内容、Planner 计划
+        - 输出：结构化（水质背景 → 数据 → 风险 → 建议）；two_phase 模式只有英文
+        Uses real LLM to generate a structured summary (English only in two_phase mode).
+        """
+        messages = self._build_messages(query, inhouse_text, web_text, plan)
+        return self.llm.complete("summarizer", messages, model=MISTRAL_MODEL_NAME)
+
+    def summarize_stream(self, query: str, inhouse_text: str, web_text: str, plan=None):
+        """
+        summarize 的流式版本：生成器，逐段 yield LLM 输出的文本。
+        缓存命中时一次性 yield 整个答案；流结束后写入缓存。
+        Streaming variant of summarize(): yields text chunks as they arrive.
+        A cache hit yields the whole answer at once; a completed stream is cached.
+        """
+        messages = self._build_messages(query, inhouse_text, web_text, plan)
+        yield from self.llm.stream("summarizer", messages, model=MISTRAL_MODEL_NAME)
+
+    # ---------- 第二阶段：中文翻译 / phase two: Chinese translation ----------
+
+    @staticmethod
+    def _translation_messages(answer: str) -> list:
+        system_prompt = """
+        You are a professional English-to-Chinese translator for water-quality reports.
+        Translate the answer into Simplified Chinese.
+        Keep the numbered structure, numbers, units and guideline names unchanged.
+        Output only the translation.
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": answer},
+        ]
+
+    def translate(self, answer: str) -> str:
+        """
+        把英文答案翻译成中文（按需调用，结果由调用方缓存到 query_log）。
+        Translate an English answer into Chinese on demand.
+        """
+        return self.llm.complete("translator", self._translation_messages(answer),
+                                 model=MISTRAL_MODEL_NAME)
+
+    # ---------- 拆分查询：单污染物结论 + 合并 / decomposed queries: partials + merge ----------
+
+    @staticmethod
+    def _partial_messages(query: str, label: str, inhouse_text: str, web_text: str,
+                          plan=None) -> list:
+        system_prompt = f"""
+        You are a Water Pollution & Quality Summarization Agent.
+        The user question covers several pollutants; answer for ONE pollutant only: {label.replace("_", " ")}.
+        Use the same structure, one or two sentences per section:
+          1) Background
+          2) Key water-quality data
+          3) Risk analysis
+          4) Recommendations
+        Write in English only; the findings for each pollutant are merged afterwards.
+        """
+        user_prompt = f"""
+        USER QUESTION:
+        {query}
+
+        POLLUTANT: {label}
+
+        PLANNER PLAN (topic, focus, need_web):
+        {plan}
+
+        INTERNAL DOCUMENTS (in-house corpus):
+        {inhouse_text}
+
+        WEB CONTENT (if any):
+        {web_text}
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def summarize_partial(self, query: str, label: str, inhouse_text: str, web_text: str,
+                          plan=None) -> str:
         """
+        拆分查询中单个污染物的简短结论（英文，结构同最终答案）。
+        Short structured finding for one pollutant of a decomposed query.
+        """
+        return self.llm.complete(
+            "summarizer", self._partial_messages(query, label, inhouse_text, web_text, plan),
+            model=MISTRAL_MODEL_NAME,
+        )
 
-        response = self.client.chat.complete(
+    def summarize_partial_stream(self, query: str, label: str, inhouse_text: str, web_text: str,
+                                 plan=None):
+        """summarize_partial 的流式版本 / Streaming variant of summarize_partial()."""
+        yield from self.llm.stream(
+            "summarizer", self._partial_messages(query, label, inhouse_text, web_text, plan),
             model=MISTRAL_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
         )
-        return response.choices[0].message.content
 
-        # return response.choices[0].message["content"]
-    
+    def llm_merge(self, plan=None) -> bool:
+        """
+        是否用 LLM 合并：DECOMPOSE_MERGE=llm、双语模式（需要 LLM 生成中文）或比较类问题。
+        Whether decomposed findings are merged by the LLM: DECOMPOSE_MERGE=llm,
+        bilingual mode (the Chinese half needs the LLM) or a comparison question.
+        """
+        return (DECOMPOSE_MERGE == "llm" or self.mode == "bilingual"
+                or (plan or {}).get("focus") == "comparison")
+
+    def _merge_messages(self, query: str, findings: list, plan=None) -> list:
+        """合并各污染物结论的 prompt / Prompt merging the per-pollutant findings."""
+        language_rule, language_task = LANGUAGE_RULES[self.mode]
+        if (plan or {}).get("focus") == "comparison":
+            merge_rule = ("The user asks for a comparison: in every section compare the pollutants "
+                          "directly (levels relative to their guidelines, relative risk, which "
+                          "needs action first) instead of describing them one after another.")
+        else:
+            merge_rule = "Combine the findings into one answer; do not repeat shared background."
+        system_prompt = f"""
+        You are a Water Pollution & Quality Summarization Agent.
+        The user question covers several pollutants, and each one has already been
+        researched separately. Merge these findings into one structured answer:
+          1) Background
+          2) Key water-quality data
+          3) Risk analysis
+          4) Recommendations
+        {merge_rule}
+        {language_rule}
+        """
+        user_prompt = f"""
+        USER QUESTION:
+        {query}
+
+        PLANNER PLAN (topic, focus, need_web):
+        {plan}
+
+        PER-POLLUTANT FINDINGS:
+        {self._findings_text(findings)}
+
+        TASK:
+        - Follow the required structure.
+        {language_task}
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    @staticmethod
+    def _findings_text(findings: list) -> str:
+        return "\n\n".join(f"[{f['label']}]\n{f['text']}" for f in findings)
+
+    def merge(self, query: str, findings: list, plan=None) -> str:
+        """
+        合并各子计划的结论 findings=[{"label", "text"}, ...]：
+        默认按小节确定性合并；llm_merge(plan) 时再调用一次 LLM。
+        Merge per-pollutant findings into one answer, deterministically by
+        default or with one more LLM call (see llm_merge()).
+        """
+        if self.llm_merge(plan):
+            return self.llm.complete("summarizer", self._merge_messages(query, findings, plan),
+                                     model=MISTRAL_MODEL_NAME)
+        return merge_sections(findings)
+
+    def merge_stream(self, query: str, findings: list, plan=None):
+        """
+        merge 的流式版本：LLM 合并逐段输出；按小节合并时见 stream_merge_sections。
+        Streaming variant of merge(); the LLM merge streams token by token.
+        """
+        if self.llm_merge(plan):
+            yield from self.llm.stream("summarizer", self._merge_messages(query, findings, plan),
+                                       model=MISTRAL_MODEL_NAME)
+        else:
+            yield merge_sections(findings)
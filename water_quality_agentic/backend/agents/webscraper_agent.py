@@ -1,10 +1,18 @@
 # backend/agents/webscraper_agent.py
 # WebScraper Agent: uses LLM to simulate fresh web knowledge (safe for demo)
+# web 证据按 (topic, focus, region, year) 缓存；WebPrefetcher 根据 query_log 热度在过期前预取
+# Web evidence is cached per (topic, focus, region, year); WebPrefetcher refreshes the
+# hottest keys from query_log before they expire
 
-import os
-from mistralai import Mistral
+import threading
+import time
+from collections import Counter
+
+from backend.agents.rule_planner import classify, region_label, rule_need_web
+from backend.db.local_db import recent_queries
+from backend.db.web_cache import ANY_REGION, LATEST, get_web_cache, web_key
+from backend.llm.client import get_llm_client
 
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "your key")
 MISTRAL_MODEL_NAME = "mistral-small-latest"
 
 class WebScraperAgent:
@@ -14,26 +22,57 @@ class WebScraperAgent:
     This version uses LLM to simulate “latest web info”, not real scraping.
     """
 
-    def __init__(self):
-        if not MISTRAL_API_KEY or MISTRAL_API_KEY == "YOUR_MISTRAL_KEY_HERE":
-            raise ValueError("MISTRAL_API_KEY is not set.")
-        self.client = Mistral(api_key=MISTRAL_API_KEY)
+    def __init__(self, llm=None, cache=None):
+        """
+        llm: 共享的 LLMClient，默认使用进程内单例 / shared LLMClient (process singleton by default)
+        cache: WebEvidenceCache，默认使用进程内单例 / shared web-evidence cache by default
+        """
+        self.llm = llm if llm is not None else get_llm_client()
+        self.cache = cache if cache is not None else get_web_cache()
 
     def fetch(self, query: str) -> str:
+        """
+        按查询的规则分类取 web 片段（走缓存）。
+        Web snippet for a query, keyed by its rule-planner classification (cached).
+        """
+        return self.fetch_evidence(web_key(query, classify(query)))["text"]
+
+    def fetch_evidence(self, key: tuple) -> dict:
+        """
+        请求路径上的入口：先读缓存，未命中时才抓取并写入缓存。
+        返回 {"text", "key", "cache": "hit" | "miss"}。
+        Request-path entry point: a cache read, falling back to fetch_key().
+        """
+        text = self.cache.get(key)
+        if text is not None:
+            return {"text": text, "key": "|".join(key), "cache": "hit"}
+        text = self.fetch_key(key)
+        self.cache.put(key, text)
+        return {"text": text, "key": "|".join(key), "cache": "miss"}
+
+    def fetch_key(self, key: tuple) -> str:
         """
         使用 LLM “模拟” web 结果，避免真实爬虫不稳定。
-        Use LLM to create a pseudo-web snippet relevant to the query.
+        换成真实爬虫时只需替换这个方法（预取调度器也调用它）。
+        Use LLM to create a pseudo-web snippet for (topic, focus, region, year).
+        A real scraper only needs to replace this method.
         """
+        topic, focus, region, year = key
+        period = "the most recent period (2024–2025)" if year == LATEST else year
+        # 查询没有提到水体时不套用任何地区 / no region framing when the query names none
+        scope = ("freshwater and drinking-water quality (no specific region)" if region == ANY_REGION
+                 else f"{region_label(region)} water quality")
 
         prompt = f"""
         You are a Web Data Simulation Agent.
 
-        Given the user question:
-        {query}
+        Research topic: {topic.replace("_", " ")} in {scope}
+        Analysis focus: {focus.replace("_", " ")}
+        Period: {period}
 
-        Generate a short paragraph (~60–100 words) summarizing what a 
+        Generate a short paragraph (~60–100 words) summarizing what a
         “recent credible online environmental news article or official report”
-        *might* say about this topic around 2024–2025.
+        *might* say about this topic for this period.
 
         Requirements:
         - Should sound realistic but not claim false facts
@@ -42,10 +81,71 @@ class WebScraperAgent:
         - Provide English only
         """
 
-        response = self.client.chat.complete(
-            model=MISTRAL_MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
+        return self.llm.complete(
+            "web", [{"role": "user", "content": prompt}], model=MISTRAL_MODEL_NAME
         )
-        return response.choices[0].message.content
 
-        # return response.choices[0].message["content"]
+
+class WebPrefetcher:
+    """
+    后台调度器：统计最近 query_log 中需要 web 的查询落在哪些 key 上，
+    把最热的 top_k 个 key 在缺失或即将过期时提前抓取，让请求路径只读缓存。
+    Background scheduler: counts which keys recent need_web queries map to
+    and refreshes the top_k hottest ones before they expire, so the request
+    path is a cache read in the common case.
+    """
+
+    def __init__(self, agent: WebScraperAgent, interval_s: float = 600.0, top_k: int = 8,
+                 window: int = 1000, max_age_s: float = 7 * 24 * 3600, margin: float = 0.25):
+        self.agent = agent
+        self.interval_s = interval_s
+        self.top_k = top_k
+        self.window = window
+        self.max_age_s = max_age_s
+        self.margin = margin
+        self.counters = {"runs": 0, "refreshed": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hot_keys(self) -> list:
+        """最近 window 个查询中需要 web 的 key，按频率降序 / Hottest web keys."""
+        counts = Counter()
+        for query, need_web in recent_queries(self.window, self.max_age_s):
+            if need_web or (need_web is None and rule_need_web(query)):
+                counts[web_key(query, classify(query))] += 1
+        return [key for key, _ in counts.most_common(self.top_k)]
+
+    def run_once(self) -> dict:
+        """刷新一轮，返回 {"hot", "refreshed"} / One refresh pass."""
+        hot = self.hot_keys()
+        refreshed = 0
+        for key in self.agent.cache.expiring(hot, self.margin):
+            try:
+                self.agent.cache.put(key, self.agent.fetch_key(key), prefetched=True)
+                refreshed += 1
+            except Exception:
+                self.counters["errors"] += 1
+        self.counters["runs"] += 1
+        self.counters["refreshed"] += refreshed
+        return {"hot": len(hot), "refreshed": refreshed}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="web-prefetch", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            try:
+                self.run_once()
+            except Exception:
+                self.counters["errors"] += 1
+            self._stop.wait(max(0.0, self.interval_s - (time.monotonic() - start)))
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return dict(self.counters, running=self._thread is not None)
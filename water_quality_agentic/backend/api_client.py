@@ -0,0 +1,85 @@
+# backend/api_client.py
+# HTTP 客户端：接口与 api_server 模块相同，前端设置 WQ_API_URL 后通过它访问独立的 API 服务
+# HTTP client exposing the same functions as the api_server module, so the
+# frontend can talk to a separately scaled backend (backend/http_server.py)
+
+import json
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+from backend.budget import Overloaded
+
+
+class ApiClient:
+    """
+    handle_query / handle_query_stream / submit_feedback / translate_answer /
+    get_stage_metrics 与 api_server 同名同返回值。
+    Drop-in stand-in for the api_server module over HTTP (stdlib only).
+    """
+
+    def __init__(self, base_url: str, timeout_s: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_s = timeout_s
+        # 与 api_server.STARTUP_TIMINGS 对应，前端会写入 frontend_load_s
+        # Mirrors api_server.STARTUP_TIMINGS; the frontend records frontend_load_s here
+        self.STARTUP_TIMINGS = {}
+
+    def _request(self, method: str, path: str, payload: dict = None):
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        req = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout_s)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 503:
+                raise Overloaded(exc.read().decode("utf-8", "replace"),
+                                 float(exc.headers.get("Retry-After", 1))) from exc
+            raise
+
+    def _call(self, method: str, path: str, payload: dict = None):
+        with self._request(method, path, payload) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def health(self) -> dict:
+        start = time.perf_counter()
+        result = self._call("GET", "/health")
+        result["latency_s"] = round(time.perf_counter() - start, 4)
+        return result
+
+    def handle_query(self, query: str):
+        result = self._call("POST", "/query", {"query": query})
+        debug = result.get("debug") or {}
+        debug["coalesced"] = result.get("coalesced", False)
+        return result["answer"], debug
+
+    def handle_query_stream(self, query: str):
+        """逐个产出服务端的 SSE 事件 / Yield the server-sent events one by one."""
+        with self._request("POST", "/query/stream", {"query": query}) as resp:
+            for raw in resp:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["event"] == "error":
+                    if event.get("status") == 503:
+                        raise Overloaded(event["message"])
+                    raise RuntimeError(event["message"])
+                if event["event"] == "done":
+                    event["debug"]["coalesced"] = event.get("coalesced", False)
+                yield event
+
+    def submit_feedback(self, query: str, answer: str, feedback: str):
+        self._call("POST", "/feedback", {"query": query, "answer": answer, "feedback": feedback})
+
+    def translate_answer(self, query: str, answer: str) -> str:
+        return self._call("POST", "/translate", {"query": query, "answer": answer})["answer_zh"]
+
+    def get_stage_metrics(self, limit: int = 1000) -> list:
+        return self._call("GET", "/metrics/stages?" + urlencode({"limit": limit}))
+
+    def get_stats(self) -> dict:
+        return self._call("GET", "/stats")
@@ -1,14 +1,190 @@
 # backend/api_server.py
 
-from backend.db.local_db import init_db, log_query
+import time
+
+_IMPORT_START = time.perf_counter()
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.budget import AdmissionController, LatencyBudget
+from backend.db.answer_cache import get_answer_cache
+from backend.db.local_db import (
+    get_translation, init_db, log_query, reflection_status_counts, save_translation,
+    stage_latency_summary, storage_stats,
+)
+from backend.db.retention import RETENTION_DAYS, RetentionJob
 from backend.agents.planner_agent import PlannerAgent
+from backend.agents.inhouse_search_agent import CorpusWatcher
 from backend.agents.introspection_agent import IntrospectionAgent
+from backend.agents.webscraper_agent import WebPrefetcher
+
+# 延迟初始化：导入本模块时不建数据库表、不创建 Agent / LLM 客户端、不读语料，
+# 这些工作推迟到第一次查询时完成。
+# Lazy initialization: importing this module does no DB, network-client or
+# corpus work; that happens on the first query.
+_planner = None
+_introspector = None
+_web_prefetcher = None
+_retention_job = None
+_corpus_watcher = None
+_init_lock = threading.Lock()
+
+# WEB_PREFETCH=0 关闭 web 证据预取；间隔和热门 key 数可配置
+# WEB_PREFETCH=0 disables the web-evidence prefetcher; interval and key count are tunable
+WEB_PREFETCH = os.getenv("WEB_PREFETCH", "1") != "0"
+WEB_PREFETCH_INTERVAL_S = float(os.getenv("WEB_PREFETCH_INTERVAL_S", "600"))
+WEB_PREFETCH_TOP_K = int(os.getenv("WEB_PREFETCH_TOP_K", "8"))
+
+# RETENTION_JOB=0 关闭后台保留期清理（归档 + 增量 VACUUM），见 backend/db/retention.py
+# RETENTION_JOB=0 disables the background retention compaction (backend/db/retention.py)
+RETENTION_JOB = os.getenv("RETENTION_JOB", "1") != "0"
+
+# CORPUS_WATCH=0 关闭后台语料检查（查询路径从不扫描语料目录）；CORPUS_SYNC=False 的进程
+# 只重新读取共享索引，不扫描目录（多 worker 时只有第一个 worker 扫描）
+# CORPUS_WATCH=0 disables the background corpus check (the query path never
+# scans the corpus). With CORPUS_SYNC False the process only refreshes from the
+# shared index; with several workers only the first one scans the directory
+CORPUS_WATCH = os.getenv("CORPUS_WATCH", "1") != "0"
+CORPUS_SYNC = True
+
+# 准入控制：同时执行的查询数、排队上限和排队超时；超出时抛出 budget.Overloaded
+# Admission control: concurrent pipeline runs, queue bound and queue timeout;
+# requests beyond that raise budget.Overloaded
+_admission = AdmissionController(
+    max_in_flight=int(os.getenv("MAX_IN_FLIGHT", "8")),
+    max_queue=int(os.getenv("ADMISSION_QUEUE", "32")),
+    queue_timeout_s=float(os.getenv("ADMISSION_TIMEOUT_S", "5")),
+)
+
+# 启动耗时：import_s（导入本模块）、init_s（首次初始化）、first_query_s（首次查询端到端）
+# Startup timings: module import, one-off backend init, first end-to-end query
+STARTUP_TIMINGS = {"import_s": None, "init_s": None, "first_query_s": None}
+
+# 中文翻译：on_demand（用户点击时才生成）或 background（答案返回后在后台预先生成）
+# Chinese translation: "on_demand" (when the user asks) or "background"
+# (pre-translated off the request path after the answer is returned)
+TRANSLATION_MODE = os.getenv("TRANSLATION_MODE", "on_demand")
+_translation_pool = None
+_translation_lock = threading.Lock()
+
+
+def _init_backend():
+    """初始化数据库和 Agent（只执行一次）/ Initialize DB and agents exactly once."""
+    global _planner, _introspector, _web_prefetcher, _retention_job, _corpus_watcher
+    if _planner is not None:
+        return
+    with _init_lock:
+        if _planner is not None:
+            return
+        start = time.perf_counter()
+        # 初始化数据库
+        init_db()
+        # PLANNER_CONCURRENT=0 可关闭阶段并行 / set PLANNER_CONCURRENT=0 to run stages sequentially
+        planner = PlannerAgent(concurrent=os.getenv("PLANNER_CONCURRENT", "1") == "1")
+        planner.warm_up()
+        _introspector = IntrospectionAgent(llm=planner.llm)
+        if WEB_PREFETCH and planner.web_agent.cache.enabled:
+            # 后台按 query_log 热度预取 web 证据 / warm hot web-evidence keys in the background
+            _web_prefetcher = WebPrefetcher(planner.web_agent, interval_s=WEB_PREFETCH_INTERVAL_S,
+                                            top_k=WEB_PREFETCH_TOP_K)
+            _web_prefetcher.start()
+        if RETENTION_JOB and RETENTION_DAYS > 0:
+            _retention_job = RetentionJob()
+            _retention_job.start()
+        if CORPUS_WATCH:
+            _corpus_watcher = CorpusWatcher(planner.inhouse_agent, sync=CORPUS_SYNC)
+            _corpus_watcher.start()
+        _planner = planner
+        STARTUP_TIMINGS["init_s"] = round(time.perf_counter() - start, 4)
+
+
+def get_planner() -> PlannerAgent:
+    """进程内共享的 PlannerAgent（首次调用时初始化）/ Shared PlannerAgent, built on first call."""
+    _init_backend()
+    return _planner
+
 
-# 初始化数据库
-init_db()
+def get_introspector() -> IntrospectionAgent:
+    _init_backend()
+    return _introspector
 
-planner = PlannerAgent()
-introspector = IntrospectionAgent()
+
+def _record_first_query(start: float, debug_info: dict):
+    """记录首个查询的端到端耗时，并把启动耗时放进 debug 信息。"""
+    if STARTUP_TIMINGS["first_query_s"] is None:
+        STARTUP_TIMINGS["first_query_s"] = round(time.perf_counter() - start, 4)
+    debug_info["startup"] = dict(STARTUP_TIMINGS)
+
+
+def _cached_answer(query: str, start: float):
+    """
+    近似重复问题直接返回历史答案：命中时返回 (answer, debug_info, None)，
+    未命中返回 (None, None, fingerprint)，fingerprint 在记录答案时复用。
+    Serve a stored answer for a near-duplicate question. Returns
+    (answer, debug_info, None) on a hit, else (None, None, fingerprint).
+    """
+    cache = get_answer_cache()
+    fp = cache.fingerprint(query)
+    hit = cache.lookup(query, fp)
+    if hit is None:
+        return None, None, fp
+    answer = hit.pop("answer")
+    debug_info = {
+        "answer_cache": dict(hit, hit=True, stats=cache.stats()),
+        "timings": {"total": round(time.perf_counter() - start, 4)},
+        "summary_mode": get_planner().summarizer.mode,
+    }
+    return answer, debug_info, None
+
+
+def _log_answer(query: str, answer: str, debug_info: dict, fp: dict):
+    """记录查询，并把新答案加入答案缓存 / Log the query and index the new answer."""
+    need_web = debug_info.get("plan", {}).get("need_web", False)
+    log_query(query, answer, debug_info.get("spans"),
+              need_web=need_web, minhash=fp["signature"].tobytes())
+    cache = get_answer_cache()
+    cache.add(query, answer, need_web, fp)
+    debug_info["answer_cache"] = {"hit": False, "stats": cache.stats()}
+    _schedule_translation(query, answer, debug_info)
+
+
+# ---------- 第二阶段：中文翻译 / phase two: Chinese translation ----------
+
+def _schedule_translation(query: str, answer: str, debug_info: dict):
+    """
+    two_phase 模式下记录翻译方式；background 模式时把翻译放到后台线程。
+    Record how the Chinese translation will be produced and, in background
+    mode, start it off the request path.
+    """
+    if debug_info.get("summary_mode") != "two_phase" or not answer:
+        return
+    debug_info["translation"] = {"mode": TRANSLATION_MODE}
+    if TRANSLATION_MODE != "background":
+        return
+    global _translation_pool
+    with _translation_lock:
+        if _translation_pool is None:
+            _translation_pool = ThreadPoolExecutor(max_workers=1,
+                                                   thread_name_prefix="translator")
+    _translation_pool.submit(translate_answer, query, answer)
+
+
+def translate_answer(query: str, answer: str) -> str:
+    """
+    返回英文答案的中文翻译：先查 query_log 里缓存的 answer_zh，没有再调用 LLM 并写回。
+    Chinese translation of an answer: served from query_log.answer_zh when
+    present, otherwise generated once and stored there.
+    """
+    _init_backend()
+    cached = get_translation(query, answer)
+    if cached is not None:
+        return cached
+    answer_zh = get_planner().summarizer.translate(answer)
+    save_translation(query, answer, answer_zh)
+    return answer_zh
 
 
 def handle_query(query: str):
@@ -22,15 +198,140 @@ def handle_query(query: str):
             {},
         )
 
-    # 1) 调用 Planner 完成整个多智能体流程
-    answer, debug_info = planner.handle_query(query)
+    start = time.perf_counter()
+    _init_backend()
+
+    # 0) 近似重复问题直接返回缓存答案
+    answer, debug_info, fp = _cached_answer(query, start)
+    if answer is not None:
+        log_query(query, answer)
+        return answer, debug_info
 
-    # 2) 记录查询和答案
-    log_query(query, answer)
+    # 1) 准入控制 + 延迟预算（排队时间也计入预算），调用 Planner 完成整个多智能体流程
+    with _admission.admit() as queued_s:
+        budget = LatencyBudget(start=start)
+        answer, debug_info = get_planner().handle_query(query, budget=budget)
+    debug_info["admission"] = {"queued_s": round(queued_s, 4)}
 
+    # 2) 记录查询、答案和每个阶段的指标
+    _log_answer(query, answer, debug_info, fp)
+
+    _record_first_query(start, debug_info)
     return answer, debug_info
 
 
 def submit_feedback(query: str, answer: str, feedback: str):
-    """前端提交用户反馈，交给 Introspection Agent."""
-    introspector.evaluate_and_log(query, answer, feedback)
\ No newline at end of file
+    """前端提交用户反馈：只入队，由 Introspection Agent 的后台 worker 打分。"""
+    get_introspector().evaluate_and_log(query, answer, feedback)
+
+
+def get_web_cache_stats() -> dict:
+    """web 证据缓存和预取调度器的统计 / Web-evidence cache and prefetcher counters."""
+    stats = {"cache": get_planner().web_agent.cache.stats()}
+    if _web_prefetcher is not None:
+        stats["prefetch"] = _web_prefetcher.stats()
+    return stats
+
+
+def get_corpus_stats() -> dict:
+    """语料索引和后台语料检查的统计 / Corpus index figures and corpus-watch counters."""
+    stats = {"index": get_planner().inhouse_agent.index.stats()}
+    if _corpus_watcher is not None:
+        stats["watch"] = _corpus_watcher.stats()
+    return stats
+
+
+def get_plan_batch_stats() -> dict:
+    """LLM 规划微批处理的统计 / Planner micro-batching counters."""
+    planner = get_planner()
+    return planner.plan_batcher.stats() if planner.plan_batch else {"enabled": False}
+
+
+def get_admission_stats() -> dict:
+    """准入控制计数（运行中 / 排队 / 拒绝）/ Admission counters."""
+    return _admission.stats()
+
+
+def get_evaluation_stats() -> dict:
+    """反馈评估队列状态 / Reflection queue counts and evaluator counters."""
+    return {"reflections": reflection_status_counts(), "agent": get_introspector().stats()}
+
+
+def get_storage_stats() -> dict:
+    """答案存储和保留期清理的统计 / Answer-store figures and retention job counters."""
+    _init_backend()
+    stats = {"db": storage_stats()}
+    if _retention_job is not None:
+        stats["retention"] = _retention_job.stats()
+    return stats
+
+
+def get_stage_metrics(limit: int = 1000) -> list:
+    """最近查询的分阶段 p50 / p95 / p99 / Per-stage latency percentiles over recent queries."""
+    init_db()
+    return stage_latency_summary(limit)
+
+
+def handle_query_stream(query: str):
+    """
+    handle_query 的流式版本：透传 planner 的事件，结束时记录查询和答案。
+    流水线在单独的线程里持有准入槽位（见 _run_stream），这里只转发事件。
+    Streaming variant of handle_query(); yields planner events and logs
+    the query once the answer is complete. The pipeline runs on its own
+    thread, which holds the admission slot (see _run_stream); this
+    generator only forwards events, so a consumer that stops reading
+    cannot keep the slot.
+    """
+    if not query.strip():
+        yield {
+            "event": "done",
+            "answer": "Please enter a non-empty question about water pollution or water quality.",
+            "debug": {},
+        }
+        return
+
+    start = time.perf_counter()
+    _init_backend()
+    answer, debug_info, fp = _cached_answer(query, start)
+    if answer is not None:
+        log_query(query, answer)
+        yield {"event": "token", "text": answer}
+        yield {"event": "done", "answer": answer, "debug": debug_info}
+        return
+
+    events = queue.Queue()
+    threading.Thread(target=_run_stream, args=(query, start, fp, events),
+                     name="query-stream", daemon=True).start()
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        if isinstance(event, Exception):
+            raise event
+        yield event
+
+
+def _run_stream(query: str, start: float, fp: dict, events: queue.Queue):
+    """
+    在准入槽位内运行 planner 流水线，把事件（或异常，如 Overloaded）放进 events，
+    最后放入 None。槽位由本线程释放，与消费者是否还在读取无关。
+    Run the planner pipeline inside an admission slot, putting its events
+    (or the exception that ended it, e.g. Overloaded) on `events` and then
+    None. This thread releases the slot whether or not anyone still reads.
+    """
+    try:
+        with _admission.admit() as queued_s:
+            budget = LatencyBudget(start=start)
+            for event in get_planner().handle_query_stream(query, budget=budget):
+                if event["event"] == "done":
+                    event["debug"]["admission"] = {"queued_s": round(queued_s, 4)}
+                    _log_answer(query, event["answer"], event["debug"], fp)
+                    _record_first_query(start, event["debug"])
+                events.put(event)
+    except Exception as exc:
+        events.put(exc)
+    finally:
+        events.put(None)
+
+
+STARTUP_TIMINGS["import_s"] = round(time.perf_counter() - _IMPORT_START, 4)
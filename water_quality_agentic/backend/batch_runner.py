@@ -0,0 +1,133 @@
+# backend/batch_runner.py
+# 批量查询：从 JSONL / CSV 读取问题，用有界线程池并行跑 PlannerAgent.handle_query
+# Batch runner: read questions from JSONL/CSV and run them through
+# PlannerAgent.handle_query on a bounded worker pool
+#
+# 用法 / usage (在 water_quality_agentic/ 目录下):
+#   python -m backend.batch_runner questions.jsonl --output answers.jsonl --workers 4
+#
+# 输入：每行 {"id": "...", "query": "..."}，或带 id,query 列的 CSV（id 可省略，默认用行号）
+# 输出：每行 {"id", "query", "status", "answer", "debug_info", "latency_s"}；
+#       重新运行时跳过 status == "ok" 的 id（断点续跑），失败的会重跑。
+
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from backend.metrics import latency_summary
+
+
+def load_queries(path: Path) -> list:
+    """读取 JSONL 或 CSV，返回 [{"id", "query"}, ...] / Load JSONL or CSV questions."""
+    items = []
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for i, row in enumerate(rows):
+            query = (row.get("query") or "").strip()
+            if query:
+                items.append({"id": str(row.get("id") or i), "query": query})
+    return items
+
+
+def load_done_ids(path: Path) -> set:
+    """已成功完成的 id，用于断点续跑 / IDs already answered successfully (for resume)."""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 上次中断时写了一半的行
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+
+def _run_one(planner, item: dict) -> dict:
+    start = time.perf_counter()
+    try:
+        answer, debug_info = planner.handle_query(item["query"])
+        record = {"status": "ok", "answer": answer, "debug_info": debug_info}
+    except Exception as exc:
+        record = {"status": "error", "error": f"{type(exc).__name__}: {exc}"}
+    record.update(id=item["id"], query=item["query"], latency_s=round(time.perf_counter() - start, 4))
+    return record
+
+
+def run_batch(planner, items: list, output: Path, workers: int = 4) -> dict:
+    """
+    有界并行执行：同时在途的任务最多 2 * workers 个；结果按完成顺序逐行追加并 flush。
+    Runs at most 2 * workers tasks in flight and appends each result as soon
+    as it completes, so an interrupted run can be resumed. Returns the report.
+    """
+    done_ids = load_done_ids(output)
+    pending_items = [item for item in items if item["id"] not in done_ids]
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            open(output, "a", encoding="utf-8") as out:
+        queue = iter(pending_items)
+        in_flight = set()
+        while True:
+            while len(in_flight) < 2 * workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                in_flight.add(executor.submit(_run_one, planner, item))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+                if record["status"] == "ok":
+                    latencies.append(record["latency_s"])
+                else:
+                    failed += 1
+
+    wall = time.perf_counter() - start
+    return {
+        "total": len(items),
+        "skipped_already_done": len(items) - len(pending_items),
+        "ok": len(latencies),
+        "failed": failed,
+        "workers": workers,
+        "wall_s": round(wall, 3),
+        "queries_per_s": round(len(pending_items) / wall, 3) if wall > 0 else 0.0,
+        "latency_s": latency_summary(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a batch of water-quality questions.")
+    parser.add_argument("input", type=Path, help="questions file (.jsonl or .csv)")
+    parser.add_argument("--output", type=Path, required=True, help="answers JSONL (appended, resumable)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel workers (default 4)")
+    parser.add_argument("--report", type=Path, help="optional path for the JSON report")
+    args = parser.parse_args(argv)
+
+    from backend.api_server import get_planner
+
+    items = load_queries(args.input)
+    report = run_batch(get_planner(), items, args.output, workers=args.workers)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        args.report.write_text(text + "\n", encoding="utf-8")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# backend/budget.py
+# 延迟预算与准入控制：每个请求一个总预算 + 各阶段截止时间；有界队列 + 满时拒绝
+# Latency budgets and admission control: one budget per request with a
+# deadline per stage, plus a bounded admission queue that rejects when full
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 每个请求的总延迟预算（秒），0 表示不限制
+# Per-request latency budget in seconds; 0 disables deadlines
+LATENCY_BUDGET_S = float(os.getenv("LATENCY_BUDGET_S", "15"))
+
+# 各阶段必须在预算的这一比例之前完成（从请求开始计时，阶段可以并行）
+# Each stage must finish by this fraction of the budget, measured from the
+# start of the request (stages may overlap)
+STAGE_DEADLINES = {
+    "plan": 0.2,
+    "web_fetch": 0.4,
+}
+# 打包上下文时剩余预算低于该比例，就缩小 Summarizer 上下文
+# Below this fraction of the budget left at packing time the summarizer context shrinks
+SUMMARY_RESERVE = 0.5
+SHRUNK_CONTEXT_RATIO = 0.5
+
+
+class Overloaded(Exception):
+    """准入队列已满或排队超时 / Admission queue full or queue wait timed out."""
+
+    def __init__(self, message: str, retry_after_s: float = 1.0):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class LatencyBudget:
+    """
+    - time_left(stage)：距离该阶段截止还有多少秒
+    - remaining()：距离总预算用完还有多少秒
+    - degrade(stage, action, reason)：记录一次降级，写入 debug_info["degradations"]
+    A request's latency budget. Deadlines are absolute (start + fraction of
+    the budget); `start` may predate the pipeline so time spent queueing for
+    admission counts against the budget.
+    """
+
+    def __init__(self, total_s: float = LATENCY_BUDGET_S, start: float = None,
+                 stage_deadlines: dict = None):
+        self.total_s = total_s
+        self.start = start if start is not None else time.perf_counter()
+        self.stage_deadlines = dict(STAGE_DEADLINES, **(stage_deadlines or {}))
+        self.degradations = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.total_s > 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def remaining(self) -> float:
+        return self.total_s - self.elapsed() if self.enabled else float("inf")
+
+    def time_left(self, stage: str):
+        """该阶段剩余时间（秒，不小于 0）；未启用时返回 None（不限时）。"""
+        if not self.enabled:
+            return None
+        deadline = self.total_s * self.stage_deadlines.get(stage, 1.0)
+        return max(0.0, deadline - self.elapsed())
+
+    def tight(self) -> bool:
+        """剩余预算不足以保证 Summarizer 时返回 True / Too little left for a full summary."""
+        return self.enabled and self.remaining() < self.total_s * SUMMARY_RESERVE
+
+    def degrade(self, stage: str, action: str, reason: str):
+        self.degradations.append({
+            "stage": stage, "action": action, "reason": reason,
+            "at_s": round(self.elapsed(), 4),
+        })
+
+    def report(self) -> dict:
+        """预算设置 + 流水线开始时已用掉的时间（排队）/ Settings plus time already spent queueing."""
+        return {"budget_s": self.total_s, "spent_before_pipeline_s": round(self.elapsed(), 4),
+                "stage_deadlines": dict(self.stage_deadlines)}
+
+
+class AdmissionController:
+    """
+    最多 max_in_flight 个请求同时执行；另外最多 max_queue 个排队，
+    队列满或排队超过 queue_timeout_s 时抛出 Overloaded。
+    At most max_in_flight requests run at once and up to max_queue wait;
+    beyond that, or after waiting queue_timeout_s, Overloaded is raised so
+    callers can shed load instead of growing tail latency.
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_queue: int = 32, queue_timeout_s: float = 5.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.counters = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0}
+        self._slots = threading.Semaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+
+    @contextmanager
+    def admit(self):
+        """在执行槽位内运行；返回排队耗时（秒）/ Run inside a slot; yields the queue wait."""
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    self.counters["rejected_full"] += 1
+                    raise Overloaded("admission queue is full")
+                self._waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.queue_timeout_s)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.counters["rejected_timeout"] += 1
+                raise Overloaded("timed out waiting for admission")
+        with self._lock:
+            self.counters["admitted"] += 1
+            self._running += 1
+        try:
+            yield time.perf_counter() - start
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, running=self._running, waiting=self._waiting,
+                        max_in_flight=self.max_in_flight, max_queue=self.max_queue)
@@ -0,0 +1,216 @@
+# backend/db/answer_cache.py
+# 近似重复查询的答案缓存：MinHash + LSH 找候选，Jaccard 相似度判定，数据来自 query_log
+# Near-duplicate answer cache: MinHash/LSH candidate lookup with an exact
+# Jaccard check, backed by past query_log rows
+
+import os
+import random
+import threading
+import time
+import zlib
+from array import array
+
+from backend.agents.rule_planner import classify, key_terms, query_region, rule_need_web
+from backend.db.local_db import recent_answers
+from backend.retrieval.tokenizer import tokenize
+
+NUM_PERM = 64
+BANDS = 16
+DEFAULT_THRESHOLD = 0.7
+# need_web / 时效性问题的答案只保留 6 小时，其它保留 7 天
+# Answers to time-sensitive (need_web) questions expire after 6 hours, others after 7 days
+WEB_TTL_S = 6 * 3600
+STATIC_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+
+# 提问套话，不影响问题本身 / Prompt boilerplate that does not change the question
+QUERY_FILLER = {
+    "research", "analyst", "understand", "know", "tell", "me", "please", "explain",
+    "like", "would", "could", "my", "our", "we", "you", "question", "whether",
+}
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+
+
+def shingles(query: str) -> frozenset:
+    """
+    去套话后的词集合（与词序无关，中文已含双字）。
+    Content-token set; order-insensitive so rephrasings still overlap
+    (Chinese runs already contribute character bigrams).
+    """
+    return frozenset(t for t in tokenize(query) if t not in QUERY_FILLER)
+
+
+def minhash(shingle_set: frozenset) -> array:
+    """稳定（跨进程一致）的 MinHash 签名 / Process-stable MinHash signature."""
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingle_set] or [0]
+    return array("I", (
+        min((a * h + b) % _MERSENNE for h in hashes) & 0xFFFFFFFF for a, b in _PERMS
+    ))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class AnswerCache:
+    """
+    - fingerprint(query)：词集合 + MinHash 签名 + key_terms + 地区 + topic/focus
+    - lookup(query)：LSH 分桶取候选 → key_terms、地区、topic、focus 一致 → Jaccard ≥ threshold → 未过期
+    - add(...)：新答案进入内存索引（持久化由 local_db.log_query 负责）
+    In-memory LSH index over recent answered queries. Candidates must share
+    the same pollutant terms / years, water body or region and rule-planner
+    topic and focus, and reach the Jaccard threshold; entries expire by
+    need_web.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        web_ttl_s: float = WEB_TTL_S,
+        static_ttl_s: float = STATIC_TTL_S,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        enabled: bool = True,
+    ):
+        self.threshold = threshold
+        self.web_ttl_s = web_ttl_s
+        self.static_ttl_s = static_ttl_s
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.counters = {"hits": 0, "misses": 0, "expired": 0}
+        self._entries = {}
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    # ---------- 指纹 ----------
+
+    @staticmethod
+    def fingerprint(query: str, signature: array = None) -> dict:
+        plan = classify(query)
+        sh = shingles(query)
+        return {
+            "shingles": sh,
+            "signature": signature if signature is not None else minhash(sh),
+            "key_terms": key_terms(query),
+            "region": query_region(query),
+            "topic": plan["topic"],
+            "focus": plan["focus"],
+        }
+
+    @staticmethod
+    def _band_keys(signature: array) -> list:
+        rows = NUM_PERM // BANDS
+        return [(i, tuple(signature[i * rows:(i + 1) * rows])) for i in range(BANDS)]
+
+    # ---------- 索引维护 ----------
+
+    def add(self, query: str, answer: str, need_web: bool, fp: dict = None,
+            created_at: float = None):
+        """把一个已回答的查询放进索引 / Index one answered query."""
+        if not self.enabled or not answer:
+            return
+        fp = fp or self.fingerprint(query)
+        entry = dict(fp, query=query, answer=answer, need_web=bool(need_web),
+                     created_at=created_at if created_at is not None else time.time())
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for key in self._band_keys(entry["signature"]):
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        for key in self._band_keys(entry["signature"]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def load(self, rows):
+        """
+        从 query_log 行 (query, answer, need_web, minhash, created_at) 重建索引。
+        Rebuild the index from query_log rows, oldest first.
+        """
+        for query, answer, need_web, blob, created_at in rows:
+            signature = array("I")
+            signature.frombytes(blob)
+            self.add(query, answer, need_web, self.fingerprint(query, signature), created_at)
+
+    def ttl_for(self, need_web: bool) -> float:
+        return self.web_ttl_s if need_web else self.static_ttl_s
+
+    # ---------- 查询 ----------
+
+    def lookup(self, query: str, fp: dict = None):
+        """
+        命中返回 {"answer", "source_query", "similarity", "age_s"}，否则 None。
+        Return the best fresh near-duplicate answer, or None.
+        """
+        if not self.enabled:
+            return None
+        fp = fp or self.fingerprint(query)
+        now = time.time()
+        # 新问题本身有时效性时，也按短 TTL 判断 / a time-sensitive query also gets the short TTL
+        query_need_web = rule_need_web(query)
+        best, best_sim, expired = None, 0.0, False
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(fp["signature"]):
+                candidates |= self._buckets.get(key, set())
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if (entry["key_terms"] != fp["key_terms"] or entry["region"] != fp["region"]
+                        or entry["topic"] != fp["topic"] or entry["focus"] != fp["focus"]):
+                    continue
+                sim = jaccard(entry["shingles"], fp["shingles"])
+                if sim < self.threshold or sim <= best_sim:
+                    continue
+                if now - entry["created_at"] > self.ttl_for(entry["need_web"] or query_need_web):
+                    expired = True
+                    continue
+                best, best_sim = entry, sim
+            if best is None:
+                self.counters["expired" if expired else "misses"] += 1
+                return None
+            self.counters["hits"] += 1
+        return {
+            "answer": best["answer"],
+            "source_query": best["query"],
+            "similarity": round(best_sim, 3),
+            "age_s": round(now - best["created_at"], 1),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries))
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    进程内共享的答案缓存，首次使用时从 query_log 加载；ANSWER_CACHE=0 时禁用。
+    Process-wide answer cache loaded from query_log on first use (ANSWER_CACHE=0 disables).
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            cache = AnswerCache(
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", str(DEFAULT_THRESHOLD))),
+                enabled=os.getenv("ANSWER_CACHE", "1") != "0",
+            )
+            if cache.enabled:
+                cache.load(recent_answers(cache.max_entries, max_age_s=cache.static_ttl_s))
+            _shared_cache = cache
+        return _shared_cache
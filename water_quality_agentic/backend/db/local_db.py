@@ -1,10 +1,45 @@
 # backend/db/local_db.py
 # 简单的 SQLite 工具类 / Simple SQLite helper
+# 答案按内容寻址存储：每个不同的答案只存一份压缩 blob，query_log / reflection_log 只存哈希
+# Answers are content-addressed: one compressed blob per distinct answer,
+# referenced by hash from query_log and reflection_log
 
+import hashlib
+import os
 import sqlite3
+import threading
+import time
+import zlib
 from pathlib import Path
 
-DB_PATH = Path(__file__).resolve().parents[2] / "data" / "sample_reflections.db"
+from backend.db.log_writer import BatchLogWriter
+from backend.metrics import latency_summary
+
+# WQ_DB_PATH 可指向其它数据库文件（例如 benchmark 使用的临时库）
+# WQ_DB_PATH points logging at another database file (e.g. a benchmark scratch DB)
+DB_PATH = Path(os.getenv(
+    "WQ_DB_PATH", Path(__file__).resolve().parents[2] / "data" / "sample_reflections.db"
+))
+
+# DB_LOG_MODE=sync 时回到每次写入都提交的同步模式
+# DB_LOG_MODE=sync falls back to one synchronous commit per log call
+DB_LOG_MODE = os.getenv("DB_LOG_MODE", "batched")
+
+# PRAGMA user_version：达到该版本的库已完成答案 blob 迁移
+# PRAGMA user_version at which inline answers have been moved into answer_blobs
+SCHEMA_VERSION = 1
+
+# 评估 worker 认领的反馈超过这么多秒仍未写回分数（worker 退出），可被重新认领
+# Claimed feedback still unscored after this many seconds (worker died) can be claimed again
+CLAIM_LEASE_S = float(os.getenv("REFLECTION_CLAIM_LEASE_S", "600"))
+
+# 每轮保留期清理最多归还的空闲页数，避免一次 incremental_vacuum 长时间占用写锁
+# Free pages returned per retention pass, so one incremental_vacuum never holds
+# the write lock for long
+RECLAIM_PAGES = int(os.getenv("RECLAIM_PAGES", "2000"))
+
+_writer = None
+_writer_lock = threading.Lock()
 
 
 def get_conn():
@@ -12,20 +47,183 @@ def get_conn():
     return conn
 
 
+def get_writer():
+    """
+    返回进程内共享的后台批量写入器；同步模式下返回 None。
+    Process-wide BatchLogWriter, or None in synchronous mode.
+    """
+    global _writer
+    if DB_LOG_MODE == "sync":
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = BatchLogWriter(DB_PATH)
+        return _writer
+
+
+def flush_logs():
+    """等待所有排队的日志写入完成 / Wait until queued log writes are committed."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def _write(sql, params: tuple = ()):
+    """
+    批量模式下入队，同步模式下立即提交；sql 也可以是 fn(conn, *params)。
+    Enqueue, or commit immediately in sync mode; `sql` may be a callable fn(conn, *params).
+    """
+    writer = get_writer()
+    if writer is not None:
+        writer.submit(sql, params)
+        return
+    conn = get_conn()
+    if callable(sql):
+        sql(conn, *params)
+    else:
+        conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+# ---------- 内容寻址的答案存储 / content-addressed answer storage ----------
+
+def text_digest(text: str) -> bytes:
+    """
+    查询 / 答案文本的 128 位 BLAKE2b 摘要（原始字节，索引比十六进制字符串小一半）。
+    128-bit BLAKE2b digest of a query or answer text, stored as raw bytes so
+    the indexes stay half the size of hex strings.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def unpack_answer(body) -> str:
+    """解压 answer_blobs.body；body 为 None 时返回 None / Decompress a stored answer."""
+    return None if body is None else zlib.decompress(body).decode("utf-8")
+
+
+def _store_answer(conn, text: str):
+    """
+    写入一个答案 blob（已存在时跳过，不重复压缩），返回哈希；空答案返回 None。
+    Store one answer blob unless it already exists and return its hash
+    (None for an empty answer). Runs inside the caller's transaction, so a
+    rolled-back event leaves no row pointing at a blob that was never stored.
+    """
+    if not text:
+        return None
+    digest = text_digest(text)
+    if conn.execute("SELECT 1 FROM answer_blobs WHERE hash = ?;", (digest,)).fetchone() is None:
+        raw = text.encode("utf-8")
+        conn.execute(
+            "INSERT OR IGNORE INTO answer_blobs (hash, body, size) VALUES (?, ?, ?);",
+            (digest, zlib.compress(raw, 6), len(raw)),
+        )
+    return digest
+
+
+def _migrate_answers(conn):
+    """
+    旧库迁移：把 query_log / reflection_log 中的明文答案和翻译移进 answer_blobs，
+    原列置空。只处理还没有哈希的行，重复执行是安全的。
+    Move inline answers and translations of older databases into
+    answer_blobs and clear the inline columns; idempotent.
+    """
+    rows = conn.execute(
+        """
+        SELECT id, query, answer, answer_zh FROM query_log
+        WHERE query_hash IS NULL OR answer IS NOT NULL OR answer_zh IS NOT NULL;
+        """
+    ).fetchall()
+    conn.executemany(
+        """
+        UPDATE query_log SET query_hash = ?, answer_hash = COALESCE(?, answer_hash),
+            answer_zh_hash = COALESCE(?, answer_zh_hash), answer = NULL, answer_zh = NULL
+        WHERE id = ?;
+        """,
+        [(text_digest(query or ""), _store_answer(conn, answer), _store_answer(conn, answer_zh),
+          row_id) for row_id, query, answer, answer_zh in rows],
+    )
+    rows = conn.execute(
+        "SELECT id, query, answer FROM reflection_log WHERE query_hash IS NULL OR answer IS NOT NULL;"
+    ).fetchall()
+    conn.executemany(
+        """
+        UPDATE reflection_log SET query_hash = ?, answer_hash = COALESCE(?, answer_hash),
+            answer = NULL
+        WHERE id = ?;
+        """,
+        [(text_digest(query or ""), _store_answer(conn, answer), row_id)
+         for row_id, query, answer in rows],
+    )
+
+
+def _add_columns(cur, table: str, columns: tuple):
+    """旧库补列 / Add columns missing from an older database."""
+    existing = {row[1] for row in cur.execute(f"PRAGMA table_info({table});")}
+    for column, decl in columns:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl};")
+
+
 def init_db():
     """初始化数据库表 / Initialize tables if not exist."""
     conn = get_conn()
+    # 新库启用增量 VACUUM（必须在建表之前设置），保留期清理后可以归还空闲页；
+    # 对已有的库无效，旧库用 python -m backend.db.retention --enable-incremental-vacuum 转换
+    # New databases use incremental auto-vacuum (must precede the first table),
+    # so retention compaction can hand free pages back to the filesystem; this
+    # is a no-op on existing files, which are converted explicitly with
+    # python -m backend.db.retention --enable-incremental-vacuum
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    # WAL：读写互不阻塞，避免并发写入时 database is locked
+    # WAL lets readers and the writer proceed concurrently
+    conn.execute("PRAGMA journal_mode=WAL;")
     cur = conn.cursor()
+    # 每个不同的答案 / 翻译一行，zlib 压缩；size 是压缩前的字节数
+    # One zlib-compressed row per distinct answer or translation; size is uncompressed bytes
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS answer_blobs (
+            hash BLOB PRIMARY KEY,
+            body BLOB,
+            size INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    # answer / answer_zh 为旧版明文列，新写入的行为 NULL（内容在 answer_blobs）
+    # answer / answer_zh are legacy inline columns, NULL for new rows (content lives in answer_blobs)
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS query_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             query TEXT,
             answer TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            need_web INTEGER,
+            minhash BLOB,
+            answer_zh TEXT,
+            query_hash BLOB,
+            answer_hash BLOB,
+            answer_zh_hash BLOB
         );
         """
     )
+    # 旧库补列：need_web / minhash 供近似重复答案缓存使用，answer_zh 存按需生成的中文翻译，
+    # *_hash 指向 answer_blobs
+    # Migrate older databases: need_web / minhash back the near-duplicate answer
+    # cache, answer_zh holds the on-demand Chinese translation, *_hash point into answer_blobs
+    _add_columns(cur, "query_log", (
+        ("need_web", "INTEGER"), ("minhash", "BLOB"), ("answer_zh", "TEXT"),
+        ("query_hash", "BLOB"), ("answer_hash", "BLOB"), ("answer_zh_hash", "BLOB"),
+    ))
+    # 按查询哈希查历史，按时间查最近 / 清理过期；查询文本本身的索引不再需要
+    # History lookups go through the query hash, recency and retention through
+    # created_at; the index on the raw query text is no longer needed
+    cur.execute("DROP INDEX IF EXISTS idx_query_log_query;")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_query_log_query_hash ON query_log (query_hash, answer_hash);"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_query_log_created_at ON query_log (created_at);")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS reflection_log (
@@ -35,36 +233,574 @@ def init_db():
             feedback TEXT,
             quality_score INTEGER,
             notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'scored',
+            evaluator TEXT,
+            query_log_id INTEGER,
+            scored_at TIMESTAMP,
+            query_hash BLOB,
+            answer_hash BLOB,
+            claimed_at TIMESTAMP
+        );
+        """
+    )
+    # 旧库补列：status = pending / scoring / scored，由后台评估 worker 更新
+    # Migrate older databases: status (pending / scoring / scored) is driven by
+    # the background evaluation workers
+    _add_columns(cur, "reflection_log", (
+        ("status", "TEXT DEFAULT 'scored'"), ("evaluator", "TEXT"), ("query_log_id", "INTEGER"),
+        ("scored_at", "TIMESTAMP"), ("query_hash", "BLOB"), ("answer_hash", "BLOB"),
+        ("claimed_at", "TIMESTAMP"),
+    ))
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reflection_log_status ON reflection_log (status, id);"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reflection_log_created_at ON reflection_log (created_at);"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reflection_log_query_hash ON reflection_log (query_hash);"
+    )
+    # 批量重评分的断点：每个 run 记录已处理到的 query_log id
+    # Bulk re-scoring checkpoints: the last query_log id each named run has scored
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS evaluation_runs (
+            name TEXT PRIMARY KEY,
+            last_query_log_id INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            status TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    # 每个查询每个阶段一行：耗时 + LLM token 用量
+    # One row per query per pipeline stage: wall time plus LLM token usage
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stage_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query_log_id INTEGER,
+            stage TEXT,
+            duration_ms REAL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            llm_calls INTEGER,
+            cache_hits INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """
     )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stage_metrics_stage ON stage_metrics (stage, id);"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stage_metrics_query_log_id ON stage_metrics (query_log_id);"
+    )
+    (version,) = conn.execute("PRAGMA user_version;").fetchone()
+    if version < SCHEMA_VERSION:
+        _migrate_answers(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
     conn.commit()
     conn.close()
 
 
-def log_query(query: str, answer: str = ""):
-    """记录一次查询 / Log a query."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO query_log (query, answer) VALUES (?, ?);",
-        (query, answer),
+_INSERT_QUERY_LOG = """
+    INSERT INTO query_log (query, query_hash, answer_hash, need_web, minhash)
+    VALUES (?, ?, ?, ?, ?);
+"""
+
+
+def log_query(query: str, answer: str = "", spans: list = None,
+              need_web: bool = None, minhash: bytes = None):
+    """
+    记录一次查询；spans 为 Trace.spans 时同时写入 stage_metrics，
+    并额外记录一个 "db_log" span（写入本身的耗时）。
+    need_web / minhash 供答案缓存在重启后重建索引。
+    Log a query, plus one stage_metrics row per span (and a "db_log" span
+    measuring the write itself) when `spans` is given. need_web / minhash
+    let the answer cache rebuild its index after a restart. Hashing and
+    compression happen on the writer thread, off the request path.
+    """
+    _write(_write_query_log, (query, answer, None if need_web is None else int(need_web),
+                              minhash, list(spans) if spans else None))
+
+
+def _write_query_log(conn, query: str, answer: str, need_web, minhash, spans):
+    """在写入连接上执行 log_query / log_query's writes, on the writer connection."""
+    start = time.perf_counter()
+    cur = conn.execute(_INSERT_QUERY_LOG, (
+        query, text_digest(query), _store_answer(conn, answer), need_web, minhash,
+    ))
+    if not spans:
+        return
+    query_log_id = cur.lastrowid
+    rows = [
+        (query_log_id, s["stage"], s["duration_ms"], s.get("prompt_tokens", 0),
+         s.get("completion_tokens", 0), s.get("llm_calls", 0), s.get("cache_hits", 0))
+        for s in spans
+    ]
+    rows.append((query_log_id, "db_log",
+                 round((time.perf_counter() - start) * 1000, 2), 0, 0, 0, 0))
+    conn.executemany(
+        """
+        INSERT INTO stage_metrics (query_log_id, stage, duration_ms, prompt_tokens,
+                                   completion_tokens, llm_calls, cache_hits)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
+        """,
+        rows,
     )
-    conn.commit()
+
+
+def get_translation(query: str, answer: str):
+    """
+    已缓存的中文翻译，没有时返回 None。
+    Cached Chinese translation of a logged answer, or None.
+    """
+    flush_logs()
+    conn = get_conn()
+    row = conn.execute(
+        """
+        SELECT b.body FROM query_log q LEFT JOIN answer_blobs b ON b.hash = q.answer_zh_hash
+        WHERE q.query_hash = ? AND q.answer_hash = ? AND q.answer_zh_hash IS NOT NULL
+        ORDER BY q.id DESC LIMIT 1;
+        """,
+        (text_digest(query), text_digest(answer)),
+    ).fetchone()
     conn.close()
+    # blob 缺失时当作没有缓存，重新翻译 / a missing blob counts as no cached translation
+    return unpack_answer(row[0]) if row else None
+
+
+def save_translation(query: str, answer: str, answer_zh: str):
+    """把中文翻译写回对应的 query_log 行 / Store a translation next to its logged answer."""
+    _write(lambda conn: conn.execute(
+        "UPDATE query_log SET answer_zh_hash = ? WHERE query_hash = ? AND answer_hash = ?;",
+        (_store_answer(conn, answer_zh), text_digest(query), text_digest(answer)),
+    ))
 
 
-def log_reflection(query: str, answer: str, feedback: str, score: int, notes: str):
+def recent_queries(limit: int, max_age_s: float) -> list:
+    """
+    最近的查询，按时间从新到旧：[(query, need_web), ...]，供 web 预取统计热度。
+    Recent queries, newest first, for the web prefetcher's popularity counts.
+    """
+    flush_logs()
+    conn = get_conn()
+    rows = conn.execute(
+        """
+        SELECT query, need_web FROM query_log
+        WHERE created_at >= datetime('now', ?)
+        ORDER BY id DESC LIMIT ?;
+        """,
+        (f"-{int(max_age_s)} seconds", limit),
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def recent_answers(limit: int, max_age_s: float) -> list:
+    """
+    带 MinHash 指纹的最近回答，按时间从旧到新：
+    [(query, answer, need_web, minhash, created_at_epoch), ...]
+    Recent fingerprinted answers, oldest first, for the answer cache.
+    """
+    flush_logs()
+    conn = get_conn()
+    rows = conn.execute(
+        """
+        SELECT q.query, b.body, q.need_web, q.minhash,
+               CAST(strftime('%s', q.created_at) AS REAL) AS ts
+        FROM query_log q LEFT JOIN answer_blobs b ON b.hash = q.answer_hash
+        WHERE q.minhash IS NOT NULL AND q.created_at >= datetime('now', ?)
+        ORDER BY q.id DESC LIMIT ?;
+        """,
+        (f"-{int(max_age_s)} seconds", limit),
+    ).fetchall()
+    conn.close()
+    # 缺失 blob 的行不能复用（没有答案文本），但不影响其它行
+    # rows whose blob is missing cannot be reused, but never hide the others
+    return [(query, unpack_answer(body), need_web, minhash, ts)
+            for query, body, need_web, minhash, ts in reversed(rows) if body is not None]
+
+
+def storage_stats() -> dict:
+    """
+    答案存储的去重 / 压缩效果和数据库页统计。
+    Answer-store dedup / compression figures plus database page counts.
+    """
+    flush_logs()
+    conn = get_conn()
+    (query_rows,) = conn.execute("SELECT COUNT(*) FROM query_log;").fetchone()
+    (reflection_rows,) = conn.execute("SELECT COUNT(*) FROM reflection_log;").fetchone()
+    blobs, raw_bytes, stored_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM answer_blobs;"
+    ).fetchone()
+    pages = {name: conn.execute(f"PRAGMA {name};").fetchone()[0]
+             for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")}
+    conn.close()
+    return {
+        "query_log_rows": query_rows,
+        "reflection_log_rows": reflection_rows,
+        "answer_blobs": blobs,
+        "answer_raw_bytes": raw_bytes,
+        "answer_stored_bytes": stored_bytes,
+        "file_bytes": pages["page_size"] * pages["page_count"],
+        "free_pages": pages["freelist_count"],
+        "incremental_vacuum": pages["auto_vacuum"] == 2,
+    }
+
+
+def stage_latency_summary(limit: int = 1000) -> list:
+    """
+    最近 limit 个查询中每个阶段的 p50 / p95 / p99 延迟（毫秒）和平均 token 用量。
+    Per-stage latency percentiles (ms) and mean token usage over the most
+    recent `limit` logged queries.
+    """
+    flush_logs()
+    conn = get_conn()
+    rows = conn.execute(
+        """
+        SELECT stage, duration_ms, prompt_tokens, completion_tokens, cache_hits
+        FROM stage_metrics
+        WHERE query_log_id >= (
+            SELECT COALESCE(MIN(query_log_id), 0) FROM (
+                SELECT DISTINCT query_log_id FROM stage_metrics
+                ORDER BY query_log_id DESC LIMIT ?
+            )
+        );
+        """,
+        (limit,),
+    ).fetchall()
+    conn.close()
+
+    by_stage = {}
+    for stage, duration_ms, prompt_tokens, completion_tokens, cache_hits in rows:
+        by_stage.setdefault(stage, []).append(
+            (duration_ms, prompt_tokens or 0, completion_tokens or 0, cache_hits or 0)
+        )
+    summary = []
+    for stage, values in by_stage.items():
+        lat = latency_summary([v[0] for v in values])
+        n = len(values)
+        summary.append({
+            "stage": stage,
+            "count": n,
+            "p50_ms": lat["p50"],
+            "p95_ms": lat["p95"],
+            "p99_ms": lat["p99"],
+            "avg_prompt_tokens": round(sum(v[1] for v in values) / n, 1),
+            "avg_completion_tokens": round(sum(v[2] for v in values) / n, 1),
+            "cache_hits": sum(v[3] for v in values),
+        })
+    summary.sort(key=lambda row: row["p95_ms"], reverse=True)
+    return summary
+
+
+_INSERT_REFLECTION = """
+    INSERT INTO reflection_log (query, query_hash, answer_hash, feedback, quality_score, notes,
+                                status, evaluator, query_log_id, scored_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+            CASE WHEN ? = 'pending' THEN NULL ELSE CURRENT_TIMESTAMP END);
+"""
+
+
+def _reflection_row(conn, query: str, answer: str, feedback: str, score, notes: str,
+                    status: str, evaluator, query_log_id) -> tuple:
+    """_INSERT_REFLECTION 的参数；答案存为 blob / Parameters, with the answer stored as a blob."""
+    return (query, text_digest(query), _store_answer(conn, answer), feedback, score, notes,
+            status, evaluator, query_log_id, status)
+
+
+def log_reflection(query: str, answer: str, feedback: str, score: int, notes: str,
+                   status: str = "scored", evaluator: str = "rule", query_log_id: int = None):
     """记录一次反思结果 / Log one reflection entry."""
+    _write(lambda conn: conn.execute(_INSERT_REFLECTION, _reflection_row(
+        conn, query, answer, feedback, score, notes, status, evaluator, query_log_id)))
+
+
+def enqueue_reflection(query: str, answer: str, feedback: str):
+    """
+    只记录待评估的反馈（status = pending），由后台 worker 打分。
+    Record feedback as pending; the evaluation worker scores it later.
+    """
+    log_reflection(query, answer, feedback, None, "", status="pending", evaluator=None)
+
+
+# ---------- 评估 worker / evaluation worker ----------
+
+def claim_reflections(limit: int, lease_s: float = CLAIM_LEASE_S) -> list:
+    """
+    认领最多 limit 条待打分的反馈（pending → scoring），按 id 从旧到新返回
+    [(id, query, answer, feedback), ...]。认领在一个写事务里完成，每个进程都有
+    评估 worker 时一行也只会被一个 worker 打分；认领超过 lease_s 秒仍是 scoring 的行
+    （worker 中途退出）会被重新认领。
+    Claim up to `limit` pending reflections (pending -> scoring) in one
+    write transaction, so with an evaluation worker in every process each
+    row is scored by one worker only. Rows left in scoring for more than
+    lease_s seconds (their worker died) are claimed again.
+    """
+    flush_logs()
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        ids = [row[0] for row in conn.execute(
+            """
+            SELECT id FROM reflection_log
+            WHERE status = 'pending'
+               OR (status = 'scoring' AND claimed_at < datetime('now', ?))
+            ORDER BY id LIMIT ?;
+            """,
+            (f"-{lease_s} seconds", limit),
+        )]
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"UPDATE reflection_log SET status = 'scoring', claimed_at = CURRENT_TIMESTAMP "
+            f"WHERE id IN ({marks});",
+            ids,
+        )
+        conn.commit()
+        rows = conn.execute(
+            f"""
+            SELECT r.id, r.query, b.body, r.feedback
+            FROM reflection_log r LEFT JOIN answer_blobs b ON b.hash = r.answer_hash
+            WHERE r.id IN ({marks}) ORDER BY r.id;
+            """,
+            ids,
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(row_id, query, unpack_answer(body) or "", feedback)
+            for row_id, query, body, feedback in rows]
+
+
+def save_reflection_scores(results: list):
+    """
+    写回一批打分结果：[{"id", "score", "notes", "evaluator", "status"}, ...]
+    Store one batch of scores for pending reflection rows.
+    """
+    _write(lambda conn: conn.executemany(
         """
-        INSERT INTO reflection_log (query, answer, feedback, quality_score, notes)
-        VALUES (?, ?, ?, ?, ?);
+        UPDATE reflection_log
+        SET quality_score = ?, notes = ?, evaluator = ?, status = ?, scored_at = CURRENT_TIMESTAMP
+        WHERE id = ?;
         """,
-        (query, answer, feedback, score, notes),
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+        [(r["score"], r["notes"], r["evaluator"], r["status"], r["id"]) for r in results],
+    ))
+
+
+def reflection_status_counts() -> dict:
+    """各状态的反馈条数 / Reflection rows per status."""
+    flush_logs()
+    conn = get_conn()
+    rows = conn.execute(
+        "SELECT COALESCE(status, 'scored'), COUNT(*) FROM reflection_log GROUP BY 1;"
+    ).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def get_evaluation_run(name: str) -> dict:
+    """某个重评分 run 的断点，没有时返回初始值 / Checkpoint of one re-scoring run."""
+    flush_logs()
+    conn = get_conn()
+    row = conn.execute(
+        "SELECT last_query_log_id, done, total, status FROM evaluation_runs WHERE name = ?;",
+        (name,),
+    ).fetchone()
+    conn.close()
+    if row is None:
+        return {"name": name, "last_query_log_id": 0, "done": 0, "total": 0, "status": None}
+    return {"name": name, "last_query_log_id": row[0], "done": row[1], "total": row[2],
+            "status": row[3]}
+
+
+def query_log_page(after_id: int, limit: int) -> list:
+    """
+    id > after_id 的已回答查询：[(id, query, answer), ...]；blob 缺失时 answer 为 None。
+    Answered queries after after_id; answer is None when its blob is missing.
+    """
+    flush_logs()
+    conn = get_conn()
+    rows = conn.execute(
+        """
+        SELECT q.id, q.query, b.body
+        FROM query_log q LEFT JOIN answer_blobs b ON b.hash = q.answer_hash
+        WHERE q.id > ? AND q.answer_hash IS NOT NULL ORDER BY q.id LIMIT ?;
+        """,
+        (after_id, limit),
+    ).fetchall()
+    conn.close()
+    return [(row_id, query, unpack_answer(body)) for row_id, query, body in rows]
+
+
+def count_query_log(after_id: int = 0) -> int:
+    flush_logs()
+    conn = get_conn()
+    (count,) = conn.execute(
+        "SELECT COUNT(*) FROM query_log WHERE id > ? AND answer_hash IS NOT NULL;",
+        (after_id,),
+    ).fetchone()
+    conn.close()
+    return count
+
+
+def save_rescore_page(run: dict, results: list):
+    """
+    一页重评分结果和断点在同一个事务里提交，中断后从断点继续不会重复或遗漏。
+    Commit one page of re-scored rows together with the run checkpoint, so a
+    resumed run neither repeats nor skips rows.
+    """
+    checkpoint = (run["name"], run["last_query_log_id"], run["done"], run["total"], run["status"])
+
+    def write(conn):
+        conn.executemany(_INSERT_REFLECTION, [
+            _reflection_row(conn, r["query"], r["answer"], "", r["score"], r["notes"],
+                            r["status"], r["evaluator"], r["id"])
+            for r in results
+        ])
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO evaluation_runs
+                (name, last_query_log_id, done, total, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP);
+            """,
+            checkpoint,
+        )
+
+    _write(write)
+
+
+# ---------- 保留期与压缩 / retention and compaction ----------
+
+# 每张表中“过期”的条件；待评估 / 评估中的反馈不会被归档
+# What "expired" means per table; unscored feedback is never archived
+RETENTION_TABLES = {
+    "query_log": "created_at < datetime('now', ?)",
+    "reflection_log": ("created_at < datetime('now', ?) "
+                       "AND COALESCE(status, 'scored') NOT IN ('pending', 'scoring')"),
+    "stage_metrics": "created_at < datetime('now', ?)",
+}
+# 归档时还原成文本的哈希列 / hash columns restored to text in archived rows
+_BLOB_COLUMNS = {"answer_hash": "answer", "answer_zh_hash": "answer_zh"}
+
+
+def expired_rows(table: str, max_age_s: float, limit: int) -> list:
+    """
+    最旧的一批过期行（dict，按 id 升序），答案 / 翻译已解压成文本，minhash 去掉。
+    The oldest batch of expired rows as dicts with answers decompressed
+    (hash columns as hex).
+    """
+    flush_logs()
+    conn = get_conn()
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(
+        f"SELECT * FROM {table} WHERE {RETENTION_TABLES[table]} ORDER BY id LIMIT ?;",
+        (f"-{int(max_age_s)} seconds", limit),
+    )]
+    hashes = {row[col] for row in rows for col in _BLOB_COLUMNS if row.get(col)}
+    bodies = {}
+    if hashes:
+        marks = ",".join("?" * len(hashes))
+        bodies = dict(conn.execute(
+            f"SELECT hash, body FROM answer_blobs WHERE hash IN ({marks});", tuple(hashes)
+        ).fetchall())
+    conn.close()
+    for row in rows:
+        row.pop("minhash", None)
+        for col, text_col in _BLOB_COLUMNS.items():
+            if col in row:
+                row[text_col] = row[text_col] or unpack_answer(bodies.get(row[col]))
+        for col in ("query_hash", "answer_hash", "answer_zh_hash"):
+            if row.get(col) is not None:
+                row[col] = row[col].hex()
+    return rows
+
+
+def delete_rows(table: str, ids: list):
+    """删除已归档的行（经由写入线程，与日志写入串行）/ Delete archived rows via the writer."""
+    if table not in RETENTION_TABLES:
+        raise ValueError(f"unknown table {table}")
+    _write(lambda conn: conn.executemany(f"DELETE FROM {table} WHERE id = ?;",
+                                         [(i,) for i in ids]))
+    flush_logs()
+
+
+def prune_answer_blobs() -> int:
+    """
+    删除不再被任何行引用的答案 blob，返回删除数。
+    在写入线程上执行，不会与正在引用该 blob 的新写入交错。
+    Drop answer blobs no row references any more. Runs on the writer so it
+    cannot interleave with a write that is about to reuse a blob.
+    """
+    pruned = []
+
+    def prune(conn):
+        cur = conn.execute(
+            """
+            DELETE FROM answer_blobs WHERE hash NOT IN (
+                SELECT answer_hash FROM query_log WHERE answer_hash IS NOT NULL
+                UNION SELECT answer_zh_hash FROM query_log WHERE answer_zh_hash IS NOT NULL
+                UNION SELECT answer_hash FROM reflection_log WHERE answer_hash IS NOT NULL
+            );
+            """
+        )
+        pruned.append(cur.rowcount)
+
+    _write(prune)
+    flush_logs()
+    return pruned[0] if pruned else 0
+
+
+def reclaim_space(max_pages: int = RECLAIM_PAGES) -> dict:
+    """
+    把最多 max_pages 个空闲页还给文件系统。只在已启用增量 VACUUM 的库上执行
+    incremental_vacuum；旧库（auto_vacuum=0）不做任何事，切换模式需要一次完整 VACUUM，
+    只能通过 enable_incremental_vacuum() 显式执行。
+    Return up to max_pages free pages to the filesystem. Only databases already
+    in incremental mode are touched; an older database is left alone, because
+    switching modes costs a full VACUUM and is an explicit maintenance step
+    (enable_incremental_vacuum).
+    """
+    flush_logs()
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    (mode,) = conn.execute("PRAGMA auto_vacuum;").fetchone()
+    free_before = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+    if mode != 2:
+        conn.close()
+        return {"action": "skipped", "auto_vacuum": mode, "freed_pages": 0,
+                "free_pages": free_before}
+    # execute() 只 step 一次，只会释放一页；executescript 把语句执行完
+    # execute() steps the pragma once and frees a single page; executescript runs it to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    free_after = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.close()
+    return {"action": "incremental_vacuum", "auto_vacuum": mode,
+            "freed_pages": free_before - free_after, "free_pages": free_after}
+
+
+def enable_incremental_vacuum() -> dict:
+    """
+    一次性维护步骤：把旧库切换为增量 auto_vacuum。需要一次完整 VACUUM（重写整个文件、
+    期间阻塞所有写入），所以只由命令行显式调用，后台任务从不执行。
+    One-time maintenance step that switches an older database to incremental
+    auto-vacuum. This rewrites the whole file with a full VACUUM and blocks
+    writers meanwhile, so it only runs from the command line, never from the
+    background job.
+    """
+    flush_logs()
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    (mode,) = conn.execute("PRAGMA auto_vacuum;").fetchone()
+    if mode == 2:
+        conn.close()
+        return {"action": "none", "auto_vacuum": mode}
+    start = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    conn.execute("VACUUM;")
+    (mode,) = conn.execute("PRAGMA auto_vacuum;").fetchone()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.close()
+    return {"action": "vacuum", "auto_vacuum": mode,
+            "duration_s": round(time.perf_counter() - start, 4)}
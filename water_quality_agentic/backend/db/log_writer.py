@@ -0,0 +1,169 @@
+# backend/db/log_writer.py
+# 后台批量写入：持久连接 + WAL + 队列 + 按数量 / 时间批量提交
+# Background batched writer: one persistent WAL connection fed by a queue,
+# committing in batches by size or time interval
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+_STOP = object()
+# flush 标记以 (_FLUSH, threading.Event) 入队，所在批次提交后 set
+# Flush markers are queued as (_FLUSH, threading.Event), set once their batch commits
+_FLUSH = object()
+
+
+class BatchLogWriter:
+    """
+    请求线程只把 (sql, params) 放进队列，立即返回；
+    后台线程攒够 batch_size 条或等待超过 flush_interval_s 后一次性提交。
+    Request threads enqueue (sql, params) and return immediately; a daemon
+    thread executes them on one WAL-mode connection and commits once per
+    batch (batch_size events or flush_interval_s, whichever comes first).
+    """
+
+    def __init__(self, db_path, batch_size: int = 64, flush_interval_s: float = 0.5,
+                 flush_timeout_s: float = 2.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.flush_timeout_s = flush_timeout_s
+        self.counters = {"events": 0, "batches": 0, "errors": 0, "flush_timeouts": 0}
+        self._queue = queue.Queue()
+        # submit / close 的切换要原子，否则事件可能排在 _STOP 之后永远不被处理
+        # submit and close switch under a lock so no event lands behind _STOP
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute("PRAGMA journal_mode=WAL;")
+        # WAL 下 NORMAL 只在 checkpoint 时 fsync / NORMAL only fsyncs at checkpoints under WAL
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        return conn
+
+    def submit(self, sql, params: tuple = ()):
+        """
+        放入一条写入事件；sql 也可以是 fn(conn, *params)，用于需要 lastrowid 的多条写入。
+        Enqueue one write event; `sql` may also be a callable fn(conn, *params)
+        for multi-statement writes that need lastrowid.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchLogWriter is closed")
+            self._queue.put((sql, params))
+
+    def _run(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get()
+            except Exception:
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval_s
+            while len(batch) < self.batch_size and not self._is_marker(batch[-1]):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                stopping = self._write_batch(conn, batch)
+            except Exception:
+                # 整批失败（例如 BEGIN / COMMIT 时库被锁）也不能让写入线程退出
+                # a failed batch (e.g. locked at BEGIN / COMMIT) must not kill the writer thread
+                self.counters["errors"] += 1
+                stopping = _STOP in batch
+        conn.close()
+
+    @staticmethod
+    def _is_marker(item) -> bool:
+        return item is _STOP or item[0] is _FLUSH
+
+    def _write_batch(self, conn, batch: list) -> bool:
+        """
+        执行并提交一批事件；遇到停止标记返回 True。每个事件在自己的 SAVEPOINT 里执行，
+        出错（任何异常）时只回滚该事件，多条语句的事件（blob + 行）不会只写一半。
+        Commit one batch; True on the stop marker. Each event runs inside its
+        own SAVEPOINT, so a failing event (any exception) is rolled back on
+        its own and a multi-statement event is never half-committed.
+        """
+        stopping = False
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN;")
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                sql, params = item
+                if sql is _FLUSH:
+                    continue
+                conn.execute("SAVEPOINT log_event;")
+                try:
+                    if callable(sql):
+                        sql(conn, *params)
+                    else:
+                        conn.execute(sql, params)
+                except Exception:
+                    conn.execute("ROLLBACK TO log_event;")
+                    self.counters["errors"] += 1
+                else:
+                    self.counters["events"] += 1
+                conn.execute("RELEASE log_event;")
+            conn.commit()
+            self.counters["batches"] += 1
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            # 批次失败也要唤醒等待者 / wake waiters even when the batch failed
+            for item in batch:
+                if item is not _STOP and item[0] is _FLUSH:
+                    item[1].set()
+        return stopping
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        立即提交当前批次，并等到本次调用之前入队的事件提交为止（最多 timeout 秒，
+        默认 flush_timeout_s）；之后别的线程继续写入不会延长等待。超时返回 False。
+        Commit the current batch now and wait until the events queued before
+        this call are committed, at most `timeout` seconds (flush_timeout_s by
+        default). Events other threads submit afterwards never extend the
+        wait. Returns False on timeout.
+        """
+        done = threading.Event()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put((_FLUSH, done))
+        if closed:
+            # close() 已经排入 _STOP：等后台线程把剩余事件写完 / the thread drains up to _STOP
+            self._thread.join(self.flush_timeout_s if timeout is None else timeout)
+            return not self._thread.is_alive()
+        if done.wait(self.flush_timeout_s if timeout is None else timeout):
+            return True
+        self.counters["flush_timeouts"] += 1
+        return False
+
+    def close(self):
+        """提交剩余事件并停止后台线程 / Flush pending events and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=self._queue.qsize())
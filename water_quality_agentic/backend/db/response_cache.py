@@ -0,0 +1,194 @@
+# backend/db/response_cache.py
+# LLM 响应缓存：SQLite 持久化，key = model + prompt 哈希
+# Persistent LLM response cache keyed by model + prompt hash (SQLite)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_DB_PATH = Path(__file__).resolve().parents[2] / "data" / "llm_cache.db"
+
+# 每个 agent 的缓存有效期（秒）/ per-agent TTL in seconds
+DEFAULT_TTLS = {
+    "planner": 7 * 24 * 3600,
+    "web": 6 * 3600,
+    "summarizer": 24 * 3600,
+    # 同一英文答案的翻译不会变 / a given English answer always translates the same way
+    "translator": 7 * 24 * 3600,
+    "evaluator": 7 * 24 * 3600,
+}
+# 命中时 last_access 距今超过该秒数才写回（LRU 只需要粗粒度时间），读操作大多不写库
+# A hit only writes last_access back when it is older than this; coarse LRU
+# order is enough and most reads stay read-only
+ACCESS_UPDATE_S = 300.0
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def make_key(model: str, messages: list) -> str:
+    """内容寻址：对 model + messages 做 sha256 / Content address of a request."""
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    - get / put：按 agent 使用不同 TTL
+    - 超过条数或总字节上限时按 LRU（last_access）淘汰
+    - 记录命中 / 未命中次数，供前端 debug 面板展示
+    - 多个 worker 进程共享同一个文件：WAL + busy_timeout，任何读写错误都当作未命中 / 不写入
+    SQLite-backed cache with per-agent TTLs, LRU/size eviction and
+    hit/miss counters. The file is shared by the pre-forked API workers, so
+    it runs in WAL mode with a busy timeout, and any SQLite error counts as
+    a miss (get) or a no-op (put) instead of failing the LLM call.
+    """
+
+    def __init__(
+        self,
+        path: Path = CACHE_DB_PATH,
+        ttls: dict = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.counters = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("PRAGMA busy_timeout=5000;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                agent TEXT,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                expires_at REAL,
+                last_access REAL
+            );
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access);")
+        self._conn.commit()
+
+    def _count(self, agent: str, field: str):
+        agent_counts = self.counters.setdefault(agent, {"hits": 0, "misses": 0})
+        agent_counts[field] += 1
+
+    def get(self, agent: str, model: str, messages: list):
+        """命中返回缓存文本，否则返回 None / Cached response text or None."""
+        if not self.enabled:
+            return None
+        key = make_key(model, messages)
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response, expires_at, last_access FROM llm_cache WHERE key = ?;", (key,)
+                ).fetchone()
+                if row is not None and row[1] >= now and now - row[2] > ACCESS_UPDATE_S:
+                    self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?;",
+                                       (now, key))
+                    self._conn.commit()
+            except sqlite3.Error:
+                self._rollback()
+                self._count(agent, "misses")
+                return None
+            if row is None or row[1] < now:
+                self._count(agent, "misses")
+                return None
+            self._count(agent, "hits")
+            return row[0]
+
+    def _rollback(self):
+        """记一次错误并丢弃未提交的写入（调用方持有 _lock）/ Count an error, drop the open transaction."""
+        self.errors += 1
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def put(self, agent: str, model: str, messages: list, response: str):
+        """写入一条响应，并在需要时淘汰旧条目 / Store a response, evicting if needed."""
+        if not self.enabled:
+            return
+        now = time.time()
+        ttl = self.ttls.get(agent, DEFAULT_TTLS["summarizer"])
+        with self._lock:
+            try:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO llm_cache
+                        (key, agent, model, response, size, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                    """,
+                    (make_key(model, messages), agent, model, response,
+                     len(response.encode("utf-8")), now, now + ttl, now),
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error:
+                # 缓存写不进去不影响已经拿到的答案 / a failed cache write never fails the call
+                self._rollback()
+
+    def _evict(self, now: float):
+        """先删过期条目，再按 last_access 从旧到新删到上限以内。"""
+        cur = self._conn.cursor()
+        cur.execute("DELETE FROM llm_cache WHERE expires_at < ?;", (now,))
+        count, total = cur.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache;").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in cur.execute(
+            "SELECT key, size FROM llm_cache ORDER BY last_access ASC;"
+        ).fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?;", (key,))
+            count -= 1
+            total -= size
+
+    def stats(self) -> dict:
+        """命中统计 + 当前条目数 / Hit/miss counters plus current size."""
+        with self._lock:
+            try:
+                entries, total = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache;"
+                ).fetchone()
+            except sqlite3.Error:
+                entries, total = None, None
+        hits = sum(c["hits"] for c in self.counters.values())
+        misses = sum(c["misses"] for c in self.counters.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "per_agent": {agent: dict(c) for agent, c in self.counters.items()},
+            "entries": entries,
+            "bytes": total,
+            "errors": self.errors,
+        }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """进程内共享的缓存实例；LLM_CACHE=0 时禁用 / Process-wide cache (LLM_CACHE=0 disables)."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache(enabled=os.getenv("LLM_CACHE", "1") != "0")
+        return _shared_cache
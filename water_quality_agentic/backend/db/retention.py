@@ -0,0 +1,158 @@
+# backend/db/retention.py
+# 保留期清理：超过 RETENTION_DAYS 的日志行归档到按日期命名的 gzip JSONL 文件后删除，
+# 再删除无引用的答案 blob，并用增量 VACUUM 归还空间。
+# Retention compaction: log rows older than RETENTION_DAYS are archived into
+# dated gzip JSONL files and deleted, unreferenced answer blobs are pruned and
+# free pages are returned with incremental VACUUM.
+#
+# 用法 / usage (在 water_quality_agentic/ 目录下):
+#   python -m backend.db.retention --days 90
+#   python -m backend.db.retention --stats
+#   python -m backend.db.retention --enable-incremental-vacuum   # 旧库一次性转换 / one-time conversion
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from backend.db.local_db import (
+    RETENTION_TABLES, delete_rows, enable_incremental_vacuum, expired_rows, init_db,
+    prune_answer_blobs, reclaim_space, storage_stats,
+)
+
+# 保留天数，0 表示不清理 / days of history kept in the live database (0 disables)
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "90"))
+# 归档目录：<表名>-<YYYY-MM-DD>.jsonl.gz，按行的 created_at 日期分文件
+# Archive directory: <table>-<YYYY-MM-DD>.jsonl.gz, one file per row date
+ARCHIVE_DIR = Path(os.getenv(
+    "WQ_ARCHIVE_DIR", Path(__file__).resolve().parents[2] / "data" / "archive"
+))
+# 后台任务的执行间隔（秒）/ interval of the background job in seconds
+RETENTION_INTERVAL_S = float(os.getenv("RETENTION_INTERVAL_S", str(24 * 3600)))
+
+
+def archive_rows(table: str, rows: list, archive_dir: Path) -> list:
+    """
+    按 created_at 日期追加写入归档文件（gzip 支持追加成员），返回写入的文件名。
+    Append rows to per-date archive files (gzip members can be appended).
+    """
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    by_date = {}
+    for row in rows:
+        by_date.setdefault(str(row.get("created_at") or "undated")[:10], []).append(row)
+    written = []
+    for day, day_rows in sorted(by_date.items()):
+        path = archive_dir / f"{table}-{day}.jsonl.gz"
+        with gzip.open(path, "at", encoding="utf-8") as fh:
+            for row in day_rows:
+                fh.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        written.append(path.name)
+    return written
+
+
+def compact(retention_days: float = RETENTION_DAYS, archive_dir: Path = ARCHIVE_DIR,
+            batch_size: int = 500) -> dict:
+    """
+    一轮清理：逐表按批归档并删除过期行 → 删除无引用的 blob → 归还空闲页。
+    先写归档再删除，中途中断最多导致少量行被重复归档，不会丢失。
+    空闲页只在增量模式的库上归还，从不执行完整 VACUUM。
+    One compaction pass. Each batch is archived before it is deleted, so an
+    interrupted run can at worst archive a few rows twice, never lose them.
+    Free pages are only returned on incremental-mode databases; a full VACUUM
+    never runs here.
+    """
+    start = time.perf_counter()
+    max_age_s = retention_days * 24 * 3600
+    report = {"archived": {}, "files": set()}
+    for table in RETENTION_TABLES:
+        archived = 0
+        while True:
+            rows = expired_rows(table, max_age_s, batch_size)
+            if not rows:
+                break
+            report["files"].update(archive_rows(table, rows, archive_dir))
+            delete_rows(table, [row["id"] for row in rows])
+            archived += len(rows)
+        report["archived"][table] = archived
+    report["files"] = sorted(report["files"])
+    report["pruned_blobs"] = prune_answer_blobs()
+    report["vacuum"] = reclaim_space()
+    report["duration_s"] = round(time.perf_counter() - start, 4)
+    return report
+
+
+class RetentionJob:
+    """
+    后台定期执行 compact()，用法与 WebPrefetcher 相同（start / stop / stats）。
+    第一轮在启动 interval_s 秒之后执行，不占用服务启动时间。
+    Runs compact() every interval_s on a daemon thread; the first pass runs
+    interval_s after start, not at startup.
+    """
+
+    def __init__(self, retention_days: float = RETENTION_DAYS, archive_dir: Path = ARCHIVE_DIR,
+                 interval_s: float = RETENTION_INTERVAL_S):
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.interval_s = interval_s
+        self.counters = {"runs": 0, "archived": 0, "pruned_blobs": 0, "errors": 0}
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> dict:
+        report = compact(self.retention_days, self.archive_dir)
+        self.counters["runs"] += 1
+        self.counters["archived"] += sum(report["archived"].values())
+        self.counters["pruned_blobs"] += report["pruned_blobs"]
+        self.last_report = report
+        return report
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="db-retention", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception:
+                self.counters["errors"] += 1
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return dict(self.counters, running=self._thread is not None,
+                    retention_days=self.retention_days, last_report=self.last_report)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old log rows and compact the database.")
+    parser.add_argument("--days", type=float, default=RETENTION_DAYS,
+                        help=f"days of history to keep (default {RETENTION_DAYS:g})")
+    parser.add_argument("--archive-dir", type=Path, default=ARCHIVE_DIR)
+    parser.add_argument("--stats", action="store_true", help="only print storage statistics")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="one-time conversion of an older database to incremental "
+                             "auto-vacuum (runs a full VACUUM)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.enable_incremental_vacuum:
+        print(json.dumps(enable_incremental_vacuum(), indent=2))
+    elif not args.stats:
+        if args.days <= 0:
+            parser.error("--days must be positive")
+        print(json.dumps(compact(args.days, args.archive_dir), indent=2))
+    print(json.dumps(storage_stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
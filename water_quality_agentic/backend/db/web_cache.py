@@ -0,0 +1,204 @@
+# backend/db/web_cache.py
+# Web 证据缓存：key = 规范化的 topic + focus + 地区 + 年份，按 topic 设置有效期（SQLite 持久化）
+# Web-evidence cache keyed by normalized planner topic + focus + region + year,
+# with per-topic TTLs (SQLite-backed)
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from backend.agents.rule_planner import (
+    CONTEXT_TOPICS, FOCUS_KEYWORDS, POLLUTANT_TOPICS, query_region, query_year,
+)
+
+WEB_CACHE_DB_PATH = Path(os.getenv(
+    "WQ_WEB_CACHE_PATH", Path(__file__).resolve().parents[2] / "data" / "web_cache.db"
+))
+
+# 每个 topic 的有效期（秒）：微生物数据变化快，重金属 / 地下水变化慢
+# Per-topic TTL in seconds: microbial conditions change quickly, metals and groundwater slowly
+TOPIC_TTLS = {
+    "microbial": 6 * 3600,
+    "nitrate": 24 * 3600,
+    "phosphorus": 24 * 3600,
+    "nutrients": 24 * 3600,
+    "lake": 24 * 3600,
+    "ecosystem_health": 3 * 24 * 3600,
+    "heavy_metals": 7 * 24 * 3600,
+    "groundwater": 7 * 24 * 3600,
+    "mixed": 12 * 3600,
+    "general": 12 * 3600,
+}
+DEFAULT_TTL_S = 12 * 3600
+
+KNOWN_TOPICS = set(POLLUTANT_TOPICS) | set(CONTEXT_TOPICS) | {"mixed", "general"}
+KNOWN_FOCUS = set(FOCUS_KEYWORDS)
+# 查询没有年份时代表“最新”，没有地区时不限地区
+# Placeholder year for queries without one, and region for queries naming none
+LATEST = "latest"
+ANY_REGION = "any"
+
+
+def _normalize(value, known: set, default: str) -> str:
+    name = str(value or "").strip().lower().replace("-", "_").replace(" ", "_")
+    return name if name in known else default
+
+
+def web_key(query: str, plan: dict) -> tuple:
+    """
+    (topic, focus, region, year)：topic / focus 不在分类表中时归为 general / assessment，
+    地区来自规则规划器（没有时为 "any"）。
+    Normalized cache key; unknown topics map to "general", unknown focus to
+    "assessment", a query naming no water body maps to "any" and a query
+    without a year maps to "latest".
+    """
+    return (
+        _normalize(plan.get("topic"), KNOWN_TOPICS, "general"),
+        _normalize(plan.get("focus"), KNOWN_FOCUS, "assessment"),
+        query_region(query) or ANY_REGION,
+        query_year(query) or LATEST,
+    )
+
+
+def _key_str(key: tuple) -> str:
+    return "|".join(key)
+
+
+class WebEvidenceCache:
+    """
+    - get(key)：未过期时返回 web 片段
+    - put(key, text)：按 topic 的 TTL 写入
+    - expiring(keys, margin)：缺失或即将过期的 key，供预取调度器刷新
+    Snippets per (topic, focus, region, year) with topic-specific TTLs and
+    hit/miss counters; expiring() tells the prefetcher what to refresh.
+    The file is shared by the API worker processes: WAL mode with a busy
+    timeout, and hits are counted in memory so reads never take the write
+    lock. SQLite errors count as a miss (get) or a no-op (put).
+    """
+
+    def __init__(self, path: Path = WEB_CACHE_DB_PATH, ttls: dict = None, enabled: bool = True):
+        self.path = path
+        self.ttls = dict(TOPIC_TTLS, **(ttls or {}))
+        self.enabled = enabled
+        self.counters = {"hits": 0, "misses": 0, "prefetched": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("PRAGMA busy_timeout=5000;")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS web_evidence (
+                key TEXT PRIMARY KEY,
+                topic TEXT,
+                focus TEXT,
+                region TEXT,
+                year TEXT,
+                snippet TEXT,
+                fetched_at REAL,
+                expires_at REAL,
+                hits INTEGER DEFAULT 0
+            );
+            """
+        )
+        # 旧库没有 region 列；旧的三段 key 不会再命中，过期后自然淘汰
+        # Older files lack the region column; their three-part keys simply expire
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(web_evidence);")}
+        if "region" not in columns:
+            self._conn.execute("ALTER TABLE web_evidence ADD COLUMN region TEXT;")
+        self._conn.commit()
+
+    def ttl_for(self, topic: str) -> float:
+        return self.ttls.get(topic, DEFAULT_TTL_S)
+
+    def get(self, key: tuple):
+        """命中返回片段，否则返回 None / Fresh snippet for the key, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT snippet, expires_at FROM web_evidence WHERE key = ?;", (_key_str(key),)
+                ).fetchone()
+            except sqlite3.Error:
+                self.counters["errors"] += 1
+                row = None
+            if row is None or row[1] < time.time():
+                self.counters["misses"] += 1
+                return None
+            # 命中只在内存里计数，读路径不写库 / hits are counted in memory; reads never write
+            self.counters["hits"] += 1
+            return row[0]
+
+    def put(self, key: tuple, snippet: str, prefetched: bool = False):
+        if not self.enabled or not snippet:
+            return
+        now = time.time()
+        topic, focus, region, year = key
+        with self._lock:
+            try:
+                self._conn.execute(
+                    """
+                    INSERT INTO web_evidence
+                        (key, topic, focus, region, year, snippet, fetched_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        snippet = excluded.snippet, fetched_at = excluded.fetched_at,
+                        expires_at = excluded.expires_at;
+                    """,
+                    (_key_str(key), topic, focus, region, year, snippet, now,
+                     now + self.ttl_for(topic)),
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                self.counters["errors"] += 1
+                try:
+                    self._conn.rollback()
+                except sqlite3.Error:
+                    pass
+                return
+            if prefetched:
+                self.counters["prefetched"] += 1
+
+    def expiring(self, keys: list, margin: float = 0.25) -> list:
+        """
+        keys 中缺失、已过期或剩余有效期不足 margin × TTL 的 key。
+        Keys that are missing, expired, or within margin × TTL of expiring.
+        """
+        now = time.time()
+        stale = []
+        with self._lock:
+            for key in keys:
+                try:
+                    row = self._conn.execute(
+                        "SELECT expires_at FROM web_evidence WHERE key = ?;", (_key_str(key),)
+                    ).fetchone()
+                except sqlite3.Error:
+                    self.counters["errors"] += 1
+                    row = None
+                if row is None or row[0] - now < margin * self.ttl_for(key[0]):
+                    stale.append(key)
+        return stale
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                (entries,) = self._conn.execute("SELECT COUNT(*) FROM web_evidence;").fetchone()
+            except sqlite3.Error:
+                entries = None
+        return dict(self.counters, entries=entries)
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_web_cache() -> WebEvidenceCache:
+    """进程内共享的 web 证据缓存；WEB_CACHE=0 时禁用 / Process-wide cache (WEB_CACHE=0 disables)."""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = WebEvidenceCache(enabled=os.getenv("WEB_CACHE", "1") != "0")
+        return _shared_cache
@@ -0,0 +1,301 @@
+# backend/http_server.py
+# 独立的 HTTP API 服务（标准库实现）：多 worker 进程共享同一个监听 socket，
+# 每个进程内对同时在途的相同查询做 single-flight 合并。
+# Standalone stdlib HTTP API around api_server: several pre-forked worker
+# processes share one listening socket, and within each worker concurrent
+# identical queries are coalesced into one pipeline execution (single-flight).
+#
+# 用法 / usage (在 water_quality_agentic/ 目录下):
+#   python -m backend.http_server --port 8000 --workers 4
+#   WQ_API_URL=http://127.0.0.1:8000 streamlit run frontend/streamlit_app.py
+#
+# 接口 / endpoints:
+#   GET  /health                  {"status": "ok", "pid": ...}
+#   POST /query                   {"query"} -> {"answer", "debug", "coalesced"}
+#   POST /query/stream            {"query"} -> text/event-stream，每个事件一行 "data: {...}"
+#   POST /feedback                {"query", "answer", "feedback"} -> {"status": "queued"}
+#   POST /translate               {"query", "answer"} -> {"answer_zh"}
+#   GET  /metrics/stages?limit=N  分阶段 p50 / p95 / p99
+#   GET  /stats                   single-flight、web 缓存、评估队列、准入控制、规划合批、存储统计
+#   准入队列满时返回 503 + Retry-After / 503 with Retry-After when admission is full
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from backend import api_server
+from backend.budget import Overloaded
+
+
+def flight_key(query: str) -> str:
+    """只合并空白差异以外完全相同的查询 / Identical queries up to whitespace."""
+    return " ".join(query.split())
+
+
+class _Broadcast:
+    """一次流式执行的事件列表，订阅者可以在任意时刻加入并从头回放。"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def publish(self, event: dict):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """从第一个事件开始依次产出，直到执行结束 / Replay from the start, then follow."""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.events) and not self.done:
+                    self._cond.wait()
+                batch = self.events[index:]
+                finished = self.done
+            index += len(batch)
+            yield from batch
+            if finished and index >= len(self.events):
+                return
+
+
+class SingleFlight:
+    """
+    - do(key, fn, *args)：同一 key 同时只执行一次，其它调用等待并共享结果
+    - stream(key, gen_fn, *args)：同一 key 的流式执行只跑一次，所有订阅者收到相同事件
+    执行放在独立线程池里，客户端断开不会中断其它等待者。
+    Coalesces concurrent calls with the same key into one execution. Work
+    runs on a separate pool so a disconnecting client never cancels the
+    execution other callers are waiting on. Keys are forgotten as soon as
+    the execution finishes; later callers start a fresh one.
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self.counters = {"executions": 0, "coalesced": 0}
+        self._lock = threading.RLock()
+        self._calls = {}
+        self._streams = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="single-flight")
+
+    def _forget(self, table: dict, key: str, value):
+        with self._lock:
+            if table.get(key) is value:
+                del table[key]
+
+    def do(self, key: str, fn, *args):
+        """返回 (result, coalesced) / Returns (result, whether it was shared)."""
+        with self._lock:
+            future = self._calls.get(key)
+            coalesced = future is not None
+            if coalesced:
+                self.counters["coalesced"] += 1
+            else:
+                self.counters["executions"] += 1
+                future = self._executor.submit(fn, *args)
+                self._calls[key] = future
+                future.add_done_callback(lambda f: self._forget(self._calls, key, f))
+        return future.result(), coalesced
+
+    def stream(self, key: str, gen_fn, *args):
+        """返回 (事件迭代器, coalesced) / Returns (event iterator, whether it was shared)."""
+        with self._lock:
+            broadcast = self._streams.get(key)
+            coalesced = broadcast is not None
+            if coalesced:
+                self.counters["coalesced"] += 1
+            else:
+                self.counters["executions"] += 1
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                self._executor.submit(self._produce, key, broadcast, gen_fn, args)
+        return broadcast.subscribe(), coalesced
+
+    def _produce(self, key: str, broadcast: _Broadcast, gen_fn, args):
+        try:
+            for event in gen_fn(*args):
+                broadcast.publish(event)
+        except Exception as exc:
+            broadcast.publish({"event": "error", "message": f"{type(exc).__name__}: {exc}",
+                               "status": 503 if isinstance(exc, Overloaded) else 500})
+        finally:
+            self._forget(self._streams, key, broadcast)
+            broadcast.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._calls) + len(self._streams))
+
+
+def _make_handler(flights: SingleFlight):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload, headers: dict = None):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send_json(200, {"status": "ok", "pid": os.getpid()})
+            elif url.path == "/metrics/stages":
+                limit = int(parse_qs(url.query).get("limit", ["1000"])[0])
+                self._send_json(200, api_server.get_stage_metrics(limit))
+            elif url.path == "/stats":
+                self._send_json(200, {
+                    "pid": os.getpid(),
+                    "single_flight": flights.stats(),
+                    "web_cache": api_server.get_web_cache_stats(),
+                    "corpus": api_server.get_corpus_stats(),
+                    "evaluation": api_server.get_evaluation_stats(),
+                    "admission": api_server.get_admission_stats(),
+                    "plan_batching": api_server.get_plan_batch_stats(),
+                    "storage": api_server.get_storage_stats(),
+                })
+            else:
+                self._send_json(404, {"error": f"unknown path {url.path}"})
+
+        def do_POST(self):
+            try:
+                payload = self._read_json()
+            except (ValueError, json.JSONDecodeError):
+                self._send_json(400, {"error": "request body must be JSON"})
+                return
+            path = urlparse(self.path).path
+            try:
+                if path == "/query":
+                    query = payload.get("query", "")
+                    (answer, debug), coalesced = flights.do(
+                        flight_key(query), api_server.handle_query, query
+                    )
+                    self._send_json(200, {"answer": answer, "debug": debug,
+                                          "coalesced": coalesced})
+                elif path == "/query/stream":
+                    self._stream(payload.get("query", ""))
+                elif path == "/feedback":
+                    api_server.submit_feedback(payload.get("query", ""),
+                                               payload.get("answer", ""),
+                                               payload.get("feedback", ""))
+                    self._send_json(200, {"status": "queued"})
+                elif path == "/translate":
+                    self._send_json(200, {"answer_zh": api_server.translate_answer(
+                        payload.get("query", ""), payload.get("answer", ""))})
+                else:
+                    self._send_json(404, {"error": f"unknown path {path}"})
+            except Overloaded as exc:
+                # 背压：让客户端稍后重试 / backpressure: ask the client to retry later
+                self._send_json(503, {"error": str(exc)},
+                                {"Retry-After": str(max(1, round(exc.retry_after_s)))})
+            except Exception as exc:
+                self._send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+
+        def _stream(self, query: str):
+            """SSE：没有 Content-Length，发送完后关闭连接 / SSE, closed when done."""
+            events, coalesced = flights.stream(flight_key(query),
+                                               api_server.handle_query_stream, query)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for event in events:
+                    if event["event"] == "done":
+                        event = dict(event, coalesced=coalesced)
+                    line = json.dumps(event, ensure_ascii=False, default=str)
+                    self.wfile.write(f"data: {line}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 客户端断开；执行本身继续服务其它订阅者
+
+    return Handler
+
+
+# ---------- 多 worker 进程 / worker processes ----------
+
+def _serve(listener: socket.socket, worker_index: int, max_flights: int):
+    """在一个 worker 进程里：初始化后端，然后在共享 socket 上提供服务。"""
+    if worker_index > 0:
+        # 只让第一个 worker 运行 web 预取、保留期清理和语料目录扫描
+        # only the first worker runs the web prefetcher, the retention job and the corpus scan
+        api_server.WEB_PREFETCH = False
+        api_server.RETENTION_JOB = False
+        api_server.CORPUS_SYNC = False
+    api_server._init_backend()
+    httpd = ThreadingHTTPServer(listener.getsockname()[:2], _make_handler(SingleFlight(max_flights)),
+                                bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = listener
+    httpd.daemon_threads = True
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, workers: int = 2, max_flights: int = 16):
+    """
+    先创建监听 socket，再 fork 出 workers 个进程共享它（同一进程内 single-flight）。
+    Bind once, then pre-fork `workers` processes that accept on the shared
+    socket. Coalescing is per worker process.
+    """
+    listener = socket.create_server((host, port), backlog=128)
+    print(f"Serving on http://{host}:{listener.getsockname()[1]} with {workers} worker(s)")
+    if workers <= 1:
+        _serve(listener, 0, max_flights)
+        return
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=_serve, args=(listener, i, max_flights), daemon=True)
+                 for i in range(workers)]
+    for proc in processes:
+        proc.start()
+    try:
+        for proc in processes:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in processes:
+            proc.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Water-quality assistant HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WQ_API_WORKERS", "2")),
+                        help="worker processes sharing the listening socket (default 2)")
+    parser.add_argument("--max-flights", type=int, default=16,
+                        help="distinct pipeline executions in flight per worker (default 16)")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers, args.max_flights)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# backend/llm/client.py
+# 共享 LLM 客户端：连接池 + 全局并发上限 + 令牌桶限流 + 重试 + 超时
+# Shared LLM client: pooled HTTP connections, global concurrency cap,
+# token-bucket rate limiting, jittered retries and per-call timeouts
+
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backend import tracing
+from backend.db.response_cache import get_response_cache
+
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY", "your key")
+# 指向本地 stub server 时可改写，例如 http://127.0.0.1:8900
+# Override to point at a local stub server, e.g. http://127.0.0.1:8900
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL", "https://api.mistral.ai")
+MISTRAL_MODEL_NAME = "mistral-small-latest"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 当前上下文里 LLM 调用必须结束的时间点（time.monotonic()），由 call_deadline() 设置
+# Monotonic time by which LLM calls in the current context must finish (see call_deadline())
+_DEADLINE = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class LLMError(RuntimeError):
+    """重试用尽或不可重试的 LLM 调用错误 / LLM call failed after retries or was not retryable."""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class DeadlineExceeded(LLMError):
+    """调用方的截止时间已到 / The caller's deadline passed before the call finished."""
+
+
+@contextmanager
+def call_deadline(seconds: float = None):
+    """
+    在 seconds 秒内结束本上下文中的 LLM 调用（HTTP 超时、重试等待、排队、限流等待都不超过它）；
+    None 表示不限制，嵌套时取更早的截止时间。
+    LLM calls made inside this context give up after `seconds`: the HTTP
+    timeout, retry backoff and the waits for an in-flight slot and a
+    rate-limiter token are all capped, so a stage abandoned at its deadline
+    frees its worker thread. None means no deadline; nested deadlines keep
+    the earlier one.
+    """
+    deadline = _DEADLINE.get()
+    if seconds is not None:
+        at = time.monotonic() + seconds
+        deadline = at if deadline is None else min(deadline, at)
+    token = _DEADLINE.set(deadline)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def deadline_left():
+    """距当前截止时间的秒数，没有截止时间时为 None / Seconds to the active deadline, or None."""
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """
+    令牌桶：平均速率 rate 次/秒，允许 capacity 的突发。
+    Token bucket allowing `rate` calls/second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float = None):
+        """
+        阻塞直到拿到一个令牌，返回等待的秒数；等待会超过 timeout 时不等、不取令牌，返回 None。
+        Block for a token and return the seconds waited. If the wait would
+        exceed `timeout`, return None at once without taking a token.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            if timeout is not None and waited + delay > timeout:
+                return None
+            time.sleep(delay)
+            waited += delay
+
+
+class LLMClient:
+    """
+    所有 Agent 共用的 chat completion 客户端：
+    - requests.Session + HTTPAdapter 复用连接
+    - BoundedSemaphore 限制同时在途的请求数
+    - TokenBucket 控制请求速率，避免触发 429
+    - 429 / 5xx / 网络错误按指数退避 + 随机抖动重试，优先遵守 Retry-After
+    - 响应缓存（ResponseCache）也放在这一层
+    Chat-completion client shared by every agent. Talks to the Mistral REST
+    API (or a local stub server via server_url) and owns the response cache.
+    """
+
+    def __init__(
+        self,
+        api_key: str = MISTRAL_API_KEY,
+        server_url: str = MISTRAL_SERVER_URL,
+        max_in_flight: int = 4,
+        rate_per_second: float = 4.0,
+        burst: int = 4,
+        max_retries: int = 4,
+        timeout_s: float = 60.0,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 8.0,
+        cache=None,
+    ):
+        if not api_key or api_key == "YOUR_MISTRAL_KEY_HERE":
+            raise ValueError(
+                "MISTRAL_API_KEY is not set. Please export it in your environment."
+            )
+        self.api_key = api_key
+        self.server_url = server_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout_s = timeout_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.cache = cache if cache is not None else get_response_cache()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._bucket = TokenBucket(rate_per_second, burst)
+        self._stats_lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "throttle_wait_s": 0.0}
+
+    # ---------- 内部工具 ----------
+
+    def _count(self, field: str, amount=1):
+        with self._stats_lock:
+            self.counters[field] += amount
+
+    def _timeout(self) -> float:
+        """本次请求的超时：timeout_s 与截止时间取小 / timeout_s capped by the active deadline."""
+        left = deadline_left()
+        if left is None:
+            return self.timeout_s
+        if left <= 0:
+            self._count("failures")
+            raise DeadlineExceeded("LLM call deadline exceeded")
+        return min(self.timeout_s, left)
+
+    @contextmanager
+    def _slot(self):
+        """占用一个在途名额，最多等到截止时间 / Hold an in-flight slot, never waiting past the deadline."""
+        if not self._in_flight.acquire(timeout=self._timeout()):
+            self._count("failures")
+            raise DeadlineExceeded("LLM call deadline exceeded waiting for an in-flight slot")
+        try:
+            yield
+        finally:
+            self._in_flight.release()
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        """Retry-After 优先，否则 full-jitter 指数退避 / Retry-After, else full-jitter backoff."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max_s)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+
+    def _post(self, payload: dict, stream: bool = False) -> requests.Response:
+        """
+        带限流和重试的 POST；调用方负责在需要时持有并发信号量。
+        Rate-limited POST with retries; the caller holds the in-flight semaphore.
+        """
+        url = f"{self.server_url}/v1/chat/completions"
+        attempt = 0
+        while True:
+            waited = self._bucket.acquire(timeout=deadline_left())
+            if waited is None:
+                self._count("failures")
+                raise DeadlineExceeded("LLM call deadline exceeded waiting for the rate limiter")
+            self._count("throttle_wait_s", waited)
+            self._count("calls")
+            try:
+                resp = self.session.post(
+                    url, data=json.dumps(payload), timeout=self._timeout(), stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise LLMError(f"LLM request failed: {exc}") from exc
+                time.sleep(min(self._backoff(attempt), self._timeout()))
+                attempt += 1
+                self._count("retries")
+                continue
+
+            if resp.status_code < 400:
+                return resp
+            if resp.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                delay = self._backoff(attempt, resp.headers.get("Retry-After"))
+                resp.close()
+                time.sleep(min(delay, self._timeout()))
+                attempt += 1
+                self._count("retries")
+                continue
+            self._count("failures")
+            raise LLMError(
+                f"LLM request failed with HTTP {resp.status_code}: {resp.text[:200]}",
+                status_code=resp.status_code,
+            )
+
+    # ---------- 对外接口 ----------
+
+    def complete(self, agent: str, messages: list, model: str = MISTRAL_MODEL_NAME) -> str:
+        """
+        一次 chat completion，返回文本；先查缓存。
+        agent 用于缓存 TTL 和统计（"planner" / "web" / "summarizer" ...）。
+        One chat completion (cache first). `agent` selects the cache TTL.
+        """
+        cached = self.cache.get(agent, model, messages)
+        if cached is not None:
+            tracing.record_usage(cached=True)
+            return cached
+        with self._slot():
+            resp = self._post({"model": model, "messages": messages})
+            body = resp.json()
+        tracing.record_usage(body.get("usage"))
+        content = body["choices"][0]["message"]["content"]
+        self.cache.put(agent, model, messages, content)
+        return content
+
+    def stream(self, agent: str, messages: list, model: str = MISTRAL_MODEL_NAME):
+        """
+        流式 chat completion（SSE），逐段 yield 文本；完整结果写入缓存。
+        响应由单独的线程读取（_pump），在途名额不会跨 yield 持有。
+        Streaming completion over SSE; yields text deltas and caches the
+        result. The response is read on its own thread (_pump), so the
+        in-flight slot is never held across a yield and a consumer that
+        stops reading cannot keep it.
+        """
+        cached = self.cache.get(agent, model, messages)
+        if cached is not None:
+            tracing.record_usage(cached=True)
+            yield cached
+            return
+        deltas = queue.Queue()
+        # 复制当前上下文：tracing span 和 call_deadline() 在读取线程里照样生效
+        # Copy the context so the active span and call_deadline() apply to the reader thread
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._pump, agent, model, messages, deltas),
+                         name="llm-stream", daemon=True).start()
+        while True:
+            delta = deltas.get()
+            if delta is None:
+                return
+            if isinstance(delta, Exception):
+                raise delta
+            yield delta
+
+    def _pump(self, agent: str, model: str, messages: list, deltas: queue.Queue):
+        """
+        在在途名额内读完一个 SSE 响应，把文本片段（或异常）放进 deltas，最后放入 None。
+        Read one SSE response inside an in-flight slot, putting text deltas
+        (or the exception that ended it) on `deltas`, then None.
+        """
+        parts = []
+        usage = None
+        try:
+            with self._slot():
+                resp = self._post({"model": model, "messages": messages, "stream": True},
+                                  stream=True)
+                with resp:
+                    for line in resp.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        # usage 只出现在最后一个 chunk / usage only arrives on the final chunk
+                        usage = chunk.get("usage") or usage
+                        choices = chunk.get("choices") or []
+                        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                        if delta:
+                            parts.append(delta)
+                            deltas.put(delta)
+            tracing.record_usage(usage)
+            self.cache.put(agent, model, messages, "".join(parts))
+        except Exception as exc:
+            deltas.put(exc)
+        finally:
+            deltas.put(None)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.counters)
+        stats["throttle_wait_s"] = round(stats["throttle_wait_s"], 3)
+        return stats
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """
+    进程内共享的 LLMClient；LLM_BACKEND=fake 时使用离线 FakeLLMClient。
+    Process-wide shared LLMClient (LLM_BACKEND=fake selects the offline FakeLLMClient).
+    """
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None and os.getenv("LLM_BACKEND") == "fake":
+            from backend.llm.fake_client import FakeLLMClient
+
+            _shared_client = FakeLLMClient(
+                latency_s=float(os.getenv("FAKE_LLM_LATENCY_S", "0.05")),
+                tokens_per_s=float(os.getenv("FAKE_LLM_TOKENS_PER_S", "0")),
+            )
+        if _shared_client is None:
+            _shared_client = LLMClient(
+                max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "4")),
+                rate_per_second=float(os.getenv("LLM_RATE_PER_SECOND", "4")),
+            )
+        return _shared_client
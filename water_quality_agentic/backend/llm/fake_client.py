@@ -0,0 +1,152 @@
+# backend/llm/fake_client.py
+# 离线 Fake LLM：与 LLMClient 接口相同，返回固定的规划 JSON / web 片段 / 摘要，
+# 可配置延迟和 token 生成速率，用于 benchmark 和无网络演示。
+# Offline stand-in for LLMClient: deterministic canned plan JSON, web
+# snippets and summaries with configurable latency and token rate.
+
+import json
+import threading
+import time
+
+from backend import tracing
+from backend.db.response_cache import ResponseCache
+from backend.llm.client import MISTRAL_MODEL_NAME, DeadlineExceeded, deadline_left
+from backend.retrieval.tokenizer import estimate_tokens
+
+FAKE_PLAN = {"topic": "mixed", "focus": "comparison", "need_web": True}
+
+FAKE_WEB_SNIPPET = (
+    "Recent provincial monitoring summaries for 2024-2025 indicate that nutrient "
+    "concentrations in Lake Ontario tributaries remain elevated during spring runoff, "
+    "while open-lake averages stay below drinking-water guidelines. Agencies continue "
+    "to recommend fertilizer management, buffer strips and expanded real-time monitoring."
+)
+
+FAKE_SUMMARY_EN = (
+    "1) Background: Lake Ontario supplies drinking water to millions of residents.\n"
+    "2) Key water-quality data: average nitrate about 28 mg/L vs WHO guideline 50 mg/L; "
+    "cadmium about 0.002 mg/L vs 0.003 mg/L.\n"
+    "3) Risk analysis: short-term runoff peaks require attention.\n"
+    "4) Recommendations: continuous monitoring and better fertilizer management."
+)
+
+FAKE_SUMMARY_ZH = (
+    "1）背景：安大略湖为数百万居民提供饮用水。\n"
+    "2）关键水质数据：硝酸盐平均约 28 mg/L，低于 WHO 50 mg/L；镉约 0.002 mg/L，低于 0.003 mg/L。\n"
+    "3）风险分析：径流季节的短期峰值需要关注。\n"
+    "4）建议：持续监测并改进施肥管理。"
+)
+
+FAKE_SUMMARY = FAKE_SUMMARY_EN + "\n" + FAKE_SUMMARY_ZH
+
+FAKE_PARTIAL = (
+    "1) Background: {label} is monitored across Lake Ontario and its tributaries.\n"
+    "2) Key water-quality data: recent {label} levels stay below the drinking-water guideline.\n"
+    "3) Risk analysis: {label} peaks follow spring runoff.\n"
+    "4) Recommendations: keep monitoring {label} at intakes."
+)
+
+
+def default_fake_responder(agent: str, messages: list) -> str:
+    """按 agent / prompt 内容返回固定文本 / Canned response chosen by agent and prompt."""
+    text = messages[-1]["content"]
+    if "### BATCH MODE" in text:
+        # 批量规划：按 id 逐条返回规划 / batched planner: one plan per request id
+        requests = json.loads(text.split("Requests (JSON):", 1)[1])
+        return json.dumps([dict(FAKE_PLAN, id=r["id"]) for r in requests])
+    if agent == "planner" or "Agentic AI Planner" in text:
+        return json.dumps(FAKE_PLAN)
+    if agent == "web" or "Web Data Simulation Agent" in text:
+        return FAKE_WEB_SNIPPET
+    if agent == "translator":
+        return FAKE_SUMMARY_ZH
+    if agent == "evaluator":
+        # 批量评估：按 id 逐条返回分数 / batched judge: one score per item id
+        return json.dumps([
+            {"id": item["id"], "score": 4 if "WHO" in item["answer"] else 2,
+             "notes": "Fake evaluation."}
+            for item in json.loads(text)
+        ])
+    if "answer for ONE pollutant only" in messages[0]["content"]:
+        label = text.split("POLLUTANT:", 1)[1].split()[0].replace("_", " ")
+        return FAKE_PARTIAL.format(label=label)
+    if "English only" in messages[0]["content"]:
+        return FAKE_SUMMARY_EN
+    return FAKE_SUMMARY
+
+
+class FakeLLMClient:
+    """
+    - latency_s：每次调用的固定往返延迟
+    - tokens_per_s：生成速率（0 表示不额外等待）
+    - responder(agent, messages) -> str：可替换的应答函数
+    Drop-in replacement for LLMClient. Each call sleeps
+    latency_s + completion_tokens / tokens_per_s; stream() spreads the
+    generation time across chunks. Like LLMClient it gives up with
+    DeadlineExceeded at a call_deadline(). The response cache is disabled
+    by default.
+    """
+
+    def __init__(self, latency_s: float = 0.05, tokens_per_s: float = 0.0,
+                 responder=default_fake_responder, cache=None):
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+        self.responder = responder
+        self.cache = cache if cache is not None else ResponseCache(path=":memory:", enabled=False)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "throttle_wait_s": 0.0}
+
+    def _generation_time(self, text: str) -> float:
+        return estimate_tokens(text) / self.tokens_per_s if self.tokens_per_s else 0.0
+
+    def _sleep(self, seconds: float):
+        """模拟等待，不超过 call_deadline() / Simulated wait, cut short at the active deadline."""
+        left = deadline_left()
+        if left is not None and left < seconds:
+            time.sleep(max(0.0, left))
+            with self._lock:
+                self.counters["failures"] += 1
+            raise DeadlineExceeded("LLM call deadline exceeded")
+        time.sleep(seconds)
+
+    @staticmethod
+    def _record_usage(messages: list, content: str):
+        """按估算的 token 数上报 usage / Report estimated usage to the active span."""
+        tracing.record_usage({
+            "prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+            "completion_tokens": estimate_tokens(content),
+        })
+
+    def complete(self, agent: str, messages: list, model: str = MISTRAL_MODEL_NAME) -> str:
+        cached = self.cache.get(agent, model, messages)
+        if cached is not None:
+            tracing.record_usage(cached=True)
+            return cached
+        with self._lock:
+            self.counters["calls"] += 1
+        content = self.responder(agent, messages)
+        self._sleep(self.latency_s + self._generation_time(content))
+        self._record_usage(messages, content)
+        self.cache.put(agent, model, messages, content)
+        return content
+
+    def stream(self, agent: str, messages: list, model: str = MISTRAL_MODEL_NAME):
+        cached = self.cache.get(agent, model, messages)
+        if cached is not None:
+            tracing.record_usage(cached=True)
+            yield cached
+            return
+        with self._lock:
+            self.counters["calls"] += 1
+        content = self.responder(agent, messages)
+        self._sleep(self.latency_s)
+        for i in range(0, len(content), 16):
+            chunk = content[i:i + 16]
+            self._sleep(self._generation_time(chunk))
+            yield chunk
+        self._record_usage(messages, content)
+        self.cache.put(agent, model, messages, content)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
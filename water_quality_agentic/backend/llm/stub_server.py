@@ -0,0 +1,113 @@
+# backend/llm/stub_server.py
+# 本地 Mistral stub server：用于在无网络环境下测试 LLMClient（重试 / 限流 / 流式）
+# Local Mistral-compatible stub server for exercising LLMClient offline
+#
+# 用法 / usage:
+#   python -m backend.llm.stub_server --port 8900 --fail-first 2
+#   MISTRAL_SERVER_URL=http://127.0.0.1:8900 streamlit run frontend/streamlit_app.py
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_responder(payload: dict) -> str:
+    """回显最后一条消息的开头 / Echo the start of the last message."""
+    return "STUB RESPONSE: " + payload["messages"][-1]["content"].strip()[:80]
+
+
+class StubLLMServer:
+    """
+    - fail_first：前 N 个请求返回 fail_status（默认 429）
+    - latency_s：每个请求的人工延迟
+    - responder(payload) -> str：决定返回内容
+    Serves POST /v1/chat/completions. The first `fail_first` requests get
+    `fail_status`, every request sleeps `latency_s`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, responder=default_responder,
+                 fail_first: int = 0, fail_status: int = 429, latency_s: float = 0.0):
+        self.responder = responder
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.latency_s = latency_s
+        self.requests_seen = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests_seen += 1
+                    seen = server.requests_seen
+                time.sleep(server.latency_s)
+                if seen <= server.fail_first:
+                    self._send(server.fail_status, b'{"message": "stub failure"}')
+                    return
+
+                content = server.responder(payload)
+                usage = {"prompt_tokens": len(json.dumps(payload["messages"])) // 4,
+                         "completion_tokens": len(content) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if not payload.get("stream"):
+                    body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                            "usage": usage}
+                    self._send(200, json.dumps(body).encode("utf-8"))
+                    return
+
+                events = []
+                for i in range(0, len(content), 16):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": content[i:i + 16]}}]}
+                    events.append(f"data: {json.dumps(chunk)}\n\n")
+                events.append(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n")
+                events.append("data: [DONE]\n\n")
+                self._send(200, "".join(events).encode("utf-8"), "text/event-stream")
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Mistral-compatible stub server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubLLMServer(port=args.port, fail_first=args.fail_first,
+                         fail_status=args.fail_status, latency_s=args.latency)
+    print(f"Stub LLM server listening on {stub.url}")
+    stub.httpd.serve_forever()
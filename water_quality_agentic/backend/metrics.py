@@ -0,0 +1,31 @@
+# backend/metrics.py
+# 延迟统计工具：百分位数 / 汇总
+# Latency statistics helpers: percentiles and summaries
+
+import math
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    最近秩法百分位数（pct 取 0–100），空列表返回 0。
+    Nearest-rank percentile (pct in 0-100); 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(values: list) -> dict:
+    """count / mean / p50 / p95 / p99 / max（秒）/ Summary of latencies in seconds."""
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
@@ -0,0 +1,108 @@
+# backend/retrieval/context_packer.py
+# Context Packer：在检索和 Summarizer 之间按 token 预算挑选证据
+# Context packer: fills a token budget with the best evidence before summarization
+
+from backend.retrieval.passages import format_passage
+from backend.retrieval.tokenizer import estimate_tokens, tokenize
+
+DEFAULT_BUDGET_TOKENS = 1800
+DEFAULT_WEB_BUDGET_TOKENS = 400
+
+
+def _truncate_lines(text: str, budget: int) -> str:
+    """按行截断到预算以内 / Keep whole lines until the budget is reached."""
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+class ContextPacker:
+    """
+    输入：按得分排序的段落 + web 文本
+    - 去掉重复 / 高度重叠的段落
+    - web 证据有单独的预算上限
+    - 按得分从高到低装入，直到用完 token 预算
+    Takes ranked passages plus web text, drops duplicate/overlapping passages
+    and greedily fills the token budget with the highest-scoring evidence.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int = DEFAULT_BUDGET_TOKENS,
+        web_budget_tokens: int = DEFAULT_WEB_BUDGET_TOKENS,
+        overlap_threshold: float = 0.8,
+    ):
+        self.budget_tokens = budget_tokens
+        self.web_budget_tokens = web_budget_tokens
+        self.overlap_threshold = overlap_threshold
+
+    def _is_duplicate(self, terms: set, kept_terms: list) -> bool:
+        """较短一方的词项有 overlap_threshold 以上被覆盖即视为重复。"""
+        if not terms:
+            return True
+        for other in kept_terms:
+            overlap = len(terms & other) / min(len(terms), len(other) or 1)
+            if overlap >= self.overlap_threshold:
+                return True
+        return False
+
+    def pack(self, passages: list, web_text: str = "", budget_tokens: int = None) -> tuple:
+        """
+        返回 (inhouse_text, web_text, stats)。stats 记录用掉和丢弃的 token 数。
+        budget_tokens 可临时缩小本次的预算（延迟预算紧张时）。
+        Returns (inhouse_text, web_text, stats); stats counts used/dropped tokens.
+        budget_tokens overrides the budget for this call (tight latency budgets).
+        """
+        budget = self.budget_tokens if budget_tokens is None else budget_tokens
+        stats = {
+            "budget_tokens": budget,
+            "used_tokens": 0,
+            "dropped_tokens": 0,
+            "passages_in": len(passages),
+            "passages_used": 0,
+            "duplicates_removed": 0,
+        }
+
+        # 1) web 证据：超过上限就截断
+        web_tokens = estimate_tokens(web_text) if web_text else 0
+        web_budget = min(self.web_budget_tokens, budget)
+        if web_tokens > web_budget:
+            web_text = _truncate_lines(web_text, web_budget) or web_text[: web_budget * 4]
+            stats["dropped_tokens"] += web_tokens - estimate_tokens(web_text)
+            web_tokens = estimate_tokens(web_text)
+        remaining = budget - web_tokens
+        stats["used_tokens"] += web_tokens
+
+        # 2) 内部段落：去重后按得分贪心装入
+        chunks = []
+        kept_terms = []
+        for p in sorted(passages, key=lambda p: p.get("score", 0.0), reverse=True):
+            text = format_passage(p) if p.get("label") else p["text"]
+            cost = estimate_tokens(text)
+            terms = set(tokenize(p["text"]))
+            if self._is_duplicate(terms, kept_terms):
+                stats["duplicates_removed"] += 1
+                stats["dropped_tokens"] += cost
+                continue
+            if cost > remaining:
+                # 第一条证据就超预算时截断保留，避免上下文为空
+                if not chunks and remaining > 0:
+                    text = _truncate_lines(text, remaining)
+                    stats["dropped_tokens"] += cost - estimate_tokens(text)
+                    cost = estimate_tokens(text)
+                else:
+                    stats["dropped_tokens"] += cost
+                    continue
+            chunks.append(text)
+            kept_terms.append(terms)
+            remaining -= cost
+            stats["used_tokens"] += cost
+            stats["passages_used"] += 1
+
+        return "\n\n".join(chunks), web_text, stats
@@ -0,0 +1,418 @@
+# backend/retrieval/corpus_index.py
+# 持久化语料索引：SQLite（mmap）保存文件指纹、段落和 BM25 倒排表，多进程共享，按 mtime/hash 增量更新
+# Persistent corpus index: files, passages and BM25 postings in a memory-mapped
+# SQLite file shared by every worker process, reindexed incrementally by mtime/hash
+
+import hashlib
+import heapq
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from backend.retrieval.measurements import extract_measurements
+from backend.retrieval.passages import split_languages, split_passages
+from backend.retrieval.tokenizer import tokenize
+
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+CORPUS_DIR = DATA_DIR / "inhouse_corpus"
+# WQ_CORPUS_INDEX_PATH 可把索引放到别处（例如共享盘）/ override to place the index elsewhere
+INDEX_DB_PATH = Path(os.getenv("WQ_CORPUS_INDEX_PATH", DATA_DIR / "corpus_index.db"))
+
+# 参与索引的文件类型 / file types picked up from the corpus directory
+CORPUS_SUFFIXES = {".txt", ".md"}
+DEFAULT_MMAP_BYTES = 256 * 1024 * 1024
+# 表结构或抽取逻辑变化时加一，旧索引会被整体重建
+# Bump when the schema or extraction changes; older index files are rebuilt
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    doc_key TEXT,
+    label TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT,
+    doc TEXT,
+    label TEXT,
+    section TEXT,
+    text TEXT,
+    length INTEGER,
+    lang TEXT,
+    text_en TEXT,
+    text_zh TEXT,
+    paired INTEGER,
+    pair_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_passages_path ON passages (path);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT,
+    passage_id INTEGER,
+    tf INTEGER,
+    PRIMARY KEY (term, passage_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_passage ON postings (passage_id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT,
+    doc TEXT,
+    parameter TEXT,
+    location TEXT,
+    year INTEGER,
+    kind TEXT,
+    stat TEXT,
+    value REAL,
+    unit TEXT,
+    guideline_value REAL,
+    guideline_source TEXT,
+    sentence TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_lookup ON measurements (parameter, kind, location, year);
+CREATE INDEX IF NOT EXISTS idx_measurements_path ON measurements (path);
+"""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_doc_key(rel_path: str) -> tuple:
+    """未登记文件的 (doc_key, label)：用文件名生成 / Fallback key and label from the file name."""
+    stem = Path(rel_path).with_suffix("").as_posix()
+    return stem, Path(stem).name.replace("_", " ").title()
+
+
+class CorpusIndex:
+    """
+    - sync()：扫描 corpus_dir，只重新切分 / 分词新增或变化的文件，删除已不存在的文件
+    - refresh()：只读，重新读取其它进程 sync 之后的统计，返回文件是否有变化
+    - search(query, top_k)：直接在 SQLite 倒排表上做 BM25 打分
+    - get_passages(ids)：按 id 取段落 dict
+    The index lives in one SQLite file opened with mmap, so worker processes
+    share the OS page cache instead of each re-reading and re-tokenizing the
+    corpus. Unchanged files are detected by size + mtime, then by sha256.
+    """
+
+    def __init__(
+        self,
+        corpus_dir: Path = CORPUS_DIR,
+        path: Path = INDEX_DB_PATH,
+        doc_keys: dict = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        mmap_bytes: int = DEFAULT_MMAP_BYTES,
+    ):
+        """doc_keys: 相对路径 -> (doc_key, label)，未登记的文件用 default_doc_key。"""
+        self.corpus_dir = Path(corpus_dir)
+        self.path = path
+        self.doc_keys = doc_keys or {}
+        self.k1 = k1
+        self.b = b
+        self.mmap_bytes = mmap_bytes
+        self.n_passages = 0
+        self.avgdl = 0.0
+        self.last_sync = 0.0
+        self._files_sig = None
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        conn = self._conn()
+        if conn.execute("PRAGMA user_version;").fetchone()[0] < SCHEMA_VERSION:
+            # 旧版本的索引直接删表重建，下一次 sync 重新处理所有文件
+            # Older index layouts are dropped; the next sync re-processes every file
+            conn.executescript(
+                "DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS passages;"
+                "DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS terms;"
+                "DROP TABLE IF EXISTS measurements;"
+                f"PRAGMA user_version={SCHEMA_VERSION};"
+            )
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        self._refresh_stats()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个只读为主的连接 / One connection per thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)};")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA busy_timeout=30000;")
+            self._local.conn = conn
+        return conn
+
+    def _refresh_stats(self) -> bool:
+        """重新读取段落统计，返回 files 表自上次读取后是否变化 / True if the files table changed."""
+        conn = self._conn()
+        n, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM passages;"
+        ).fetchone()
+        self.n_passages = n
+        self.avgdl = (total / n) if n else 0.0
+        sig = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(MAX(mtime_ns), 0) FROM files;"
+        ).fetchone()
+        changed = self._files_sig is not None and sig != self._files_sig
+        self._files_sig = sig
+        return changed
+
+    # ---------- 增量建索引 ----------
+
+    def _discover(self) -> dict:
+        """相对路径 -> Path，覆盖 corpus_dir 下所有子目录 / Every corpus file, recursively."""
+        if not self.corpus_dir.exists():
+            return {}
+        return {
+            p.relative_to(self.corpus_dir).as_posix(): p
+            for p in sorted(self.corpus_dir.rglob("*"))
+            if p.is_file() and p.suffix.lower() in CORPUS_SUFFIXES
+        }
+
+    def sync(self) -> dict:
+        """
+        增量更新索引，返回 {"added", "updated", "removed", "touched", "unchanged", "elapsed_s"}。
+        touched 表示 mtime 变了但内容 hash 没变。
+        Bring the index up to date with the corpus directory; only new or
+        modified files are re-chunked and re-tokenized.
+        """
+        start = time.perf_counter()
+        stats = {"added": 0, "updated": 0, "removed": 0, "touched": 0, "unchanged": 0}
+        with self._sync_lock:
+            conn = self._conn()
+            # IMMEDIATE：多个进程同时启动时只有一个在写，其它等待后看到最新状态
+            # IMMEDIATE: concurrent workers serialize here and then see the fresh state
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                known = {
+                    row[0]: row[1:]
+                    for row in conn.execute("SELECT path, size, mtime_ns, sha256 FROM files;")
+                }
+                found = self._discover()
+                for rel, file_path in found.items():
+                    st = file_path.stat()
+                    old = known.get(rel)
+                    if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                        stats["unchanged"] += 1
+                        continue
+                    sha = _sha256(file_path)
+                    if old is not None and old[2] == sha:
+                        conn.execute(
+                            "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?;",
+                            (st.st_size, st.st_mtime_ns, rel),
+                        )
+                        stats["touched"] += 1
+                        continue
+                    if old is not None:
+                        self._drop_file(conn, rel)
+                    self._index_file(conn, rel, file_path, st, sha)
+                    stats["updated" if old is not None else "added"] += 1
+                for rel in known.keys() - found.keys():
+                    self._drop_file(conn, rel)
+                    conn.execute("DELETE FROM files WHERE path = ?;", (rel,))
+                    stats["removed"] += 1
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            self._refresh_stats()
+            self.last_sync = time.monotonic()
+        stats["elapsed_s"] = round(time.perf_counter() - start, 4)
+        return stats
+
+    def refresh(self) -> bool:
+        """
+        只读：不扫描目录、不开写事务，只重新读取另一个进程 sync 之后的统计。
+        Read-only: picks up another process's sync without scanning the
+        directory or taking the write lock. Returns True if files changed.
+        """
+        with self._sync_lock:
+            return self._refresh_stats()
+
+    def _drop_file(self, conn, rel: str):
+        conn.execute("DELETE FROM measurements WHERE path = ?;", (rel,))
+        ids = [row[0] for row in conn.execute("SELECT id FROM passages WHERE path = ?;", (rel,))]
+        if not ids:
+            return
+        marks = ",".join("?" * len(ids))
+        df_delta = Counter(
+            row[0] for row in conn.execute(
+                f"SELECT term FROM postings WHERE passage_id IN ({marks});", ids
+            )
+        )
+        conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?;",
+                         [(n, term) for term, n in df_delta.items()])
+        conn.execute("DELETE FROM terms WHERE df <= 0;")
+        conn.execute(f"DELETE FROM postings WHERE passage_id IN ({marks});", ids)
+        conn.execute("DELETE FROM passages WHERE path = ?;", (rel,))
+
+    def _index_file(self, conn, rel: str, file_path: Path, st, sha: str):
+        doc_key, label = self.doc_keys.get(rel) or default_doc_key(rel)
+        text = file_path.read_text(encoding="utf-8", errors="replace")
+        df_delta = Counter()
+        # 同一章节里的纯英文段落和纯中文段落按顺序互相配对
+        # Pure-English and pure-Chinese passages of one section are paired in order
+        by_section = {}
+        for p in split_passages(doc_key, label, text):
+            terms = Counter(tokenize(f"{p['section']}\n{p['text']}"))
+            langs = split_languages(p["text"])
+            cur = conn.execute(
+                """
+                INSERT INTO passages (path, doc, label, section, text, length,
+                                      lang, text_en, text_zh, paired)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                """,
+                (rel, p["doc"], p["label"], p["section"], p["text"], sum(terms.values()),
+                 langs["lang"], langs["text_en"], langs["text_zh"], int(langs["paired"])),
+            )
+            conn.executemany(
+                "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?);",
+                [(term, cur.lastrowid, tf) for term, tf in terms.items()],
+            )
+            df_delta.update(terms.keys())
+            if langs["lang"] != "mixed":
+                by_section.setdefault(p["section"], {"en": [], "zh": []})[langs["lang"]].append(
+                    cur.lastrowid
+                )
+        for group in by_section.values():
+            for en_id, zh_id in zip(group["en"], group["zh"]):
+                conn.executemany("UPDATE passages SET pair_id = ? WHERE id = ?;",
+                                 [(zh_id, en_id), (en_id, zh_id)])
+        conn.executemany(
+            """
+            INSERT INTO measurements (path, doc, parameter, location, year, kind, stat, value,
+                                      unit, guideline_value, guideline_source, sentence)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            [(rel, m["doc"], m["parameter"], m["location"], m["year"], m["kind"], m["stat"],
+              m["value"], m["unit"], m["guideline_value"], m["guideline_source"], m["sentence"])
+             for m in extract_measurements(doc_key, text)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO terms (term, df) VALUES (?, ?)
+            ON CONFLICT(term) DO UPDATE SET df = df + excluded.df;
+            """,
+            list(df_delta.items()),
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO files (path, doc_key, label, size, mtime_ns, sha256, indexed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+            """,
+            (rel, doc_key, label, st.st_size, st.st_mtime_ns, sha, time.time()),
+        )
+
+    # ---------- 查询 ----------
+
+    def search(self, query: str, top_k: int = 5) -> list:
+        """
+        Okapi BM25 打分，返回 [(passage_id, score), ...]；df 取自 terms 表，
+        语料里没有的查询词不会去扫倒排表。
+        Okapi BM25 over the index file, returning [(passage_id, score), ...].
+        Document frequencies come from the terms table, so query terms the
+        corpus lacks never touch the postings.
+        """
+        if not self.n_passages:
+            return []
+        conn = self._conn()
+        n, avgdl, k1, b = self.n_passages, self.avgdl, self.k1, self.b
+        query_terms = list(set(tokenize(query)))
+        if not query_terms:
+            return []
+        df = dict(conn.execute(
+            f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(query_terms))});",
+            query_terms,
+        ))
+        scores = {}
+        for term, term_df in df.items():
+            idf = math.log(1 + (n - term_df + 0.5) / (term_df + 0.5))
+            rows = conn.execute(
+                """
+                SELECT po.passage_id, po.tf, pa.length
+                FROM postings po JOIN passages pa ON pa.id = po.passage_id
+                WHERE po.term = ?;
+                """,
+                (term,),
+            )
+            for passage_id, tf, length in rows:
+                norm = k1 * (1 - b + b * length / avgdl)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def get_passages(self, ids: list) -> list:
+        """按给定顺序返回段落 dict / Passage dicts in the order of `ids`."""
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        columns = ("doc", "label", "section", "text", "lang", "text_en", "text_zh", "paired",
+                   "pair_id")
+        rows = {
+            row[0]: dict(zip(columns, row[1:]), id=row[0], paired=bool(row[8]))
+            for row in self._conn().execute(
+                f"SELECT id, {', '.join(columns)} FROM passages WHERE id IN ({marks});", ids
+            )
+        }
+        return [rows[i] for i in ids if i in rows]
+
+    def lookup_measurements(self, parameter: str, kind: str = "observation",
+                            location: str = None, year: int = None) -> list:
+        """
+        按参数 / 地点 / 年份查测量值（走 idx_measurements_lookup 索引）。
+        Measurement rows for one parameter, optionally filtered by location and year.
+        """
+        sql = """
+            SELECT doc, parameter, location, year, kind, stat, value, unit,
+                   guideline_value, guideline_source, sentence
+            FROM measurements WHERE parameter = ? AND kind = ?
+        """
+        params = [parameter, kind]
+        if location:
+            sql += " AND location = ? COLLATE NOCASE"
+            params.append(location)
+        if year:
+            sql += " AND year = ?"
+            params.append(int(year))
+        sql += " ORDER BY year DESC, id;"
+        columns = ("doc", "parameter", "location", "year", "kind", "stat", "value", "unit",
+                   "guideline_value", "guideline_source", "sentence")
+        return [dict(zip(columns, row)) for row in self._conn().execute(sql, params)]
+
+    def locations(self) -> list:
+        """出现过的所有地点 / Every location that has measurements."""
+        return [row[0] for row in self._conn().execute(
+            "SELECT DISTINCT location FROM measurements WHERE location != '';"
+        )]
+
+    def guideline_for(self, parameter: str, unit: str):
+        """参数的指南限值行，优先 WHO / Guideline row for a parameter (WHO first), or None."""
+        rows = [r for r in self.lookup_measurements(parameter, kind="guideline") if r["unit"] == unit]
+        rows.sort(key=lambda r: r["guideline_source"] != "WHO")
+        return rows[0] if rows else None
+
+    def documents(self) -> dict:
+        """doc_key -> 文件路径 / doc_key -> file path of every indexed file."""
+        return {
+            doc_key: self.corpus_dir / rel
+            for rel, doc_key in self._conn().execute("SELECT path, doc_key FROM files;")
+        }
+
+    def stats(self) -> dict:
+        files = self._conn().execute("SELECT COUNT(*) FROM files;").fetchone()[0]
+        return {"files": files, "passages": self.n_passages, "avgdl": round(self.avgdl, 2)}
@@ -0,0 +1,184 @@
+# backend/retrieval/measurements.py
+# 结构化测量值抽取：从语料中的英文句子里抽取 参数 / 地点 / 年份 / 数值 / 单位 / 指南限值
+# Structured measurement extraction: parameter, location, year, value, unit and
+# guideline limit pulled from the English sentences of the corpus
+
+import re
+
+from backend.retrieval.passages import HEADING_RE
+from backend.retrieval.tokenizer import CJK_RE
+from backend.retrieval.topic_router import get_router
+
+# 参数 -> 别名（英文小写 + 中文），来自共享的关键词登记表；查询和抽取共用
+# Parameter -> aliases (lower-case English + Chinese) from the shared keyword
+# registry (data/topic_keywords.json), used by extraction and queries alike
+PARAMETERS = get_router().terms("parameter")
+
+# 统一到 mg/L 比较；微生物指标单独一个单位
+# Mass concentrations are normalized to mg/L; microbial counts keep their own unit
+UNIT_SCALE = {"mg/l": ("mg/L", 1.0), "µg/l": ("mg/L", 0.001), "μg/l": ("mg/L", 0.001),
+              "ug/l": ("mg/L", 0.001)}
+COUNT_UNIT = "CFU/100 mL"
+
+VALUE_RE = re.compile(
+    r"(?P<cmp><\s*)?(?P<value>\d+(?:\.\d+)?)\s*"
+    r"(?P<unit>mg/L|µg/L|μg/L|ug/L|(?:CFU\s+)?(?:per|/)\s*100\s*mL)",
+    re.IGNORECASE,
+)
+GUIDELINE_BEFORE_RE = re.compile(r"guideline|limit|recommended maximum|standard|maximum acceptable",
+                                 re.IGNORECASE)
+GUIDELINE_AFTER_RE = re.compile(r"^\s*(?:\([^)]*\)\s*)?(?:guideline|limit)", re.IGNORECASE)
+AVERAGE_RE = re.compile(r"\baverage|\baveraged|\bmean\b|\btypically\b|\baround\b", re.IGNORECASE)
+PEAK_RE = re.compile(r"\bpeaks?\b|\bup to\b|\bmaximum observed\b|\bhighest\b", re.IGNORECASE)
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}\b")
+# "Lake Ontario" / "Ontario Lake"（统一为前者）/ "Grand River" / "Hamilton Harbour" ...
+LAKE_FIRST_RE = re.compile(r"\bLake\s+([A-Z][a-z]+)\b")
+LAKE_LAST_RE = re.compile(r"\b([A-Z][a-z]+)\s+Lake\b")
+WATERBODY_RE = re.compile(r"\b[A-Z][a-z]+\s+(?:River|Bay|Harbour|Harbor|Creek)\b")
+NOT_A_NAME = {"Water", "Quality", "Health", "Report", "Monitoring"}
+AUTHORITY_RE = re.compile(r"\b(WHO|EPA|Health Canada|EU)\b")
+
+
+def _compile(aliases: list):
+    parts = []
+    for alias in sorted(aliases, key=len, reverse=True):
+        escaped = re.escape(alias)
+        parts.append(rf"\b{escaped}(?![a-z])" if alias.isascii() else escaped)
+    return re.compile("|".join(parts))
+
+
+_PARAMETER_RE = {name: _compile(aliases) for name, aliases in PARAMETERS.items()}
+
+
+def find_parameters(text: str) -> list:
+    """按出现位置排序的参数名 / Parameter names in order of first mention."""
+    lowered = text.lower()
+    found = []
+    for name, rx in _PARAMETER_RE.items():
+        m = rx.search(lowered)
+        if m:
+            found.append((m.start(), name))
+    return [name for _, name in sorted(found)]
+
+
+def find_location(text: str) -> str:
+    """文本中的水体名称，湖泊统一写成 "Lake X" / Water body named in the text."""
+    for rx in (LAKE_FIRST_RE, LAKE_LAST_RE):
+        for m in rx.finditer(text):
+            if m.group(1) not in NOT_A_NAME:
+                return f"Lake {m.group(1)}"
+    m = WATERBODY_RE.search(text)
+    return m.group() if m else ""
+
+
+def _normalize(value: float, unit: str) -> tuple:
+    key = unit.lower().replace(" ", "")
+    if key in UNIT_SCALE:
+        norm_unit, scale = UNIT_SCALE[key]
+        return value * scale, norm_unit
+    return value, COUNT_UNIT
+
+
+def extract_measurements(doc_key: str, text: str) -> list:
+    """
+    从一篇文档中抽取测量值。只看英文行（中文行是同一事实的翻译）。
+    每条记录：{"doc", "parameter", "location", "year", "kind", "stat", "value", "unit",
+               "guideline_value", "guideline_source", "sentence"}
+    kind 为 "observation"（监测值）或 "guideline"（指南限值本身）。
+    Extract measurements from one document (English lines only; the Chinese
+    lines translate the same facts). kind is "observation" or "guideline".
+    """
+    lines = text.splitlines()
+    title = " ".join(line.strip() for line in lines[:2])
+    doc_location = find_location(title)
+    doc_year = (YEAR_RE.findall(title) or [None])[0]
+    doc_source = (AUTHORITY_RE.findall(title) or [""])[0]
+    # 指南类文档里的数值都是限值 / every value in a guideline document is a limit
+    guideline_doc = bool(GUIDELINE_BEFORE_RE.search(title))
+
+    records = []
+    section = ""
+    for raw in lines:
+        stripped = raw.strip()
+        if HEADING_RE.match(stripped):
+            section = stripped
+            continue
+        line = stripped.lstrip("- ").strip()
+        if not line or CJK_RE.search(line):
+            continue
+        matches = list(VALUE_RE.finditer(line))
+        if not matches:
+            continue
+        params = find_parameters(line) or find_parameters(section)
+        if not params:
+            continue
+        parameter = params[0]
+        location = find_location(line) or doc_location
+        year = (YEAR_RE.findall(line) or [doc_year])[0]
+        source = (AUTHORITY_RE.findall(line) or [doc_source])[0]
+
+        observed, guideline = [], None
+        prev_end = 0
+        for m in matches:
+            before = line[prev_end:m.start()]
+            after = line[m.end():m.end() + 30]
+            value, unit = _normalize(float(m.group("value")), m.group("unit"))
+            if (guideline_doc or GUIDELINE_BEFORE_RE.search(before)
+                    or GUIDELINE_AFTER_RE.search(after)):
+                guideline = guideline if guideline is not None else (value, unit)
+            else:
+                observed.append((value, unit, before))
+            prev_end = m.end()
+
+        base = {"doc": doc_key, "parameter": parameter, "location": location, "year": year,
+                "guideline_source": source, "sentence": line}
+        if not observed and guideline is not None:
+            records.append(dict(base, kind="guideline", stat="guideline", value=guideline[0],
+                                unit=guideline[1], guideline_value=guideline[0]))
+            continue
+        for value, unit, before in observed:
+            if PEAK_RE.search(before) or PEAK_RE.search(line) and not AVERAGE_RE.search(before):
+                stat = "peak"
+            elif AVERAGE_RE.search(before):
+                stat = "average"
+            else:
+                stat = "value"
+            limit = guideline[0] if guideline is not None and guideline[1] == unit else None
+            records.append(dict(base, kind="observation", stat=stat, value=value, unit=unit,
+                                guideline_value=limit))
+    return records
+
+
+# ---------- 限值判断 / limit checks ----------
+
+def limit_status(value: float, limit: float) -> str:
+    """within / exceeds，并给出占限值的百分比 / Verdict plus percent of the limit."""
+    if limit is None:
+        return "no guideline"
+    if limit == 0:
+        return "within" if value == 0 else "exceeds (guideline is zero)"
+    verdict = "within" if value <= limit else "exceeds"
+    return f"{verdict} ({value / limit:.0%} of limit)"
+
+
+def _fmt(value: float) -> str:
+    return f"{value:g}"
+
+
+def format_measurement_table(rows: list) -> str:
+    """
+    把 check 结果渲染成紧凑的表格，代替原始文档交给 Summarizer。
+    Render limit-check rows as a compact table for the summarizer.
+    """
+    lines = ["Parameter | Location | Year | Statistic | Value | Guideline | Status"]
+    for r in rows:
+        guideline = "-"
+        if r.get("guideline_value") is not None:
+            guideline = f"{_fmt(r['guideline_value'])} {r['unit']}"
+            if r.get("guideline_source"):
+                guideline += f" ({r['guideline_source']})"
+        lines.append(" | ".join([
+            r["parameter"], r.get("location") or "-", str(r.get("year") or "-"), r["stat"],
+            f"{_fmt(r['value'])} {r['unit']}", guideline, r["status"],
+        ]))
+    return "\n".join(lines)
@@ -0,0 +1,172 @@
+# backend/retrieval/passages.py
+# 语料切分：把整篇文档切成“章节 / 要点”级别的段落
+# Corpus chunking: split whole documents into section/bullet-level passages
+
+import re
+
+from backend.retrieval.tokenizer import CJK_RE
+
+RULE_RE = re.compile(r"^-{5,}\s*$")
+HEADING_RE = re.compile(r"^\d+\.\s+\S")
+LANG_MARKERS = ("English:", "中文：", "中文:")
+
+# 单个段落的最大字符数，超过则按行再切分
+# Max characters per passage; longer blocks are split on line boundaries
+MAX_PASSAGE_CHARS = 600
+
+
+def _is_bullet(line: str) -> bool:
+    return line.lstrip().startswith("- ")
+
+
+def split_passages(doc_key: str, label: str, text: str, max_chars: int = MAX_PASSAGE_CHARS) -> list:
+    """
+    按章节标题、空行和 English/中文 标记切分文档。
+    每个段落是一个 dict：{"doc", "label", "section", "text"}。
+    Split one document on section headings, blank lines and English/中文
+    markers. Each passage is a dict with doc, label, section and text.
+    """
+    passages = []
+    section = ""
+    block = []
+    in_heading = False
+    # 文件开头到第一个空行是文档标题 / the lines up to the first blank line are the title
+    in_title = True
+
+    def flush():
+        if not block:
+            return
+        window = []
+        size = 0
+        for line in block:
+            if window and size + len(line) > max_chars:
+                passages.append({"doc": doc_key, "label": label, "section": section,
+                                 "text": "\n".join(window)})
+                window, size = [], 0
+            window.append(line)
+            size += len(line) + 1
+        passages.append({"doc": doc_key, "label": label, "section": section,
+                         "text": "\n".join(window)})
+        block.clear()
+
+    for raw in text.splitlines():
+        line = raw.rstrip()
+        stripped = line.strip()
+
+        if RULE_RE.match(stripped):
+            in_heading = False
+            continue
+        if not stripped:
+            flush()
+            in_heading = False
+            in_title = False
+            continue
+        if HEADING_RE.match(stripped):
+            flush()
+            section = stripped
+            in_heading = True
+            in_title = False
+            continue
+        if stripped in LANG_MARKERS:
+            flush()
+            in_heading = False
+            continue
+        # 标题后紧跟的中文标题行（无要点符号）并入章节名
+        # A non-bullet Chinese line directly under a heading is its translated title
+        if in_heading and not _is_bullet(line) and CJK_RE.search(stripped):
+            section = f"{section} / {stripped}"
+            continue
+        in_heading = False
+        # 文档标题已由 label 表示；没有编号章节的报告正文照常切分
+        # The title is represented by the label; body text of reports without
+        # numbered sections is still kept
+        if in_title:
+            continue
+        block.append(line)
+
+    flush()
+    return passages
+
+
+# ---------- 语言标注 / language tagging ----------
+
+LATIN_WORD_RE = re.compile(r"[A-Za-z]+")
+BILINGUAL_LABEL_RE = re.compile(r"[A-Za-z][^/]*\s/\s*[一-鿿]")
+LANGUAGES = ("en", "zh")
+
+
+def tag_language(line: str) -> str:
+    """
+    单行语言：无中文为 "en"；"English / 中文" 标签行为 "mixed"；
+    中文字数不少于英文单词数为 "zh"；否则 "mixed"。
+    Line language: "en" without CJK, "mixed" for bilingual "English / 中文"
+    labels, "zh" when CJK characters outnumber Latin words, else "mixed".
+    """
+    cjk = len(CJK_RE.findall(line))
+    if not cjk:
+        return "en"
+    # "Note / 说明：" 这类双语标题行 / bilingual label lines like "Note / 说明："
+    if BILINGUAL_LABEL_RE.search(line):
+        return "mixed"
+    return "zh" if cjk >= len(LATIN_WORD_RE.findall(line)) else "mixed"
+
+
+def split_languages(text: str) -> dict:
+    """
+    把段落拆成英文版和中文版（mixed 行两边都保留），并判断两者能否逐行配对。
+    返回 {"lang": "en" / "zh" / "mixed", "text_en", "text_zh", "paired"}。
+    paired 为 True 时第 i 行英文与第 i 行中文互为翻译。
+    Split a passage into its English and Chinese versions (mixed lines go to
+    both). When paired is True, line i of text_en translates line i of text_zh.
+    """
+    en, zh, en_only, zh_only = [], [], 0, 0
+    for line in text.splitlines():
+        tag = tag_language(line)
+        if tag != "zh":
+            en.append(line)
+            en_only += tag == "en"
+        if tag != "en":
+            zh.append(line)
+            zh_only += tag == "zh"
+    if en_only and zh_only:
+        lang = "mixed"
+    else:
+        lang = "zh" if zh_only else "en"
+    return {
+        "lang": lang,
+        "text_en": "\n".join(en),
+        "text_zh": "\n".join(zh),
+        "paired": bool(en_only and en_only == zh_only and len(en) == len(zh)),
+    }
+
+
+def query_language(query: str) -> str:
+    """查询语言：中文为主返回 "zh"，否则 "en" / Dominant language of a query."""
+    return "zh" if tag_language(query) == "zh" else "en"
+
+
+def select_language(passage: dict, language: str) -> dict:
+    """
+    返回只含一种语言文本的段落副本；另一种语言保留在 text_en / text_zh 中，可用于引用还原。
+    Copy of the passage whose "text" holds one language only; both versions
+    stay in text_en / text_zh so the other language can be restored.
+    """
+    if language not in LANGUAGES or passage.get("lang", "mixed") != "mixed":
+        return passage
+    text = passage.get(f"text_{language}") or passage["text"]
+    return dict(passage, text=text)
+
+
+def translation_pairs(passage: dict) -> list:
+    """逐行配对的 (英文, 中文)；不能配对时为空 / Line-aligned (en, zh) pairs, if any."""
+    if not passage.get("paired"):
+        return []
+    return list(zip(passage["text_en"].splitlines(), passage["text_zh"].splitlines()))
+
+
+def format_passage(passage: dict) -> str:
+    """渲染为 prompt 片段 / Render a passage as a prompt snippet."""
+    header = f"【{passage['label']}】"
+    if passage.get("section"):
+        header += f" {passage['section']}"
+    return f"{header}\n{passage['text']}"
@@ -0,0 +1,53 @@
+# backend/retrieval/tokenizer.py
+# 中英双语分词：英文按单词切分，中文按单字 + 双字切分
+# Bilingual tokenizer: English words + Chinese character unigrams/bigrams
+
+import re
+
+# 英文单词（允许 0.003 这类小数）或连续的中文字符
+# English words (incl. decimals like 0.003) or runs of CJK characters
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?|[一-鿿]+")
+CJK_RE = re.compile(r"[一-鿿]")
+
+EN_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does",
+    "for", "from", "has", "have", "how", "i", "in", "is", "it", "its", "of",
+    "on", "or", "should", "so", "such", "that", "the", "their", "then",
+    "there", "these", "this", "to", "want", "was", "were", "what", "when",
+    "whether", "which", "will", "with", "within",
+}
+
+
+def _stem(word: str) -> str:
+    """极简词干：去掉复数 s / Minimal stemming: strip plural "s"."""
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """
+    把文本切分为检索用的 token 列表。
+    - 英文：小写、去停用词、去复数
+    - 中文：单字 + 相邻双字（无需分词词典）
+    Split text into index terms. English words are lower-cased, stop-word
+    filtered and lightly stemmed; Chinese runs become unigrams + bigrams.
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        tok = match.group()
+        if CJK_RE.match(tok):
+            tokens.extend(tok)
+            tokens.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+        elif tok not in EN_STOPWORDS:
+            tokens.append(_stem(tok))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计 LLM token 数：中文约 1 字 1 token，其余约 4 字符 1 token。
+    Rough LLM token estimate: ~1 token per CJK char, ~4 chars per token otherwise.
+    """
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
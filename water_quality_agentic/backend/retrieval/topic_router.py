@@ -0,0 +1,212 @@
+# backend/retrieval/topic_router.py
+# 主题路由：中英文关键词 / 同义词登记在 data/topic_keywords.json，编译成一个前缀树形的正则，
+# 一次扫描返回所有命中（分组、名称、位置、权重）。规则规划器、关键词检索和测量抽取共用。
+# Topic router: one EN/CN keyword and synonym registry (data/topic_keywords.json)
+# compiled into a single trie-shaped regex that returns every hit with its
+# group, name, position and weight in one pass. Shared by the rule planner, the in-house
+# keyword routing and measurement extraction, so they cannot disagree.
+
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+TOPIC_KEYWORDS_PATH = Path(os.getenv(
+    "WQ_TOPIC_KEYWORDS_PATH", Path(__file__).resolve().parents[2] / "data" / "topic_keywords.json"
+))
+
+# 登记表中的分组：topic（污染物 / 背景主题）、focus（问题类型）、signal（时效 / 地点 / 指南）、
+# parameter（可抽取数值的具体参数）、region（水体 / 地区）、ignore（形似关键词的短语，
+# 如动词 "lead to"：按最长匹配吃掉这段文本，不产生命中）
+# Registry groups: topic (pollutant / context), focus (question type), signal
+# (recency, place, guideline cues), parameter (concrete measurable parameters),
+# region (named water bodies) and ignore (phrases that only look like a term,
+# e.g. the verb "lead to": they win the longest match and produce no hit)
+GROUPS = ("topic", "focus", "signal", "parameter", "region", "ignore")
+
+
+def load_registry(path: Path = TOPIC_KEYWORDS_PATH) -> dict:
+    """
+    读取登记表：{group: {name: {"terms": [...], "weight": 1.0, ...}}}，以 "_" 开头的键忽略。
+    Load the registry; keys starting with "_" are comments.
+    """
+    raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    registry = {}
+    for group in GROUPS:
+        entries = raw.get(group, {})
+        registry[group] = {
+            name: dict(entry, terms=[t.lower() for t in entry["terms"]],
+                       weight=float(entry.get("weight", 1.0)))
+            for name, entry in entries.items() if not name.startswith("_")
+        }
+    return registry
+
+
+def term_pattern(term: str) -> str:
+    """
+    英文词两端是字母 / 数字时加单词边界，中文直接子串匹配（单独使用某个词时的正则）。
+    Regex for one term on its own: word boundaries on the ASCII word-character
+    ends, plain substring for Chinese terms.
+    """
+    escaped = re.escape(term)
+    if _needs_boundary(term[:1]):
+        escaped = r"\b" + escaped
+    if _needs_boundary(term[-1:]):
+        escaped += r"\b"
+    return escaped
+
+
+def _needs_boundary(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _trie_pattern(terms: list) -> str:
+    """
+    把所有词按前缀合并成一个正则（贪婪，最长优先），每个位置只需尝试一个分支。
+    Merge the terms into one prefix-factored (trie-shaped) regex; greedy, so
+    the longest term wins and each position only explores one branch.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node) -> str:
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = f"(?:{body})?" if len(branches) == 1 and len(body) > 1 else body + "?"
+        return body
+
+    return emit(trie)
+
+
+class TopicRouter:
+    """
+    - route(query)：所有命中 [{"group", "name", "term", "start", "end", "weight", "nested"}]，按位置排序
+    - names(query, group)：某分组命中的名称，按首次出现排序
+    - scores(query, group)：某分组每个名称的权重和
+    - terms(group, kind)：{name: [terms]}，供需要原始词表的调用方使用
+    All terms are compiled into one trie-shaped regex scanned once per query
+    (longest match wins). A term also reports every registered term it
+    contains ("lake ontario" -> "lake", "total phosphorus" -> "phosphorus"),
+    so nested hits are not lost; an ignore-group term reports nothing, not
+    even the terms inside it. Results are memoized per query.
+    """
+
+    def __init__(self, registry: dict = None, cache_size: int = 4096):
+        self.registry = registry if registry is not None else load_registry()
+        # term -> [(group, name, weight), ...]
+        own = {}
+        for group, names in self.registry.items():
+            for name, entry in names.items():
+                for term in entry["terms"]:
+                    own.setdefault(term, []).append((group, name, entry["weight"]))
+        terms = sorted(own, key=len, reverse=True)
+        # term -> [(group, name, weight, sub_term, offset, nested)]：自身及其包含的词；
+        # nested 表示外层词在同一分组里也有登记（"heavy metals" 里的 "heavy metal"）
+        # term -> its own entries plus those of every term nested inside it;
+        # `nested` when the outer term is registered in the same group too
+        self._entries = {}
+        # term -> 作为它前缀的更短的词（最长在前），最长匹配不满足单词边界时回退
+        # term -> shorter registered prefixes, longest first, tried when the
+        # longest match fails its word-boundary check
+        self._prefixes = {}
+        for term in terms:
+            found = [(g, n, w, term, 0, False) for g, n, w in own[term]]
+            outer_groups = {g for g, _, _ in own[term]}
+            prefixes = []
+            for shorter in terms:
+                if len(shorter) >= len(term):
+                    continue
+                for match in re.finditer(term_pattern(shorter), term):
+                    found.extend((g, n, w, shorter, match.start(), g in outer_groups)
+                                 for g, n, w in own[shorter])
+                if term.startswith(shorter):
+                    prefixes.append(shorter)
+            self._entries[term] = [] if "ignore" in outer_groups else found
+            self._prefixes[term] = prefixes
+        self._regex = re.compile(_trie_pattern(terms)) if terms else None
+        self._route = lru_cache(maxsize=cache_size)(self._scan)
+
+    @staticmethod
+    def _bounded(q: str, start: int, term: str) -> bool:
+        end = start + len(term)
+        if _needs_boundary(term[0]) and start > 0 and _is_word(q[start - 1]):
+            return False
+        if _needs_boundary(term[-1]) and end < len(q) and _is_word(q[end]):
+            return False
+        return True
+
+    def _scan(self, q: str) -> tuple:
+        if self._regex is None:
+            return ()
+        hits = []
+        for match in self._regex.finditer(q):
+            start = match.start()
+            term = next((t for t in [match.group()] + self._prefixes[match.group()]
+                         if self._bounded(q, start, t)), None)
+            if term is None:
+                continue
+            for group, name, weight, sub_term, offset, nested in self._entries[term]:
+                hits.append((group, name, sub_term, start + offset,
+                             start + offset + len(sub_term), weight, nested))
+        hits.sort(key=lambda hit: hit[3])
+        return tuple(hits)
+
+    def route(self, query: str) -> list:
+        """
+        一次扫描的全部命中，按位置排序；nested 表示该词包含在同一分组更长的命中词里。
+        Every hit of one scan, in position order; `nested` marks a term found
+        inside a longer matched term of the same group.
+        """
+        return [
+            {"group": g, "name": n, "term": t, "start": s, "end": e, "weight": w, "nested": nested}
+            for g, n, t, s, e, w, nested in self._route(query.lower())
+        ]
+
+    def names(self, query: str, group: str) -> list:
+        """该分组命中的名称（去重，按首次出现）/ Distinct names hit in a group, by first mention."""
+        seen = []
+        for g, name, *_ in self._route(query.lower()):
+            if g == group and name not in seen:
+                seen.append(name)
+        return seen
+
+    def scores(self, query: str, group: str) -> dict:
+        """该分组每个名称的权重和 / Summed hit weights per name in a group."""
+        totals = {}
+        for g, name, _, _, _, weight, _ in self._route(query.lower()):
+            if g == group:
+                totals[name] = totals.get(name, 0.0) + weight
+        return totals
+
+    def terms(self, group: str, kind: str = None) -> dict:
+        return {name: list(entry["terms"]) for name, entry in self.registry[group].items()
+                if kind is None or entry.get("kind") == kind}
+
+    def entry(self, group: str, name: str) -> dict:
+        return self.registry[group][name]
+
+
+_shared_router = None
+_shared_lock = threading.Lock()
+
+
+def get_router() -> TopicRouter:
+    """进程内共享的路由器，首次使用时编译 / Process-wide router, compiled on first use."""
+    global _shared_router
+    with _shared_lock:
+        if _shared_router is None:
+            _shared_router = TopicRouter()
+        return _shared_router
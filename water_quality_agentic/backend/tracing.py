@@ -0,0 +1,67 @@
+# backend/tracing.py
+# 轻量级 tracing：记录每个阶段的耗时和 LLM token 用量
+# Lightweight tracing: per-stage wall time and LLM token usage
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 当前线程 / 上下文正在执行的 span，LLMClient 通过它上报 usage
+# Span active in the current context; LLMClient reports usage into it
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """
+    一次请求的 trace：spans 列表 + 兼容旧版的 timings 字典（秒）。
+    One request's trace: a list of span dicts plus the legacy timings dict
+    (stage -> seconds) that debug_info["timings"] exposes.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        计时一个阶段；阶段内的 LLM 调用会把 token 用量记到这个 span 上。
+        Time one stage; LLM calls made inside it add their token usage here.
+        """
+        record = {"stage": stage, "duration_ms": 0.0, "prompt_tokens": 0,
+                  "completion_tokens": 0, "llm_calls": 0, "cache_hits": 0}
+        token = _CURRENT_SPAN.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - start
+            _CURRENT_SPAN.reset(token)
+            record["duration_ms"] = round(elapsed * 1000, 2)
+            with self._lock:
+                self.spans.append(record)
+                self.timings[stage] = round(elapsed, 4)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def record_usage(usage: dict = None, cached: bool = False):
+    """
+    把一次 LLM 调用的 usage（prompt_tokens / completion_tokens）加到当前 span。
+    不在任何 span 内时忽略。
+    Add one LLM call's usage to the active span; a no-op outside spans.
+    """
+    span = _CURRENT_SPAN.get()
+    if span is None:
+        return
+    if cached:
+        span["cache_hits"] += 1
+        return
+    span["llm_calls"] += 1
+    if usage:
+        span["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        span["completion_tokens"] += int(usage.get("completion_tokens") or 0)
@@ -0,0 +1,292 @@
+# benchmarks/run_benchmarks.py
+# 离线 benchmark：FakeLLMClient 代替 Mistral，不需要网络
+# Offline benchmark suite: FakeLLMClient stands in for Mistral, no network needed
+#
+# 用法 / usage (在 water_quality_agentic/ 目录下):
+#   python -m benchmarks.run_benchmarks                   # 与 baseline.json 比较，回归时退出码为 1
+#   python -m benchmarks.run_benchmarks --update-baseline # 记录新的基线
+#
+# 测量内容 / measures:
+#   - 主题路由（一次扫描所有关键词）的单次耗时
+#   - InHouseSearchAgent.search 的单次延迟，以及索引冷构建 / 热启动时间
+#   - PlannerAgent.handle_query 在不同并发度下的延迟和吞吐
+#   - 多污染物查询：拆分成子计划并行执行 vs 整体执行
+#   - 并发 LLM 规划：逐个调用 vs 微批处理（LLM 调用次数和延迟）
+#   - local_db 日志写入（同步 vs 批量）的吞吐
+#   - 每项的峰值内存（tracemalloc）
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+QUERIES_PATH = BENCH_DIR / "queries.jsonl"
+
+# 必须在导入 backend 之前设置：日志写入临时库，关闭响应缓存和 web 证据缓存
+# （web 缓存单独测）
+# Must be set before importing backend: scratch DB, no response cache and no
+# web-evidence cache in the pipeline runs (the web cache is measured separately)
+_SCRATCH_DIR = tempfile.mkdtemp(prefix="wq_bench_")
+os.environ["WQ_DB_PATH"] = str(Path(_SCRATCH_DIR) / "bench.db")
+os.environ["WQ_CORPUS_INDEX_PATH"] = str(Path(_SCRATCH_DIR) / "corpus_index.db")
+os.environ["WQ_WEB_CACHE_PATH"] = str(Path(_SCRATCH_DIR) / "web_cache.db")
+os.environ["LLM_CACHE"] = "0"
+os.environ["WEB_CACHE"] = "0"
+
+from backend.agents.inhouse_search_agent import InHouseSearchAgent  # noqa: E402
+from backend.agents.planner_agent import PlannerAgent  # noqa: E402
+from backend.agents.rule_planner import classify, decompose  # noqa: E402
+from backend.agents.webscraper_agent import WebScraperAgent  # noqa: E402
+from backend.db import local_db  # noqa: E402
+from backend.db.web_cache import WebEvidenceCache, web_key  # noqa: E402
+from backend.llm.fake_client import FakeLLMClient  # noqa: E402
+from backend.metrics import latency_summary  # noqa: E402
+from backend.retrieval.topic_router import TopicRouter  # noqa: E402
+
+CONCURRENCY_LEVELS = (1, 4, 8)
+
+# 低于这些绝对差值的变化视为噪声 / changes smaller than these are treated as noise
+ABS_NOISE_FLOOR = {"_ms": 0.5, "_us": 5.0, "_s": 0.005, "_kb": 256.0}
+
+
+def load_queries() -> list:
+    with open(QUERIES_PATH, encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+
+def peak_memory_kb(fn) -> float:
+    """在 tracemalloc 下执行一次 fn，返回峰值内存（KB）/ Peak traced memory of one fn() run."""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+# ---------- 各项 benchmark ----------
+
+def bench_routing(queries: list, repeats: int) -> dict:
+    """不带结果缓存的主题路由单次耗时 / Per-query topic routing cost with the memo disabled."""
+    router = TopicRouter(cache_size=0)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for q in queries:
+            router.route(q)
+    return {"routing.scan_us": round((time.perf_counter() - start) / (repeats * len(queries)) * 1e6, 2)}
+
+
+def bench_inhouse_search(queries: list, repeats: int) -> dict:
+    start = time.perf_counter()
+    InHouseSearchAgent()
+    build_ms = (time.perf_counter() - start) * 1000
+    # 第二次构造复用磁盘索引，只检查文件 mtime / a second construction reuses the on-disk index
+    start = time.perf_counter()
+    agent = InHouseSearchAgent()
+    warm_start_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(repeats):
+        for q in queries:
+            t = time.perf_counter()
+            agent.search(q)
+            latencies.append((time.perf_counter() - t) * 1000)
+    summary = latency_summary(latencies)
+    return {
+        "inhouse_search.build_ms": round(build_ms, 3),
+        "inhouse_search.warm_start_ms": round(warm_start_ms, 3),
+        "inhouse_search.p50_ms": summary["p50"],
+        "inhouse_search.p95_ms": summary["p95"],
+        "inhouse_search.peak_kb": peak_memory_kb(
+            lambda: [InHouseSearchAgent().search(q) for q in queries]
+        ),
+    }
+
+
+def bench_pipeline(queries: list, latency_s: float, tokens_per_s: float) -> dict:
+    results = {}
+    for level in CONCURRENCY_LEVELS:
+        planner = PlannerAgent(
+            llm=FakeLLMClient(latency_s=latency_s, tokens_per_s=tokens_per_s), concurrent=True
+        )
+        planner.warm_up()
+
+        def timed(q):
+            t = time.perf_counter()
+            planner.handle_query(q)
+            return time.perf_counter() - t
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            latencies = list(pool.map(timed, queries))
+        wall = time.perf_counter() - start
+        summary = latency_summary(latencies)
+        results[f"pipeline.c{level}.p50_s"] = summary["p50"]
+        results[f"pipeline.c{level}.p95_s"] = summary["p95"]
+        results[f"pipeline.c{level}.queries_per_s"] = round(len(queries) / wall, 2)
+
+    planner = PlannerAgent(llm=FakeLLMClient(latency_s=0.0), concurrent=True)
+    results["pipeline.peak_kb"] = peak_memory_kb(lambda: [planner.handle_query(q) for q in queries])
+    return results
+
+
+def bench_decomposition(queries: list, latency_s: float, tokens_per_s: float) -> dict:
+    """多污染物查询的端到端延迟：整体执行 vs 拆分成子计划 / whole vs decomposed."""
+    mixed = [q for q in queries if decompose(q)]
+    results = {"decompose.queries": len(mixed)}
+    for name, enabled in (("whole", False), ("split", True)):
+        planner = PlannerAgent(llm=FakeLLMClient(latency_s=latency_s, tokens_per_s=tokens_per_s),
+                               concurrent=True, decompose=enabled)
+        planner.warm_up()
+        latencies = []
+        for q in mixed:
+            t = time.perf_counter()
+            planner.handle_query(q)
+            latencies.append(time.perf_counter() - t)
+        results[f"decompose.{name}.p50_s"] = latency_summary(latencies)["p50"]
+    return results
+
+
+def bench_plan_batching(queries: list, latency_s: float, concurrency: int = 8) -> dict:
+    """
+    所有查询都走 LLM 规划（关闭规则快速路径），concurrency 个线程并发：
+    比较逐个调用和微批处理的 LLM 调用次数与单次规划延迟。
+    Every query takes the LLM planning path at `concurrency` threads;
+    individual vs micro-batched planner calls (LLM call count and latency).
+    """
+    results = {}
+    for name, plan_batch in (("single", False), ("batched", True)):
+        llm = FakeLLMClient(latency_s=latency_s)
+        planner = PlannerAgent(llm=llm, rule_fast_path=False, plan_batch=plan_batch)
+        latencies = []
+
+        def run(q):
+            t = time.perf_counter()
+            planner._plan(q)
+            latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, queries * 2))
+        wall = time.perf_counter() - start
+        results[f"plan_batch.{name}.llm_calls"] = llm.stats()["calls"]
+        results[f"plan_batch.{name}.p50_s"] = latency_summary(latencies)["p50"]
+        results[f"plan_batch.{name}.plans_per_s"] = round(len(latencies) / wall, 2)
+    return results
+
+
+def bench_web_cache(queries: list, latency_s: float) -> dict:
+    """web_fetch 阶段：首次（未命中，调用 LLM）与再次（命中缓存）的耗时。"""
+    agent = WebScraperAgent(llm=FakeLLMClient(latency_s=latency_s),
+                            cache=WebEvidenceCache(path=":memory:"))
+    keys = [web_key(q, classify(q)) for q in queries]
+    timings = {"miss": [], "hit": []}
+    for key in keys + keys:
+        t = time.perf_counter()
+        evidence = agent.fetch_evidence(key)
+        timings[evidence["cache"]].append((time.perf_counter() - t) * 1000)
+    return {
+        "web_cache.distinct_keys": len(set(keys)),
+        "web_cache.miss_p50_ms": latency_summary(timings["miss"])["p50"],
+        "web_cache.hit_p50_ms": latency_summary(timings["hit"])["p50"],
+    }
+
+
+def bench_db_logging(events: int) -> dict:
+    local_db.init_db()
+    results = {}
+    for mode in ("sync", "batched"):
+        local_db.DB_LOG_MODE = mode
+        start = time.perf_counter()
+        for i in range(events):
+            local_db.log_query(f"benchmark query {i}", "benchmark answer " * 20)
+        enqueue_s = time.perf_counter() - start
+        local_db.flush_logs()
+        total_s = time.perf_counter() - start
+        results[f"db_logging.{mode}.call_us"] = round(enqueue_s / events * 1e6, 2)
+        results[f"db_logging.{mode}.events_per_s"] = round(events / total_s, 1)
+    results["db_logging.batched.peak_kb"] = peak_memory_kb(
+        lambda: ([local_db.log_query("q", "a") for _ in range(events)], local_db.flush_logs())
+    )
+    return results
+
+
+# ---------- 与基线比较 ----------
+
+def _higher_is_better(name: str) -> bool:
+    return name.endswith("_per_s")
+
+
+def _noise_floor(name: str) -> float:
+    for suffix, floor in ABS_NOISE_FLOOR.items():
+        if name.endswith(suffix):
+            return floor
+    return 0.0
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """返回回归项列表 / Return the list of regressed metrics."""
+    regressions = []
+    for name, base in baseline.items():
+        cur = current.get(name)
+        if cur is None or not base:
+            continue
+        if _higher_is_better(name):
+            regressed = cur < base * (1 - tolerance)
+        else:
+            regressed = cur > base * (1 + tolerance) and cur - base > _noise_floor(name)
+        if regressed:
+            regressions.append((name, base, cur))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the water-quality pipeline.")
+    parser.add_argument("--update-baseline", action="store_true", help="write results to baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown (default 0.3)")
+    parser.add_argument("--fake-latency", type=float, default=0.02, help="fake LLM round-trip seconds")
+    parser.add_argument("--fake-tokens-per-s", type=float, default=2000.0, help="fake LLM generation rate")
+    parser.add_argument("--search-repeats", type=int, default=20)
+    parser.add_argument("--db-events", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    queries = load_queries()
+    results = {}
+    results.update(bench_routing(queries, args.search_repeats))
+    results.update(bench_inhouse_search(queries, args.search_repeats))
+    results.update(bench_pipeline(queries, args.fake_latency, args.fake_tokens_per_s))
+    results.update(bench_decomposition(queries, args.fake_latency, args.fake_tokens_per_s))
+    results.update(bench_plan_batching(queries, args.fake_latency))
+    results.update(bench_web_cache(queries, args.fake_latency))
+    results.update(bench_db_logging(args.db_events))
+
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}}  {value}")
+
+    if args.update_baseline or not BASELINE_PATH.exists():
+        BASELINE_PATH.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        print(f"\nBaseline written to {BASELINE_PATH}")
+        return 0
+
+    baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\nREGRESSIONS (tolerance {args.tolerance:.0%}):")
+        for name, base, cur in regressions:
+            print(f"  {name}: baseline {base} -> current {cur}")
+        return 1
+    print(f"\nNo regressions against baseline (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
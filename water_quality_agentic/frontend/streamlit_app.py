@@ -4,8 +4,34 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import time
+
 import streamlit as st
-from backend.api_server import handle_query, submit_feedback
+
+
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    """
+    进程级单例：第一次查询时才导入后端（Agent / 语料 / LLM 客户端随之延迟初始化），
+    之后所有会话和 rerun 复用同一个实例。
+    Process-wide backend handle: imported on first use and shared across
+    sessions and reruns, so the UI renders before any backend work happens.
+    设置 WQ_API_URL 时改为通过 HTTP 调用独立的 API 服务（backend/http_server.py）。
+    With WQ_API_URL set, the backend is a separately scaled HTTP service.
+    """
+    start = time.perf_counter()
+    api_url = os.getenv("WQ_API_URL")
+    if api_url:
+        from backend.api_client import ApiClient
+        client = ApiClient(api_url)
+        client.health()
+        client.STARTUP_TIMINGS["frontend_load_s"] = round(time.perf_counter() - start, 4)
+        return client
+    from backend import api_server
+    api_server.get_planner()
+    api_server.STARTUP_TIMINGS["frontend_load_s"] = round(time.perf_counter() - start, 4)
+    return api_server
+
 
 st.set_page_config(page_title="Water Quality Agentic Demo", layout="wide")
 
@@ -24,11 +50,39 @@ query = st.text_area(
 )
 
 if st.button("Run multi-agent analysis "):
-    with st.spinner("Running planner and agents..."):
-        answer, debug_info = handle_query(query)
-    st.session_state["last_query"] = query
-    st.session_state["last_answer"] = answer
-    st.session_state["last_debug"] = debug_info
+    # 流式输出：阶段完成后先显示状态，再逐段渲染答案
+    # Streaming: show stage progress, then render the answer as tokens arrive
+    status = st.empty()
+    answer_box = st.empty()
+    status.info("Running planner and agents...")
+    answer, debug_info, parts = "", {}, []
+    from backend.budget import Overloaded
+    try:
+        for event in get_backend().handle_query_stream(query):
+            if event["event"] == "stage":
+                debug_info = event["debug"]
+                plan = debug_info.get("plan", {})
+                status.info(
+                    f"Planned (topic: {plan.get('topic')}, focus: {plan.get('focus')}) · "
+                    f"agents: {', '.join(debug_info.get('called_agents', []))} · generating answer..."
+                )
+            elif event["event"] == "token":
+                parts.append(event["text"])
+                answer_box.markdown("".join(parts) + "▌")
+            elif event["event"] == "done":
+                answer, debug_info = event["answer"], event["debug"]
+        overloaded = False
+    except Overloaded:
+        overloaded = True
+    status.empty()
+    answer_box.empty()
+    if overloaded:
+        st.warning("The backend is at capacity right now. Please try again in a moment.")
+    else:
+        st.session_state["last_query"] = query
+        st.session_state["last_answer"] = answer
+        st.session_state["last_debug"] = debug_info
+        st.session_state.pop("last_answer_zh", None)
 
 if "last_answer" in st.session_state:
     st.subheader("Answer ：")
@@ -38,6 +92,18 @@ if "last_answer" in st.session_state:
         height=320,
     )
 
+    # 两阶段摘要：英文答案先返回，中文翻译按需生成并缓存在 query_log
+    # Two-phase summary: the English answer comes first; the Chinese
+    # translation is generated on request and cached in query_log
+    if st.session_state.get("last_debug", {}).get("summary_mode") == "two_phase":
+        if st.button("Show Chinese translation / 显示中文翻译"):
+            with st.spinner("Translating..."):
+                st.session_state["last_answer_zh"] = get_backend().translate_answer(
+                    st.session_state["last_query"], st.session_state["last_answer"]
+                )
+        if st.session_state.get("last_answer_zh"):
+            st.text_area("中文翻译 ：", value=st.session_state["last_answer_zh"], height=320)
+
     # ====== 新增：调试信息展示 / Debug info ======
     st.subheader("Debug info ：")
     show_debug = st.checkbox("Show planner & agents debug ")
@@ -45,9 +111,34 @@ if "last_answer" in st.session_state:
     if show_debug and "last_debug" in st.session_state:
         debug = st.session_state["last_debug"]
 
+        if debug.get("coalesced"):
+            st.write("Shared the result of an identical in-flight query (single-flight).")
+
+        answer_cache = debug.get("answer_cache", {})
+        if answer_cache.get("hit"):
+            st.markdown("**Answer cache ：**")
+            st.write(
+                f"Served from a similar earlier question (similarity "
+                f"{answer_cache.get('similarity')}, {answer_cache.get('age_s')} s old): "
+                f"{answer_cache.get('source_query', '')}"
+            )
+
+        if debug.get("degradations"):
+            st.markdown("**Latency-budget degradations ：**")
+            st.table(debug["degradations"])
+
         st.markdown("**Planner plan ：**")
         st.json(debug.get("plan", {}))
 
+        if debug.get("decomposition"):
+            st.markdown("**Sub-plans / 子计划 ：**")
+            st.table([
+                {"pollutant": sub["label"], "topic": sub["topic"],
+                 "web": (sub.get("web_cache") or {}).get("status", "-"),
+                 "context_tokens": sub["context_tokens"], "error": sub.get("error", "")}
+                for sub in debug["decomposition"]
+            ])
+
         st.markdown("**Called agents ：**")
         st.write(", ".join(debug.get("called_agents", [])))
 
@@ -55,15 +146,44 @@ if "last_answer" in st.session_state:
         st.code(debug.get("inhouse_preview", ""), language="text")
 
         st.markdown("**Web search preview ：**")
+        web_cache = debug.get("web_cache")
+        if web_cache:
+            st.write(f"Web evidence key: {web_cache['key']} · cache {web_cache['status']}")
         st.code(debug.get("web_preview", ""), language="text")
 
+        if debug.get("measurements"):
+            st.markdown("**Guideline checks (measurement table) ：**")
+            st.table(debug["measurements"])
+
+        st.markdown("**Context packing ：**")
+        st.json(debug.get("context_packing", {}))
+
+        st.markdown("**Stage timings (s) ：**")
+        st.write(f"Execution mode: {debug.get('execution_mode', '')}")
+        st.json(debug.get("timings", {}))
+
+        st.markdown("**Stage spans (ms / tokens) ：**")
+        st.table(debug.get("spans", []))
+
+        st.markdown("**LLM response cache ：**")
+        cache_stats = debug.get("llm_cache", {})
+        st.write(f"Hits: {cache_stats.get('hits', 0)} · Misses: {cache_stats.get('misses', 0)}")
+        st.json(cache_stats)
+
+        st.markdown("**Startup timings (s) ：**")
+        st.json(debug.get("startup", {}))
+
+    # ====== 分阶段指标（历史查询）/ Pipeline metrics over logged queries ======
+    if st.checkbox("Show pipeline metrics (p50 / p95 / p99) "):
+        st.table(get_backend().get_stage_metrics())
+
     # ====== 用户反馈 ======
     st.subheader("Feedback ：")
     feedback = st.text_input("Optional feedback ")
     if st.button("Submit feedback "):
-        submit_feedback(
+        get_backend().submit_feedback(
             st.session_state["last_query"],
             st.session_state["last_answer"],
             feedback,
         )
-        st.success("Feedback recorded. ")
\ No newline at end of file
+        st.success("Feedback recorded; it will be scored in the background. ")
\ No newline at end of file
@@ -0,0 +1,26 @@
+# tests/conftest.py
+# 测试环境：所有 SQLite 文件放进临时目录，LLM 使用离线 FakeLLMClient，后台任务关闭
+# Test environment: every SQLite file lives in a temp directory, the LLM is
+# the offline FakeLLMClient and background jobs are off
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 必须在导入 backend 之前设置：各模块在导入时读取这些路径
+# Set before backend is imported: the modules read these paths at import time
+_TMP = Path(tempfile.mkdtemp(prefix="wq-tests-"))
+os.environ.update({
+    "MISTRAL_API_KEY": "test",
+    "LLM_BACKEND": "fake",
+    "LLM_CACHE": "0",
+    "WEB_PREFETCH": "0",
+    "RETENTION_JOB": "0",
+    "CORPUS_WATCH": "0",
+    "WQ_DB_PATH": str(_TMP / "reflections.db"),
+    "WQ_CORPUS_INDEX_PATH": str(_TMP / "corpus_index.db"),
+    "WQ_WEB_CACHE_PATH": str(_TMP / "web_cache.db"),
+})
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
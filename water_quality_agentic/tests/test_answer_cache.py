@@ -0,0 +1,32 @@
+# tests/test_answer_cache.py
+# 答案缓存的匹配规则 / Answer-cache match rules
+
+from backend.db.answer_cache import AnswerCache
+
+ONTARIO = "What are the nitrate concentration trends for Lake Ontario monitoring stations?"
+
+
+def _cache() -> AnswerCache:
+    cache = AnswerCache()
+    cache.add(ONTARIO, "ONTARIO ANSWER", need_web=False)
+    return cache
+
+
+def test_rephrased_query_hits():
+    hit = _cache().lookup("Nitrate concentration trends for Lake Ontario monitoring stations?")
+    assert hit is not None and hit["answer"] == "ONTARIO ANSWER"
+
+
+def test_different_region_misses():
+    cache = _cache()
+    assert cache.lookup(ONTARIO.replace("Lake Ontario", "Lake Erie")) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_region_is_part_of_fingerprint():
+    assert AnswerCache.fingerprint(ONTARIO)["region"] == "lake_ontario"
+    assert AnswerCache.fingerprint(ONTARIO.replace("Lake Ontario", "Lake Erie"))["region"] == "lake_erie"
+
+
+def test_different_pollutant_misses():
+    assert _cache().lookup(ONTARIO.replace("nitrate", "phosphorus")) is None
@@ -0,0 +1,82 @@
+# tests/test_budget.py
+# 准入控制：并发上限、排队上限、排队超时，异常退出时释放槽位
+# Admission control: concurrency cap, queue bound, queue timeout and slot
+# release on errors
+
+import threading
+import time
+
+import pytest
+
+from backend.budget import AdmissionController, Overloaded
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_queue_full_and_queue_timeout():
+    admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout_s=0.2)
+    release = threading.Event()
+    errors = []
+
+    def hold():
+        with admission.admit():
+            release.wait()
+
+    def queue_up():
+        try:
+            with admission.admit():
+                pass
+        except Overloaded as exc:
+            errors.append(exc)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    _wait_for(lambda: admission.stats()["running"] == 1)
+    waiter = threading.Thread(target=queue_up)
+    waiter.start()
+    _wait_for(lambda: admission.stats()["waiting"] == 1)
+    with pytest.raises(Overloaded):
+        with admission.admit():
+            pass
+    waiter.join()
+    release.set()
+    holder.join()
+    assert len(errors) == 1
+    stats = admission.stats()
+    assert (stats["rejected_full"], stats["rejected_timeout"]) == (1, 1)
+    assert (stats["running"], stats["waiting"]) == (0, 0)
+
+
+def test_queued_request_runs_when_a_slot_frees():
+    admission = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout_s=2.0)
+    release = threading.Event()
+    queued = []
+
+    def hold():
+        with admission.admit():
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    _wait_for(lambda: admission.stats()["running"] == 1)
+    threading.Timer(0.1, release.set).start()
+    with admission.admit() as queued_s:
+        queued.append(queued_s)
+    holder.join()
+    assert queued[0] >= 0.05
+    assert admission.stats()["admitted"] == 2
+
+
+def test_slot_released_when_the_body_raises():
+    admission = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout_s=0.1)
+    with pytest.raises(ValueError):
+        with admission.admit():
+            raise ValueError("pipeline failed")
+    with admission.admit():
+        assert admission.stats()["running"] == 1
+    assert admission.stats()["running"] == 0
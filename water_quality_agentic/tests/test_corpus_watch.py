@@ -0,0 +1,74 @@
+# tests/test_corpus_watch.py
+# 语料检查在后台执行：查询路径只读索引，一个进程 sync，其它进程只 refresh
+# Corpus checks run off the query path: search only reads the index, one
+# process syncs and the others refresh from the shared file
+
+import time
+
+import pytest
+
+from backend.agents.inhouse_search_agent import CorpusWatcher, InHouseSearchAgent
+from backend.retrieval.corpus_index import CorpusIndex
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    (corpus_dir / "lake.txt").write_text(
+        "Lake monitoring\n\nTurbidity in the harbour stayed low through the summer.\n",
+        encoding="utf-8",
+    )
+    return corpus_dir, tmp_path / "index.db"
+
+
+def _agent(corpus) -> InHouseSearchAgent:
+    corpus_dir, path = corpus
+    return InHouseSearchAgent(index=CorpusIndex(corpus_dir=corpus_dir, path=path), language="en")
+
+
+def _add_file(corpus):
+    (corpus[0] / "well.txt").write_text(
+        "Well survey\n\nManganese was detected in several farm wells.\n", encoding="utf-8"
+    )
+
+
+def _docs_found(agent, query):
+    return {p["doc"] for p in agent.search_passages(query)}
+
+
+def test_search_never_syncs(corpus, monkeypatch):
+    agent = _agent(corpus)
+    _add_file(corpus)
+    # 上次 sync 已经很久，旧实现会在这次查询里重新扫描
+    # The last sync is long past, which used to trigger a rescan inside the query
+    agent.index.last_sync = 0.0
+    monkeypatch.setattr(agent.index, "sync", lambda: pytest.fail("sync on the query path"))
+    monkeypatch.setattr(agent.index, "refresh", lambda: pytest.fail("refresh on the query path"))
+    assert "well" not in _docs_found(agent, "manganese wells")
+
+
+def test_one_process_syncs_the_other_refreshes(corpus):
+    writer, reader = _agent(corpus), _agent(corpus)
+    _add_file(corpus)
+    assert reader.check_corpus(sync=False) is False
+    assert writer.check_corpus(sync=True) is True
+    assert writer.last_sync["added"] == 1
+    assert reader.check_corpus(sync=False) is True
+    assert "well" in _docs_found(reader, "manganese wells")
+    assert reader.check_corpus(sync=False) is False
+
+
+def test_watcher_waits_interval_then_syncs(corpus):
+    agent = _agent(corpus)
+    _add_file(corpus)
+    watcher = CorpusWatcher(agent, interval_s=0.3)
+    watcher.start()
+    time.sleep(0.1)
+    assert watcher.counters["runs"] == 0
+    deadline = time.monotonic() + 5
+    while watcher.counters["changed"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    watcher.stop()
+    assert watcher.counters["changed"] == 1 and watcher.counters["errors"] == 0
+    assert "well" in _docs_found(agent, "manganese wells")
@@ -0,0 +1,100 @@
+# tests/test_http_server.py
+# SingleFlight：同一 key 的并发请求只执行一次并共享结果，执行结束后 key 被忘掉
+# SingleFlight: concurrent calls for one key run once and share the result;
+# the key is forgotten once the execution finishes
+
+import threading
+import time
+
+import pytest
+
+from backend.http_server import SingleFlight, flight_key
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert predicate()
+
+
+def test_concurrent_calls_coalesce():
+    flights = SingleFlight()
+    gate = threading.Event()
+    calls = []
+
+    def work(query):
+        calls.append(query)
+        gate.wait()
+        return f"answer to {query}"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", work, "q")))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    _wait_for(lambda: flights.counters["coalesced"] == 4)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == ["q"]
+    assert sorted(coalesced for _, coalesced in results) == [False] + [True] * 4
+    assert {answer for answer, _ in results} == {"answer to q"}
+
+    # 执行已结束：下一个调用重新执行 / finished, so the next call runs again
+    _wait_for(lambda: flights.stats()["in_flight"] == 0)
+    assert flights.do("k", work, "q") == ("answer to q", False)
+    assert len(calls) == 2
+
+
+def test_error_reaches_every_waiter():
+    flights = SingleFlight()
+    gate = threading.Event()
+
+    def fail():
+        gate.wait()
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("k", fail)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    _wait_for(lambda: flights.counters["coalesced"] == 2)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3 and flights.counters["executions"] == 1
+
+
+def test_stream_subscribers_replay_every_event():
+    flights = SingleFlight()
+    gate = threading.Event()
+
+    def events():
+        yield {"event": "token", "text": "a"}
+        gate.wait()
+        yield {"event": "token", "text": "b"}
+        raise RuntimeError("boom")
+
+    first, coalesced = flights.stream("k", events)
+    assert coalesced is False
+    assert next(first) == {"event": "token", "text": "a"}
+    late, coalesced = flights.stream("k", events)
+    assert coalesced is True
+    gate.set()
+    expected = [{"event": "token", "text": "a"}, {"event": "token", "text": "b"},
+                {"event": "error", "message": "RuntimeError: boom", "status": 500}]
+    assert list(late) == expected
+    assert list(first) == expected[1:]
+
+
+@pytest.mark.parametrize("query", ["lead in  Lake Ontario", " lead in Lake\tOntario "])
+def test_flight_key_ignores_whitespace(query):
+    assert flight_key(query) == "lead in Lake Ontario"
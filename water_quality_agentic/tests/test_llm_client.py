@@ -0,0 +1,158 @@
+# tests/test_llm_client.py
+# LLMClient 对本地 stub server：429 / 5xx 重试退避、单次超时与截止时间、在途并发上限、限流等待
+# LLMClient against the local stub server: 429/5xx retries with backoff,
+# per-call timeouts and deadlines, the in-flight cap and the rate limiter
+
+import threading
+import time
+
+import pytest
+
+from backend.db.response_cache import ResponseCache
+from backend.llm.client import (
+    DeadlineExceeded, LLMClient, LLMError, TokenBucket, call_deadline,
+)
+from backend.llm.stub_server import StubLLMServer
+
+MESSAGES = [{"role": "user", "content": "phosphorus in Lake Ontario"}]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs) -> StubLLMServer:
+        servers.append(StubLLMServer(**kwargs).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _client(server: StubLLMServer, **kwargs) -> LLMClient:
+    options = dict(rate_per_second=1000.0, burst=100, backoff_base_s=0.01, backoff_max_s=0.05)
+    options.update(kwargs)
+    return LLMClient(api_key="test", server_url=server.url,
+                     cache=ResponseCache(path=":memory:", enabled=False), **options)
+
+
+# ---------- 重试 / retries ----------
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_status_is_retried(stub, status):
+    server = stub(fail_first=2, fail_status=status)
+    client = _client(server)
+    assert client.complete("planner", MESSAGES).startswith("STUB RESPONSE: phosphorus")
+    assert server.requests_seen == 3
+    assert client.stats()["retries"] == 2 and client.stats()["failures"] == 0
+
+
+def test_retries_exhausted(stub):
+    server = stub(fail_first=10, fail_status=503)
+    client = _client(server, max_retries=2)
+    with pytest.raises(LLMError) as err:
+        client.complete("planner", MESSAGES)
+    assert err.value.status_code == 503
+    assert server.requests_seen == 3
+
+
+def test_client_error_is_not_retried(stub):
+    server = stub(fail_first=1, fail_status=400)
+    client = _client(server)
+    with pytest.raises(LLMError) as err:
+        client.complete("planner", MESSAGES)
+    assert err.value.status_code == 400
+    assert server.requests_seen == 1
+
+
+def test_backoff_is_jittered_exponential_and_honours_retry_after():
+    client = LLMClient(api_key="test", backoff_base_s=0.1, backoff_max_s=1.0,
+                       cache=ResponseCache(path=":memory:", enabled=False))
+    for attempt in range(6):
+        cap = min(1.0, 0.1 * 2 ** attempt)
+        assert all(0 <= client._backoff(attempt) <= cap for _ in range(50))
+    assert client._backoff(0, "0.3") == 0.3
+    assert client._backoff(0, "30") == 1.0
+
+
+# ---------- 超时 / timeouts ----------
+
+def test_per_call_timeout(stub):
+    server = stub(latency_s=0.5)
+    client = _client(server, timeout_s=0.1, max_retries=0)
+    start = time.monotonic()
+    with pytest.raises(LLMError):
+        client.complete("planner", MESSAGES)
+    assert time.monotonic() - start < 0.4
+
+
+def test_call_deadline_caps_timeout_and_retries(stub):
+    server = stub(latency_s=0.5)
+    client = _client(server, timeout_s=60.0, max_retries=4)
+    start = time.monotonic()
+    with call_deadline(0.2), pytest.raises(LLMError):
+        client.complete("planner", MESSAGES)
+    assert time.monotonic() - start < 0.45
+    assert server.requests_seen == 1
+
+
+def test_rate_limiter_wait_respects_deadline(stub):
+    server = stub()
+    client = _client(server, rate_per_second=1.0, burst=1)
+    client.complete("planner", MESSAGES)
+    start = time.monotonic()
+    with call_deadline(0.2), pytest.raises(DeadlineExceeded):
+        client.complete("planner", MESSAGES)
+    # 等不到令牌时立即失败，不会先睡满截止时间 / fails at once instead of sleeping out the deadline
+    assert time.monotonic() - start < 0.1
+    assert server.requests_seen == 1
+
+
+def test_token_bucket_timeout_keeps_the_token():
+    bucket = TokenBucket(rate=10.0, capacity=1)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire(timeout=0.01) is None
+    assert 0.0 < bucket.acquire(timeout=0.5) <= 0.15
+
+
+# ---------- 在途并发上限 / in-flight cap ----------
+
+def test_in_flight_semaphore_limits_concurrency(stub):
+    state = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def responder(payload):
+        with lock:
+            state["now"] += 1
+            state["peak"] = max(state["peak"], state["now"])
+        time.sleep(0.05)
+        with lock:
+            state["now"] -= 1
+        return "ok"
+
+    server = stub(responder=responder)
+    client = _client(server, max_in_flight=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.complete("planner", MESSAGES)))
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["ok"] * 6
+    assert state["peak"] == 2
+
+
+def test_in_flight_wait_respects_deadline(stub):
+    server = stub(latency_s=0.5)
+    client = _client(server, max_in_flight=1)
+    busy = threading.Thread(target=client.complete, args=("planner", MESSAGES))
+    busy.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    with call_deadline(0.1), pytest.raises(DeadlineExceeded):
+        client.complete("planner", [{"role": "user", "content": "second"}])
+    assert time.monotonic() - start < 0.3
+    busy.join()
+    assert server.requests_seen == 1
@@ -0,0 +1,126 @@
+# tests/test_log_writer.py
+# 后台批量写入器：flush / close 语义与出错的事件
+# Batched log writer: flush / close semantics and failing events
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from backend.db.log_writer import BatchLogWriter
+
+INSERT = "INSERT INTO events (value) VALUES (?);"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "log.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, value TEXT);")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _values(path) -> list:
+    conn = sqlite3.connect(path)
+    rows = [row[0] for row in conn.execute("SELECT value FROM events ORDER BY id;")]
+    conn.close()
+    return rows
+
+
+def test_flush_commits_queued_events(db_path):
+    writer = BatchLogWriter(db_path, flush_interval_s=10)
+    writer.submit(INSERT, ("a",))
+    writer.submit(INSERT, ("b",))
+    assert writer.flush() is True
+    assert _values(db_path) == ["a", "b"]
+    writer.close()
+
+
+def test_flush_is_not_extended_by_later_writes(db_path):
+    writer = BatchLogWriter(db_path, batch_size=4, flush_interval_s=0.01)
+    stop = threading.Event()
+
+    def slow(conn, value):
+        time.sleep(0.005)
+        conn.execute(INSERT, (value,))
+
+    def produce():
+        while not stop.is_set():
+            writer.submit(slow, ("x",))
+            time.sleep(0.001)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    try:
+        time.sleep(0.05)
+        start = time.monotonic()
+        assert writer.flush(timeout=10) is True
+        # 之前排队的事件有限，之后的写入不应让 flush 一直等下去
+        assert time.monotonic() - start < 5
+    finally:
+        stop.set()
+        producer.join()
+    writer.close()
+
+
+def test_flush_times_out(db_path):
+    writer = BatchLogWriter(db_path, flush_interval_s=0.01)
+    writer.submit(lambda conn: time.sleep(0.5))
+    assert writer.flush(timeout=0.05) is False
+    assert writer.stats()["flush_timeouts"] == 1
+    assert writer.flush(timeout=5) is True
+    writer.close()
+
+
+def test_failing_event_is_rolled_back_alone(db_path):
+    writer = BatchLogWriter(db_path)
+
+    def half_then_fail(conn):
+        conn.execute(INSERT, ("partial",))
+        raise TypeError("boom")
+
+    writer.submit(INSERT, ("before",))
+    writer.submit(half_then_fail)
+    writer.submit(INSERT, ("after",))
+    writer.flush()
+    assert _values(db_path) == ["before", "after"]
+    assert writer.stats()["errors"] == 1
+    writer.submit(INSERT, ("still alive",))
+    writer.flush()
+    assert _values(db_path)[-1] == "still alive"
+    writer.close()
+
+
+def test_submit_after_close_raises_and_flush_returns(db_path):
+    writer = BatchLogWriter(db_path)
+    writer.submit(INSERT, ("last",))
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(INSERT, ("late",))
+    assert writer.flush(timeout=1) is True
+    assert _values(db_path) == ["last"]
+
+
+def test_concurrent_close_never_loses_accepted_events(db_path):
+    writer = BatchLogWriter(db_path, flush_interval_s=0.01)
+    accepted = []
+
+    def produce(n):
+        for i in range(200):
+            try:
+                writer.submit(INSERT, (f"{n}-{i}",))
+            except RuntimeError:
+                return
+            accepted.append(f"{n}-{i}")
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.005)
+    writer.close()
+    for thread in threads:
+        thread.join()
+    assert sorted(_values(db_path)) == sorted(accepted)
@@ -0,0 +1,85 @@
+# tests/test_plan_batcher.py
+# 规划微批处理：同一窗口的请求合并成一次调用，缺失 / 失败时单独规划，超时的请求被丢弃
+# Planner micro-batching: one call per window, per-request fallback, and
+# timed-out requests are dropped
+
+import threading
+import time
+
+import pytest
+
+from backend.agents.plan_batcher import PlanBatcher
+
+
+class FakePlanner:
+    def __init__(self, skip=(), fail=False, gate=None):
+        self.batches, self.singles = [], []
+        self.skip, self.fail, self.gate = skip, fail, gate
+
+    def plan_batch(self, items):
+        self.batches.append([query for _, query in items])
+        if self.fail:
+            raise ValueError("not a JSON array")
+        return {request_id: {"query": query} for request_id, query in items
+                if query not in self.skip}
+
+    def plan_one(self, query):
+        if self.gate is not None:
+            self.gate.wait()
+        self.singles.append(query)
+        return {"query": query, "single": True}
+
+
+def _plan_concurrently(batcher, queries):
+    results = {}
+    threads = [threading.Thread(target=lambda q=q: results.update({q: batcher.plan(q, timeout=5)}))
+               for q in queries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_requests_in_one_window_share_one_call():
+    planner = FakePlanner()
+    batcher = PlanBatcher(planner.plan_batch, planner.plan_one, window_s=0.1)
+    results = _plan_concurrently(batcher, ["a", "b", "c", "d"])
+    assert sorted(map(sorted, planner.batches)) == [["a", "b", "c", "d"]]
+    assert all(results[q] == {"query": q, "batch_size": 4} for q in "abcd")
+    assert batcher.stats()["llm_calls"] == 1
+
+
+def test_missing_or_failed_batch_falls_back_to_single_plans():
+    planner = FakePlanner(skip={"b"})
+    batcher = PlanBatcher(planner.plan_batch, planner.plan_one, window_s=0.1)
+    results = _plan_concurrently(batcher, ["a", "b"])
+    assert results["b"] == {"query": "b", "single": True}
+    assert planner.singles == ["b"] and batcher.stats()["fallbacks"] == 1
+
+    planner = FakePlanner(fail=True)
+    batcher = PlanBatcher(planner.plan_batch, planner.plan_one, window_s=0.1)
+    results = _plan_concurrently(batcher, ["a", "b"])
+    assert all(results[q]["single"] for q in "ab")
+    assert batcher.stats()["batch_errors"] == 1
+
+
+def test_timeout_raises_and_drops_undispatched_request():
+    planner = FakePlanner()
+    batcher = PlanBatcher(planner.plan_batch, planner.plan_one, window_s=0.3)
+    with pytest.raises(TimeoutError):
+        batcher.plan("late", timeout=0.05)
+    time.sleep(0.5)
+    assert planner.singles == [] and planner.batches == []
+    assert batcher.stats()["timeouts"] == 1
+
+
+def test_timeout_while_planning_returns_to_caller():
+    gate = threading.Event()
+    planner = FakePlanner(gate=gate)
+    batcher = PlanBatcher(planner.plan_batch, planner.plan_one, window_s=0.0)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        batcher.plan("slow", timeout=0.1)
+    assert time.monotonic() - start < 0.5
+    gate.set()
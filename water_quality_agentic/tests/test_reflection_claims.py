@@ -0,0 +1,75 @@
+# tests/test_reflection_claims.py
+# 反馈认领：每行只被一个 worker 认领，租约过期后可重新认领
+# Reflection claims: each row goes to one worker, expired leases are reclaimed
+
+import sqlite3
+import threading
+
+import pytest
+
+from backend.db import local_db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """独立的空库，写入走同步模式 / An empty database of its own, written synchronously."""
+    local_db.flush_logs()
+    monkeypatch.setattr(local_db, "DB_PATH", tmp_path / "reflections.db")
+    monkeypatch.setattr(local_db, "DB_LOG_MODE", "sync")
+    local_db.init_db()
+    return tmp_path / "reflections.db"
+
+
+def _enqueue(n):
+    for i in range(n):
+        local_db.enqueue_reflection(f"query {i}", f"answer {i}", "helpful")
+
+
+def test_claims_do_not_overlap(fresh_db):
+    _enqueue(5)
+    first = local_db.claim_reflections(3)
+    assert [row[1] for row in first] == ["query 0", "query 1", "query 2"]
+    assert first[0][2] == "answer 0"
+    second = local_db.claim_reflections(3)
+    assert [row[1] for row in second] == ["query 3", "query 4"]
+    assert local_db.claim_reflections(3) == []
+    assert local_db.reflection_status_counts() == {"scoring": 5}
+
+
+def test_concurrent_claimers_score_each_row_once(fresh_db):
+    _enqueue(40)
+    claimed = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            rows = local_db.claim_reflections(3)
+            if not rows:
+                return
+            with lock:
+                claimed.extend(row[0] for row in rows)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(set(claimed)) and len(claimed) == 40
+
+
+def test_expired_lease_is_claimed_again(fresh_db):
+    _enqueue(2)
+    rows = local_db.claim_reflections(2)
+    conn = sqlite3.connect(fresh_db)
+    conn.execute("UPDATE reflection_log SET claimed_at = datetime('now', '-20 minutes') "
+                 "WHERE id = ?;", (rows[0][0],))
+    conn.commit()
+    conn.close()
+    assert local_db.claim_reflections(5, lease_s=600) == [rows[0]]
+
+    local_db.save_reflection_scores([
+        {"id": row_id, "score": 4, "notes": "", "evaluator": "rule", "status": "scored"}
+        for row_id, *_ in rows
+    ])
+    assert local_db.reflection_status_counts() == {"scored": 2}
+    assert local_db.claim_reflections(5, lease_s=0) == []
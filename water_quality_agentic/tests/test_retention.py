@@ -0,0 +1,97 @@
+# tests/test_retention.py
+# 保留期清理：旧库（auto_vacuum=0）上后台清理不做完整 VACUUM、不切换模式，转换只能显式执行
+# Retention: on an older database (auto_vacuum=0) compaction never runs a full
+# VACUUM or switches modes; the conversion is an explicit step
+
+import gzip
+import json
+import sqlite3
+import time
+
+import pytest
+
+from backend.db import local_db, retention
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """
+    auto_vacuum=0 建好的旧库，含 200 行两年前的查询日志；写入走同步模式直接落到该文件。
+    An auto_vacuum=0 database holding 200 two-year-old query rows; writes go
+    through sync mode so they land in this file rather than the shared writer's.
+    """
+    path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum=NONE;")
+    conn.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY);")
+    conn.commit()
+    conn.close()
+    local_db.flush_logs()
+    monkeypatch.setattr(local_db, "DB_PATH", path)
+    monkeypatch.setattr(local_db, "DB_LOG_MODE", "sync")
+    local_db.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO query_log (query, created_at) VALUES (?, datetime('now', '-730 days'));",
+        [("old query %d %s" % (i, "x" * 2000),) for i in range(200)],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _pragma(path, name):
+    conn = sqlite3.connect(path)
+    (value,) = conn.execute(f"PRAGMA {name};").fetchone()
+    conn.close()
+    return value
+
+
+def test_compact_on_legacy_db_skips_vacuum(legacy_db, tmp_path):
+    assert _pragma(legacy_db, "auto_vacuum") == 0
+    report = retention.compact(retention_days=90, archive_dir=tmp_path / "archive")
+    assert report["archived"]["query_log"] == 200
+    assert report["vacuum"]["action"] == "skipped"
+    # 模式没变，删掉的行留在空闲页里（完整 VACUUM 会把它们清空）
+    # Mode unchanged and the deleted rows' pages are still free (a full VACUUM would drop them)
+    assert _pragma(legacy_db, "auto_vacuum") == 0
+    assert _pragma(legacy_db, "freelist_count") > 0
+    rows = []
+    for path in (tmp_path / "archive").glob("query_log-*.jsonl.gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            rows.extend(json.loads(line) for line in fh)
+    assert len(rows) == 200
+
+
+def test_explicit_conversion_then_incremental_reclaim(legacy_db, tmp_path):
+    retention.compact(retention_days=90, archive_dir=tmp_path / "archive")
+    assert retention.main(["--enable-incremental-vacuum"]) == 0
+    assert _pragma(legacy_db, "auto_vacuum") == 2
+    assert local_db.enable_incremental_vacuum()["action"] == "none"
+
+    conn = sqlite3.connect(legacy_db)
+    conn.executemany("INSERT INTO query_log (query) VALUES (?);", [("y" * 2000,)] * 100)
+    conn.commit()
+    conn.execute("DELETE FROM query_log;")
+    conn.commit()
+    conn.close()
+    assert _pragma(legacy_db, "freelist_count") > 10
+    report = local_db.reclaim_space(max_pages=10)
+    assert report["action"] == "incremental_vacuum"
+    assert report["freed_pages"] == 10 and report["free_pages"] > 0
+    assert local_db.reclaim_space()["free_pages"] == 0
+
+
+def test_job_waits_interval_before_first_run(legacy_db, tmp_path):
+    job = retention.RetentionJob(retention_days=90, archive_dir=tmp_path / "archive",
+                                 interval_s=0.3)
+    job.start()
+    time.sleep(0.1)
+    assert job.counters["runs"] == 0
+    deadline = time.monotonic() + 5
+    while job.counters["runs"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    job.stop()
+    assert job.counters["runs"] >= 1 and job.counters["errors"] == 0
+    assert job.last_report["archived"]["query_log"] == 200
+    assert _pragma(legacy_db, "auto_vacuum") == 0
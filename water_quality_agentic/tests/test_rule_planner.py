@@ -0,0 +1,68 @@
+# tests/test_rule_planner.py
+# 规则规划器：拆分子查询与关键词误命中 / Rule planner: decomposition and keyword false positives
+
+import pytest
+
+from backend.agents.rule_planner import classify, decompose, key_terms
+from backend.retrieval.topic_router import get_router
+
+
+def _parts(query: str) -> list:
+    return [(part["label"], part["query"]) for part in decompose(query)]
+
+
+def test_decompose_rewrites_each_pollutant():
+    assert _parts("What are nitrate and cadmium levels in Lake Ontario in 2025?") == [
+        ("nitrate", "What are nitrate levels in Lake Ontario in 2025?"),
+        ("cadmium", "What are cadmium levels in Lake Ontario in 2025?"),
+    ]
+
+
+def test_decompose_chinese():
+    assert _parts("安大略湖的硝酸盐和镉是否超标？") == [
+        ("nitrate", "安大略湖的硝酸盐是否超标？"),
+        ("cadmium", "安大略湖的镉是否超标？"),
+    ]
+
+
+@pytest.mark.parametrize("query", [
+    "Does nitrate runoff lead to algal blooms in Lake Erie?",
+    "Can high phosphorus levels lead to fish kills?",
+    "Which factors lead into nitrate spikes in spring?",
+])
+def test_verb_lead_is_not_a_pollutant(query):
+    assert decompose(query) == []
+    assert "heavy_metals" not in classify(query)["topic_hits"]
+    assert "lead" not in key_terms(query)
+
+
+def test_noun_lead_is_still_a_pollutant():
+    assert get_router().names("Are lead levels in tap water rising?", "parameter") == ["lead"]
+    assert [label for label, _ in _parts("Is there lead in my tap water and nitrate in the well?")] \
+        == ["lead", "nitrate"]
+
+
+def test_decompose_only_for_mixed_topics():
+    # 同一 topic 的两个参数不拆 / two parameters of one topic stay one plan
+    assert classify("Compare cadmium and mercury levels")["topic"] == "heavy_metals"
+    assert decompose("Compare cadmium and mercury levels") == []
+    assert decompose("What are nitrate levels in Lake Ontario?") == []
+
+
+@pytest.mark.parametrize("query", [
+    "How do phosphorus and nitrate affect lakes as well as rivers?",
+    "Is nitrate a concern in Lake Erie as well?",
+    "农村饮用水中的硝酸盐",
+])
+def test_no_groundwater_false_positive(query):
+    assert "groundwater" not in classify(query)["topic_scores"]
+
+
+@pytest.mark.parametrize("query", [
+    "What are the health risks of arsenic in rural well water?",
+    "Is my private well safe to drink?",
+    "Latest groundwater quality concerns for rural wells",
+    "农村水井的砷含量",
+])
+def test_groundwater_terms(query):
+    assert "groundwater" in classify(query)["topic_scores"]